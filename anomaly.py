@@ -0,0 +1,192 @@
+import argparse
+import math
+import sqlite3
+
+import numpy as np
+
+from database import ensure_schema
+
+# Streaming anomaly detection on RPM and PTO, fed by the ingest path: every decoded sample updates a small
+# per-vehicle state (anomaly_state: time-decayed EWMA mean/variance, a rate-of-change reference sample, a
+# hunting score and the PTO state), so each sample costs O(1) and history is never rescanned.
+# Samples that break a rule become alert events; events of one vehicle and kind at most ALERT_GAP_MS apart
+# are merged into one row of anomaly_alerts (start, end, samples, peak), like fault episodes. Alerts keep
+# history after retention prunes raw rows; `python anomaly.py rebuild` recomputes them from the signal tables.
+
+EWMA_TAU_SEC = 60 # Time constant of the RPM mean/variance (weights decay by e every 60 s, whatever the sample rate)
+WARMUP_SAMPLES = 30 # Samples before the variance is trusted for spike detection
+SPIKE_Z = 4.0 # RPM spike: deviation from the EWMA mean in standard deviations
+MIN_STD_RPM = 25.0 # Standard deviation floor, so a steady engine doesn't turn every small change into a spike
+OVERREV_RPM = 3000.0 # Over-rev threshold
+RATE_WINDOW_MS = 1000 # Rate of change is measured over at least this long (EEC1 repeats values between updates)
+MAX_RATE_RPM_S = 400.0 # Rapid RPM change
+HUNT_MIN_RATE_RPM_S = 100.0 # Swings at least this fast count towards hunting
+HUNT_TAU_SEC = 10 # Decay of the hunting score (direction reversals)
+HUNT_REVERSALS = 4.0 # Hunting: this many recent reversals of a significant RPM swing
+PTO_MAX_RPM = 1500.0 # RPM expected below this while the PTO is engaged...
+PTO_GRACE_MS = 60_000 # ...once it has been engaged this long (the engine settles after engagement)
+ALERT_GAP_MS = 5000 # Alert events at most this far apart belong to the same alert
+
+# Alert kinds: label and unit of the peak value
+ALERT_KINDS = {
+    "overrev": ("Over-rev", "rpm"),
+    "rpm_spike": ("RPM spike", "sigma"),
+    "rapid_change": ("Rapid RPM change", "rpm/s"),
+    "hunting": ("RPM hunting", "reversals"),
+    "pto_high_rpm": ("High RPM with PTO engaged", "rpm"),
+}
+
+STATE_COLUMNS = ["rpm_ts", "samples", "mean", "var", "ref_ts", "ref_rpm", "direction", "hunt", "hunt_ts", "pto_on", "pto_since"]
+INITIAL_STATE = [None, 0, 0.0, 0.0, None, None, 0, 0.0, None, 0, None]
+
+# Run the detector over one vehicle's samples in time order; state is a list in STATE_COLUMNS order, updated
+# in place. samples: (timestamp, is_rpm, value) with value = RPM or PTO on (0/1). Appends (kind, timestamp, peak)
+# events to events. Samples older than the vehicle's last RPM sample are skipped (late API writes).
+def detect(state, samples, events):
+    rpm_ts, n, mean, var, ref_ts, ref_rpm, direction, hunt, hunt_ts, pto_on, pto_since = state
+    exp, sqrt = math.exp, math.sqrt
+    for ts, is_rpm, x in samples:
+        if rpm_ts is not None and ts < rpm_ts:
+            continue
+        if not is_rpm:
+            if x and not pto_on:
+                pto_since = ts
+            pto_on = int(x)
+            continue
+
+        # Time-decayed EWMA mean and variance (incremental form; alpha from the gap to the previous sample)
+        if n == 0:
+            mean, var = x, 0.0
+        else:
+            diff = x - mean
+            if n >= WARMUP_SAMPLES:
+                z = abs(diff) / max(sqrt(var), MIN_STD_RPM)
+                if z > SPIKE_Z:
+                    events.append(("rpm_spike", ts, z))
+            alpha = 1.0 - exp((rpm_ts - ts) / (EWMA_TAU_SEC * 1000))
+            increment = alpha * diff
+            mean += increment
+            var = (1.0 - alpha) * (var + diff * increment)
+        n += 1
+        rpm_ts = ts
+
+        if x > OVERREV_RPM:
+            events.append(("overrev", ts, x))
+
+        # Rate of change against a reference sample at least RATE_WINDOW_MS old; significant swings that
+        # reverse direction add to a decaying hunting score
+        if ref_ts is None:
+            ref_ts, ref_rpm = ts, x
+        elif ts - ref_ts >= RATE_WINDOW_MS:
+            rate = (x - ref_rpm) * 1000 / (ts - ref_ts)
+            ref_ts, ref_rpm = ts, x
+            if abs(rate) > MAX_RATE_RPM_S:
+                events.append(("rapid_change", ts, abs(rate)))
+            if abs(rate) >= HUNT_MIN_RATE_RPM_S:
+                sign = 1 if rate > 0 else -1
+                hunt = hunt * exp((hunt_ts - ts) / (HUNT_TAU_SEC * 1000)) if hunt_ts is not None else 0.0
+                hunt_ts = ts
+                if direction and sign != direction:
+                    hunt += 1.0
+                    if hunt >= HUNT_REVERSALS:
+                        events.append(("hunting", ts, hunt))
+                direction = sign
+
+        if pto_on and x > PTO_MAX_RPM and ts - pto_since >= PTO_GRACE_MS:
+            events.append(("pto_high_rpm", ts, x))
+
+    state[:] = [rpm_ts, n, mean, var, ref_ts, ref_rpm, direction, hunt, hunt_ts, pto_on, pto_since]
+
+# Merge alert events into anomaly_alerts: each vehicle/kind run of events at most ALERT_GAP_MS apart extends
+# the stored alert it is within ALERT_GAP_MS of, otherwise starts a new one; caller commits
+def write_alerts(conn, vehicle_id, events):
+    events.sort()
+    run = None # [kind, start, end, samples, peak]
+    runs = []
+    for kind, ts, peak in events:
+        if run and run[0] == kind and ts - run[2] <= ALERT_GAP_MS:
+            run[2], run[3], run[4] = ts, run[3] + 1, max(run[4], peak)
+        else:
+            run = [kind, ts, ts, 1, peak]
+            runs.append(run)
+
+    for kind, start, end, count, peak in runs:
+        alert = conn.execute('''
+            SELECT id FROM anomaly_alerts
+            WHERE vehicle_id IS ? AND kind = ? AND end_ts >= ? AND start_ts <= ?
+            ORDER BY end_ts DESC LIMIT 1
+        ''', (vehicle_id, kind, start - ALERT_GAP_MS, end + ALERT_GAP_MS)).fetchone()
+        if alert:
+            conn.execute('''
+                UPDATE anomaly_alerts SET start_ts = MIN(start_ts, ?), end_ts = MAX(end_ts, ?), samples = samples + ?, peak = MAX(peak, ?)
+                WHERE id = ?
+            ''', (start, end, count, peak, alert[0]))
+        else:
+            conn.execute("INSERT INTO anomaly_alerts (vehicle_id, kind, start_ts, end_ts, samples, peak) VALUES (?, ?, ?, ?, ?, ?)",
+                         (vehicle_id, kind, start, end, count, peak))
+
+# Feed a batch of decoded RPM samples (epoch-ms timestamps, vehicle ids, RPM) and PTO samples (timestamps,
+# vehicle ids, 0/1) through the per-vehicle detectors; caller commits. Returns the number of alert events.
+def update_anomalies(conn, rpm_timestamps, rpm_vehicle_ids, rpm, pto_timestamps, pto_vehicle_ids, pto_on):
+    n_rpm, n_pto = len(rpm_timestamps), len(pto_timestamps)
+    if n_rpm + n_pto == 0:
+        return 0
+    timestamps = np.concatenate([np.asarray(rpm_timestamps, dtype=np.int64), np.asarray(pto_timestamps, dtype=np.int64)])
+    keys = np.array([v or 0 for v in (*rpm_vehicle_ids, *pto_vehicle_ids)], dtype=np.int64) # 0 = no vehicle id
+    values = np.concatenate([np.asarray(rpm, dtype=np.float64), np.asarray(pto_on, dtype=np.float64)])
+    is_rpm = np.arange(n_rpm + n_pto) < n_rpm
+
+    # Per vehicle in time order; at equal timestamps the PTO state is applied before the RPM sample
+    order = np.lexsort((is_rpm, timestamps, keys))
+    keys, samples = keys[order], list(zip(timestamps[order].tolist(), is_rpm[order].tolist(), values[order].tolist()))
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    starts, stops = [0, *bounds.tolist()], [*bounds.tolist(), len(keys)]
+    vehicles = keys[starts].tolist()
+
+    placeholders = ", ".join("?" * len(vehicles))
+    stored = {row[0]: list(row[1:]) for row in conn.execute(
+        f"SELECT vehicle_key, {', '.join(STATE_COLUMNS)} FROM anomaly_state WHERE vehicle_key IN ({placeholders})", vehicles)}
+
+    total = 0
+    for vehicle, start, stop in zip(vehicles, starts, stops):
+        state = stored.get(vehicle) or list(INITIAL_STATE)
+        events = []
+        detect(state, samples[start:stop], events)
+        stored[vehicle] = state
+        if events:
+            write_alerts(conn, vehicle or None, events)
+            total += len(events)
+
+    conn.executemany(f"INSERT OR REPLACE INTO anomaly_state (vehicle_key, {', '.join(STATE_COLUMNS)}) VALUES ({', '.join('?' * (len(STATE_COLUMNS) + 1))})",
+                     [(vehicle, *stored[vehicle]) for vehicle in vehicles])
+    return total
+
+# Recompute anomaly_alerts and anomaly_state from rpm_samples and pto_samples, in raw_id windows; caller commits
+def rebuild_anomalies(conn, batch_size=100000):
+    conn.execute("DELETE FROM anomaly_alerts")
+    conn.execute("DELETE FROM anomaly_state")
+    last = max(conn.execute("SELECT MAX(raw_id) FROM rpm_samples").fetchone()[0] or 0,
+               conn.execute("SELECT MAX(raw_id) FROM pto_samples").fetchone()[0] or 0)
+    for first in range(0, last, batch_size):
+        window = (first, first + batch_size)
+        rpm_rows = conn.execute("SELECT timestamp, vehicle_id, rpm FROM rpm_samples WHERE raw_id > ? AND raw_id <= ? ORDER BY raw_id", window).fetchall()
+        pto_rows = conn.execute("SELECT timestamp, vehicle_id, pto_on FROM pto_samples WHERE raw_id > ? AND raw_id <= ? ORDER BY raw_id", window).fetchall()
+        rpm_columns = list(zip(*rpm_rows)) or [(), (), ()]
+        pto_columns = list(zip(*pto_rows)) or [(), (), ()]
+        update_anomalies(conn, *rpm_columns, *pto_columns)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming RPM/PTO anomaly detection tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recompute anomaly_alerts from the rpm_samples and pto_samples tables")
+    rebuild_parser.add_argument("db_path", nargs="?", default="db/telemetry.db", help="SQLite database path")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        conn = sqlite3.connect(args.db_path)
+        ensure_schema(conn)
+        rebuild_anomalies(conn)
+        conn.commit()
+        counts = conn.execute("SELECT kind, COUNT(*) FROM anomaly_alerts GROUP BY kind ORDER BY kind").fetchall()
+        conn.close()
+        print(f"Rebuilt anomaly_alerts: {', '.join(f'{kind} {count:,}' for kind, count in counts) or 'no alerts'}")
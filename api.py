@@ -1,69 +1,383 @@
-from flask import Flask, request, jsonify
-import sqlite3
+from flask import Flask, Response, request, jsonify, g
+import argparse
+import json
+import time
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timezone
+
+from analyze import get_rpm_stats, get_pto_stats, read_signal_range, read_sql, get_fault_episodes, get_mtbf, get_fault_frequency, get_anomaly_alerts
+from anomaly import ALERT_KINDS
+from archive import default_root, reaches
+from downsample import downsample
+from formats import FORMATS, negotiate, encode, cursor_chunks, frame_chunks
+from decode import load_signals, stored_signals
+from ingest import ingest_frames, redecode
+from database import (
+    pool,
+    to_epoch_ms,
+    parse_can_id,
+    pack_payload,
+    convert_rows_checked
+)
+from metrics import (
+    REGISTRY,
+    CONTENT_TYPE,
+    DB_QUERY_SECONDS,
+    ROWS_SCANNED,
+    SERIALIZE_SECONDS,
+    COMMIT_SECONDS,
+    SlowProfile,
+    db_size_gauge,
+    timed_iter
+)
 
 app = Flask(__name__) # Flask app instance
 DB_PATH = "db/telemetry.db" # Path to SQLite database file
+MAX_BATCH_FRAMES = 100000 # Largest batch accepted by POST /api/telemetry/batch
+PROFILE_SLOW_MS = None # Dump a cProfile of requests slower than this many ms (None = off; python api.py --profile-slow-ms)
+PROFILE_DIR = "db/profiles" # Where slow request profiles are written
+
+REQUEST_SECONDS = REGISTRY.histogram("telemetry_http_request_seconds", "API request latency, including streamed bodies", ["method", "route", "status"])
+db_size_gauge(lambda: DB_PATH)
+
+# Columns of each series in the NDJSON/CSV/Arrow/Parquet formats: (name, kind) as in formats.py
+RPM_COLUMNS = [("id", "int"), ("timestamp", "timestamp"), ("rpm", "float")]
+PTO_COLUMNS = [("id", "int"), ("timestamp", "timestamp"), ("pto_on", "bool")]
+FAULT_COLUMNS = [("timestamp", "timestamp"), ("spn", "int"), ("fmi", "int")]
 
 # Root API route
 @app.route("/", methods=["GET"])
 def home():
     return jsonify({
         "message": "Vehicle Telemetry Data Analyzer API",
+        "formats": "GET data routes return JSON, or NDJSON/CSV/Arrow/Parquet via the Accept header or ?format=json|ndjson|csv|arrow|parquet",
         "endpoints": {
-            "GET /api/rpm": "Get RPM telemetry data",
-            "GET /api/pto": "Get PTO telemetry data",
-            "GET /api/faults": "Get fault data",
+            "GET /api/rpm": "Get RPM telemetry data (optional ?start=&end=&limit=&cursor= and ?points=N&method=lttb|minmax)",
+            "GET /api/pto": "Get PTO telemetry data (optional ?start=&end=&limit=&cursor= and ?points=N&method=lttb|minmax)",
+            "GET /api/rpm/stats": "Get RPM min/max/avg from the rollup tables (optional ?start=&end= ISO 8601)",
+            "GET /api/pto/stats": "Get PTO usage from the rollup tables (optional ?start=&end= ISO 8601)",
+            "GET /api/faults": "Get fault data (optional ?start=&end=&limit=&cursor=)",
+            "GET /api/faults/episodes": "Get fault episodes: repeated SPN/FMI frames collapsed into start/end/duration/count (optional ?start=&end=)",
+            "GET /api/faults/stats": "Get fault episode counts by severity, MTBF and the most frequent faults (optional ?start=&end=)",
+            "GET /api/alerts": "Get RPM/PTO anomaly alerts from the streaming detector (optional ?start=&end=&kind=)",
+            "GET /api/signals": "List the J1939 signal definitions",
+            "GET /api/signals/<name>": "Get stored values of a decoded signal (optional ?start=&end=&limit=)",
             "POST /api/telemetry": "Add new telemetry data",
+            "POST /api/telemetry/batch": "Add many telemetry frames (JSON array or NDJSON body) in one transaction",
             "PATCH /api/telemetry/<id>": "Update telemetry data",
-            "DELETE /api/telemetry/<id>": "Delete telemetry data"
+            "DELETE /api/telemetry/<id>": "Delete telemetry data",
+            "GET /metrics": "Latency histograms, rows scanned/decoded, ingest and commit metrics in Prometheus text format"
         }
     }), 200
 
-# Database connection function
+# Database connection function: the request thread's pooled WAL connection (don't close it)
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return pool.get(DB_PATH)
+
+# Roll back anything a failed request left uncommitted so the pooled connection stays usable
+@app.teardown_request
+def end_transaction(exc):
+    pool.rollback(DB_PATH)
+
+# Start timing each request, and profiling it when PROFILE_SLOW_MS is set
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.profile = None
+    if PROFILE_SLOW_MS is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        name = f"{request.method}{route.replace('/', '_').replace('<', '').replace('>', '')}"
+        g.profile = SlowProfile(PROFILE_DIR, PROFILE_SLOW_MS / 1000, name).__enter__()
+
+# Record the request latency once the response body has been sent (streamed bodies are generated after the view returns)
+@app.after_request
+def record_request_metrics(response):
+    start, profile = g.request_start, g.pop("profile", None)
+    labels = {"method": request.method, "route": request.url_rule.rule if request.url_rule else "unmatched",
+              "status": response.status_code}
+
+    def done():
+        if profile is not None:
+            profile.__exit__(None, None, None)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+    response.call_on_close(done)
+    return response
+
+# Stop the profiler of a request that failed before after_request ran
+@app.teardown_request
+def stop_profile(exc):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.__exit__(None, None, None)
+
+# Optional ?points=N&method=lttb|minmax downsampling for time series routes
+def downsample_args(default_method):
+    points = request.args.get("points", type=int)
+    method = request.args.get("method", default_method)
+    if points is not None and points < 3:
+        raise ValueError("points must be at least 3")
+    if method not in ("lttb", "minmax"):
+        raise ValueError("method must be 'lttb' or 'minmax'")
+    return points, method
+
+# Optional ?start=&end= time range (ISO 8601, end exclusive) as epoch ms; a missing start means from the beginning
+def range_args():
+    start, end = request.args.get("start"), request.args.get("end")
+    return (to_epoch_ms(start) if start else 0), (to_epoch_ms(end) if end else None)
+
+# Opaque page cursor "<timestamp ms>:<id>" of the last row returned
+def parse_cursor(cursor):
+    timestamp, _, row_id = cursor.partition(":")
+    try:
+        return int(timestamp), int(row_id)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+# Parse ?start=&end= (ISO 8601, end exclusive), ?cursor= (keyset pagination) and ?limit=N
+# Returns (start ms, end ms, (timestamp, id) after the cursor, limit), each None when not given
+def window_bounds():
+    start, end = request.args.get("start"), request.args.get("end")
+    limit, cursor = request.args.get("limit"), request.args.get("cursor")
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+    return (to_epoch_ms(start) if start else None), (to_epoch_ms(end) if end else None), \
+        (parse_cursor(cursor) if cursor else None), limit
+
+# The request window as a WHERE clause on a signal table's timestamp index; returns (where sql, params, limit or None)
+def window_args():
+    start, end, after, limit = window_bounds()
+    where, params = [], []
+    if start is not None:
+        where.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("timestamp < ?")
+        params.append(end)
+    if after is not None:
+        where.append("timestamp >= ? AND (timestamp > ? OR raw_id > ?)") # Rows after (timestamp, id)
+        params += [after[0], after[0], after[1]]
+    return (" WHERE " + " AND ".join(where) if where else ""), params, limit
+
+# True if the request window reaches into the Parquet archive (rows are then read from both stores)
+def window_in_archive():
+    start, _, after, _ = window_bounds()
+    return reaches(default_root(DB_PATH), max(start or 0, after[0] if after else 0) or None)
+
+# SELECT over a window in (timestamp, id) order
+def window_sql(table, select, where, limit, offset=0):
+    sql = f"SELECT {select} FROM {table}{where} ORDER BY timestamp, raw_id"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+    return sql
+
+# Read a signal table window into a DataFrame with id, timestamp (epoch ms) and the columns
+# Returns (DataFrame, next cursor or None on the last page)
+def read_window(table, columns):
+    if window_in_archive():
+        start, end, after, limit = window_bounds()
+        df = read_signal_range(DB_PATH, table, columns, start, end, after, limit)
+    else:
+        where, params, limit = window_args()
+        conn = get_db_connection()
+        df = read_sql(conn, window_sql(table, f"raw_id AS id, timestamp, {', '.join(columns)}", where, limit), table, params)
+    next_cursor = None
+    if limit is not None and len(df) == limit: # A full page: there may be more rows
+        next_cursor = f"{df['timestamp'].iloc[-1]}:{df['id'].iloc[-1]}"
+    return df, next_cursor
+
+# Cursor after the last row of a full page, looked up on the covering timestamp index (None on the last page)
+def next_page_cursor(conn, table, where, params, limit):
+    if limit is None:
+        return None
+    row = conn.execute(window_sql(table, "timestamp, raw_id", where, 1, offset=limit - 1), params).fetchone()
+    return f"{row[0]}:{row[1]}" if row else None
+
+# Response format from ?format= or the Accept header (JSON by default)
+def response_format():
+    return negotiate(request.args.get("format"), request.accept_mimetypes)
+
+# Column chunks from an executed cursor, with the read time and row count recorded for the table
+def timed_chunks(cursor, columns, table):
+    for chunk in timed_iter(cursor_chunks(cursor, columns), DB_QUERY_SECONDS, source="sqlite", table=table):
+        ROWS_SCANNED.inc(len(chunk[columns[0][0]]), source="sqlite", table=table)
+        yield chunk
+
+# Stream a signal table window in a non-JSON format straight from the SQLite cursor, chunk by chunk
+# (windows that reach the Parquet archive are read into one frame first); columns: list of (name, kind) as in formats.py
+def stream_window(fmt, table, columns):
+    if window_in_archive():
+        df, next_cursor = read_window(table, [name for name, _ in columns if name not in ("id", "timestamp")])
+        return body_response(encode(fmt, frame_chunks(df, columns), columns), fmt, next_cursor)
+    where, params, limit = window_args()
+    conn = get_db_connection()
+    next_cursor = next_page_cursor(conn, table, where, params, limit)
+    select = ", ".join("raw_id AS id" if name == "id" else name for name, _ in columns)
+    cursor = conn.execute(window_sql(table, select, where, limit), params)
+
+    def generate():
+        try:
+            yield from encode(fmt, timed_chunks(cursor, columns, table), columns)
+        finally:
+            cursor.close()
+    return body_response(generate(), fmt, next_cursor)
+
+# Streamed body in the given format with the next page's cursor in the X-Next-Cursor header
+# (encoding time is recorded as the body is generated; for cursor streams it includes the cursor reads)
+def body_response(body, fmt, next_cursor):
+    response = Response(timed_iter(body, SERIALIZE_SECONDS, format=fmt), mimetype=FORMATS[fmt])
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+# JSON list response with the next page's cursor in the X-Next-Cursor header
+def page_response(records, next_cursor):
+    with SERIALIZE_SECONDS.time(format="json"):
+        response = jsonify(records)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+# Convert request fields to the stored column types (epoch ms, integer CAN ID, payload BLOB)
+def to_db_values(fields):
+    converters = {"timestamp": to_epoch_ms, "can_id": parse_can_id, "data": pack_payload}
+    return {name: converters[name](value) for name, value in fields.items()}
 
 # Route to get RPM telemetry data
 @app.route("/api/rpm", methods=["GET"])
 def get_rpm_data():
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT id, timestamp, data FROM telemetry WHERE can_id='0x0CF00400'", conn) # Fetch RPM data based on CAN ID
-    conn.close()
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['rpm'] = df['data'].apply(lambda d: int(d[:4], 16) / 4) # Convert hex data to RPM
-    return jsonify(df.to_dict(orient="records"))
+    try:
+        fmt = response_format()
+        points, method = downsample_args("lttb")
+        if fmt != "json" and points is None:
+            return stream_window(fmt, "rpm_samples", RPM_COLUMNS)
+        df, next_cursor = read_window("rpm_samples", ["rpm"]) # Fetch RPM decoded at ingest
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    df = downsample(df, "rpm", points, method)
+    if fmt != "json":
+        return body_response(encode(fmt, frame_chunks(df, RPM_COLUMNS), RPM_COLUMNS), fmt, next_cursor)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True)
+    return page_response(df.to_dict(orient="records"), next_cursor)
+
+# Route to get RPM stats for a time range, read from the rollup tables
+@app.route("/api/rpm/stats", methods=["GET"])
+def get_rpm_range_stats():
+    try:
+        start, end = range_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    return jsonify(get_rpm_stats(DB_PATH, start, end))
 
 # Route to get PTO telemetry data
 @app.route("/api/pto", methods=["GET"])
 def get_pto_data():
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT id, timestamp, data FROM telemetry WHERE can_id='0x18FEF100'", conn) # Fetch PTO data based on CAN ID
-    conn.close()
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df['pto_on'] = df['data'].apply(lambda d: d[:2] == "01") # Convert hex data to PTO status
-    return jsonify(df.to_dict(orient="records"))
+    try:
+        fmt = response_format()
+        points, method = downsample_args("minmax")
+        if fmt != "json" and points is None:
+            return stream_window(fmt, "pto_samples", PTO_COLUMNS)
+        df, next_cursor = read_window("pto_samples", ["pto_on"]) # Fetch PTO status decoded at ingest
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    df = downsample(df, "pto_on", points, method)
+    if fmt != "json":
+        return body_response(encode(fmt, frame_chunks(df, PTO_COLUMNS), PTO_COLUMNS), fmt, next_cursor)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True)
+    df['pto_on'] = df['pto_on'].astype(bool)
+    return page_response(df.to_dict(orient="records"), next_cursor)
+
+# Route to get PTO stats for a time range, read from the rollup tables
+@app.route("/api/pto/stats", methods=["GET"])
+def get_pto_range_stats():
+    try:
+        start, end = range_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    return jsonify(get_pto_stats(DB_PATH, start, end))
 
 # Route to get fault telemetry data
 @app.route("/api/faults", methods=["GET"])
 def get_fault_data():
-    def decode_fault(hex_str):
-        try:
-            spn = int(hex_str[:4], 16) # First 4 hex chars to SPN
-            fmi = int(hex_str[4:6], 16) # Next 2 hex chars to FMI
-            return spn, fmi
-        except:
-            return None, None
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("SELECT timestamp, data FROM telemetry WHERE can_id='0x0CFE6CEE'", conn) # Fetch fault data based on CAN ID
-    conn.close()
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df[['spn', 'fmi']] = df['data'].apply(lambda d: pd.Series(decode_fault(d))) 
-    df = df.dropna()
-    return jsonify(df[['timestamp', 'spn', 'fmi']].to_dict(orient="records"))
+    try:
+        fmt = response_format()
+        if fmt != "json":
+            return stream_window(fmt, "fault_events", FAULT_COLUMNS)
+        df, next_cursor = read_window("fault_events", ["spn", "fmi"]) # Fetch fault codes decoded at ingest
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True)
+    return page_response(df[['timestamp', 'spn', 'fmi']].to_dict(orient="records"), next_cursor)
+
+# Route to get fault episodes overlapping an optional ?start=&end= range
+@app.route("/api/faults/episodes", methods=["GET"])
+def get_fault_episode_data():
+    try:
+        start, end = range_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    df = get_fault_episodes(DB_PATH, start=start, end=end)
+    return jsonify(df.astype(object).where(df.notna(), None).to_dict(orient="records"))
+
+# Route to get fault stats over the episodes in an optional ?start=&end= range
+@app.route("/api/faults/stats", methods=["GET"])
+def get_fault_episode_stats():
+    try:
+        start, end = range_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    df = get_fault_episodes(DB_PATH, start=start, end=end)
+    frequency = get_fault_frequency(df) if not df.empty else pd.DataFrame(columns=["wrapped_description", "severity", "count"])
+    return jsonify({
+        "episodes": len(df),
+        "severity_counts": {k: int(v) for k, v in df["severity"].value_counts().items() if v > 0},
+        "mtbf_sec": get_mtbf(df),
+        "top_faults": [{"description": d.replace("\n", " "), "severity": sev, "episodes": int(c)}
+                       for d, sev, c in frequency[["wrapped_description", "severity", "count"]].itertuples(index=False)],
+    })
+
+# Route to get anomaly alerts (over-rev, RPM spike, rapid change, hunting, high RPM with PTO engaged)
+# overlapping an optional ?start=&end= range, optionally only ?kind=
+@app.route("/api/alerts", methods=["GET"])
+def get_alerts():
+    kind = request.args.get("kind")
+    if kind is not None and kind not in ALERT_KINDS:
+        return jsonify({"error": f"kind must be one of {', '.join(ALERT_KINDS)}"}), 400 # Error return
+    try:
+        start, end = range_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    df = get_anomaly_alerts(DB_PATH, start, end, kind)
+    return jsonify(df.astype(object).where(df.notna(), None).to_dict(orient="records"))
+
+# Route to list the J1939 signal definitions (data/j1939_signals.csv)
+@app.route("/api/signals", methods=["GET"])
+def get_signals():
+    return jsonify([
+        {"signal": s.name, "pgn": s.pgn, "pgn_name": decoder.name, "spn": s.spn, "unit": s.unit, "stored": s.store}
+        for decoder in load_signals().values() for s in decoder.signals
+    ])
+
+# Route to get the stored values of one signal (store=1 in the definitions), optional ?start=&end=&limit=
+@app.route("/api/signals/<name>", methods=["GET"])
+def get_signal_values(name):
+    if name not in stored_signals(load_signals()):
+        return jsonify({"error": f"No stored signal named {name!r}"}), 404 # Error return
+    try:
+        start, end = range_args()
+        limit = request.args.get("limit", type=int)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400 # Error return
+    sql = "SELECT timestamp, vehicle_id, instance, value FROM signal_values WHERE signal = ? AND timestamp >= ?"
+    params = [name, start]
+    if end is not None:
+        sql += " AND timestamp < ?"
+        params.append(end)
+    sql += " ORDER BY timestamp, raw_id, instance" + (f" LIMIT {max(limit, 0)}" if limit is not None else "")
+    df = read_sql(get_db_connection(), sql, "signal_values", params) # Uses the (signal, timestamp) index
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True)
+    return jsonify(df.to_dict(orient="records"))
 
 # Route to post new telemetry data
 @app.route("/api/telemetry", methods=["POST"])
@@ -76,18 +390,76 @@ def add_telemetry():
     if not all([timestamp, can_id, hex_data]):
         return jsonify({"error": "timestamp, can_id, and data are required"}), 400 # Error return
 
+    try:
+        values = to_db_values({"timestamp": timestamp, "can_id": can_id, "data": hex_data})
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid telemetry record: {e}"}), 400 # Error return
+
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO telemetry (timestamp, can_id, data) VALUES (?, ?, ?)",
-        (timestamp, can_id, hex_data) # Insert telemetry data into the database
-    )
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
+    new_id, = ingest_frames(conn, [(values["timestamp"], values["can_id"], values["data"], None)], source="api") # Insert and decode telemetry data
+    with COMMIT_SECONDS.time(source="api"):
+        conn.commit()
 
     return jsonify({"message": "Telemetry record added", "id": new_id}), 201
 
+# Parse a batch body (JSON array, or NDJSON with one frame object per line) into a list of items;
+# lines that aren't valid JSON become error strings so they can be reported per item
+def parse_batch_body():
+    body = request.get_data(as_text=True)
+    if request.mimetype != "application/x-ndjson" and body.lstrip().startswith("["):
+        return json.loads(body)
+    items = []
+    for line in body.splitlines():
+        if line.strip():
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(f"Invalid JSON: {e}")
+    return items
+
+# Route to post a batch of telemetry frames: valid frames are inserted in one transaction,
+# invalid ones are reported per item (ids[i] is the new id of item i, or null if it was rejected)
+@app.route("/api/telemetry/batch", methods=["POST"])
+def add_telemetry_batch():
+    try:
+        items = parse_batch_body()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid JSON body: {e}"}), 400 # Error return
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Body must be a non-empty JSON array or NDJSON of telemetry frames"}), 400 # Error return
+    if len(items) > MAX_BATCH_FRAMES:
+        return jsonify({"error": f"Batch larger than {MAX_BATCH_FRAMES} frames"}), 413 # Error return
+
+    now = int(datetime.now(timezone.utc).timestamp() * 1000)
+    rows, errors = [], {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[i] = item if isinstance(item, str) else "Frame must be a JSON object"
+        elif item.get("can_id") in (None, "") or item.get("data") in (None, ""):
+            errors[i] = "can_id and data are required"
+        else:
+            rows.append((i, (item.get("timestamp", now), item["can_id"], item["data"], item.get("vehicle_id"))))
+
+    frames, positions, bad = convert_rows_checked(row for _, row in rows) # Bulk timestamp/CAN ID/payload validation
+    for position, message in bad:
+        errors[rows[position][0]] = f"Invalid telemetry record: {message}"
+
+    ids = [None] * len(items)
+    if frames:
+        conn = get_db_connection()
+        new_ids = ingest_frames(conn, frames, source="api") # Insert and decode the whole batch in one transaction
+        with COMMIT_SECONDS.time(source="api"):
+            conn.commit()
+        for position, new_id in zip(positions, new_ids):
+            ids[rows[position][0]] = new_id
+
+    return jsonify({
+        "inserted": len(frames),
+        "rejected": len(errors),
+        "ids": ids,
+        "errors": [{"index": i, "error": errors[i]} for i in sorted(errors)]
+    }), 201 if frames else 400
+
 # Route to patch telemetry data
 @app.route("/api/telemetry/<int:record_id>", methods=["PATCH"])
 def update_telemetry(record_id):
@@ -95,11 +467,15 @@ def update_telemetry(record_id):
     fields = []
     values = []
 
+    try:
+        updates = to_db_values({f: data[f] for f in ["timestamp", "can_id", "data"] if f in data})
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid telemetry record: {e}"}), 400 # Error return
+
     # Append data in desired field
-    for field in ["timestamp", "can_id", "data"]:
-        if field in data:
-            fields.append(f"{field} = ?")
-            values.append(data[field])
+    for field, value in updates.items():
+        fields.append(f"{field} = ?")
+        values.append(value)
 
     if not fields:
         return jsonify({"error": "No valid fields to update"}), 400 # Error return
@@ -108,8 +484,8 @@ def update_telemetry(record_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(f"UPDATE telemetry SET {', '.join(fields)} WHERE id = ?", values) # Update telemetry data in the database
+    redecode(conn, [record_id]) # Keep the decoded signal tables in sync
     conn.commit()
-    conn.close()
     
     return jsonify({"message": f"Telemetry record {record_id} updated"}), 200
 
@@ -119,11 +495,21 @@ def update_telemetry(record_id):
 def delete_telemetry(record_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM telemetry WHERE id = ?", (record_id,)) # Delete telemetry data from the database
+    cursor.execute("DELETE FROM telemetry WHERE id = ?", (record_id,)) # Delete telemetry data (trigger removes decoded rows)
     conn.commit()
-    conn.close()
 
     return jsonify({"message": f"Telemetry record {record_id} deleted"}), 200
 
+# Route to get the process metrics in Prometheus text format
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telemetry REST API (Flask development server)")
+    parser.add_argument("--profile-slow-ms", type=float, default=None, help="Write a cProfile dump of every request slower than this many ms")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="Directory for slow request profiles")
+    args = parser.parse_args()
+
+    PROFILE_SLOW_MS, PROFILE_DIR = args.profile_slow_ms, args.profile_dir
     app.run(debug=True)
@@ -0,0 +1,243 @@
+import argparse
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from database import connect
+from decode import load_signals, pgn_of
+from retention import can_ids
+
+# Cold archive for months of history: aged telemetry is moved out of SQLite into Parquet files
+# partitioned by UTC day and CAN ID, next to the database:
+#   db/telemetry_archive/date=2025-01-01/can_id=0CF00400/part-<first id>-<last id>.parquet
+# Each file holds the raw frames plus the values decoded at ingest, sorted by timestamp, so a range query
+# opens only the day/CAN ID partitions it needs, reads only the requested columns and skips row groups by
+# their timestamp statistics. Archived frames leave the SQLite signal tables (telemetry_delete_decoded
+# trigger); the rollup tables keep their history.
+# Every archive run adds a part file per day and CAN ID (once a minute from the simulator's retention), so
+# runs also compact: a closed day is merged into one compact-<first id>-<last id>.parquet per CAN ID, and the
+# open day's part files are merged into one compact file whenever MAX_OPEN_PARTS of them accumulate.
+
+# Archived columns: (name, SQL expression, pandas dtype); decoded columns are NULL for other PGNs
+COLUMNS = [
+    ("id", "t.id", "int64"),
+    ("timestamp", "t.timestamp", "int64"),
+    ("vehicle_id", "t.vehicle_id", "Int64"),
+    ("data", "t.data", "object"),
+    ("rpm", "r.rpm", "float64"),
+    ("pto_on", "p.pto_on", "Int64"),
+    ("spn", "f.spn", "Int64"),
+    ("fmi", "f.fmi", "Int64"),
+]
+
+# Signal tables readable from the archive: the signal whose PGN selects the CAN ID partitions, and the
+# decoded columns that are set for the table's rows
+TABLES = {
+    "rpm_samples": ("engine_speed", ["rpm"]),
+    "pto_samples": ("pto_state", ["pto_on"]),
+    "fault_events": ("dtc_spn", ["spn", "fmi"]),
+}
+
+DAY_MS = 86_400_000
+ROW_GROUP_ROWS = 65536 # Row group size: the unit skipped by timestamp statistics
+MAX_OPEN_PARTS = 32 # Part files per CAN ID of the day still being archived before they are merged
+
+# Archive directory used for a database file (db/telemetry.db -> db/telemetry_archive)
+def default_root(db_path):
+    return os.path.splitext(db_path)[0] + "_archive"
+
+def day_of(timestamp_ms):
+    return datetime.fromtimestamp(timestamp_ms // DAY_MS * DAY_MS / 1000, timezone.utc).strftime("%Y-%m-%d")
+
+# Archived days in order (names of the date=YYYY-MM-DD partition directories)
+def days(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(name[5:] for name in os.listdir(root) if name.startswith("date="))
+
+# True if the archive may hold rows at or after start_ms (None = from the beginning)
+def reaches(root, start_ms=None):
+    archived = days(root)
+    return bool(archived) and (start_ms is None or day_of(start_ms) <= archived[-1])
+
+# Write one day/CAN ID slice as a new part file; returns (temporary path, final path) for the caller to publish
+def _write_part(pq, pa, root, can_id, day, df, prefix="part"):
+    directory = os.path.join(root, f"date={day}", f"can_id={can_id:08X}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{prefix}-{df['id'].min():012d}-{df['id'].max():012d}.parquet")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    pq.write_table(table, path + ".tmp", row_group_size=ROW_GROUP_ROWS, compression="zstd")
+    return path + ".tmp", path
+
+# Move telemetry rows older than before_ms to the archive, batch by batch per CAN ID; returns frames archived.
+# Each batch's files are published and its rows deleted in one step per commit, so an interrupted run loses
+# nothing; a crash between rename and commit can leave rows in both stores, which readers de-duplicate by id.
+def archive(conn, root, before_ms, batch_size=500000):
+    import pyarrow as pa # Only needed for the archive
+    import pyarrow.parquet as pq
+
+    select = ", ".join(f"{expr} AS {name}" for name, expr, _ in COLUMNS)
+    moved = 0
+    touched = {day_of(before_ms - DAY_MS)} # The day before the cutoff's may have closed since the last run
+    for can_id in can_ids(conn):
+        last = (-1, -1) # Keyset position (timestamp, id) within this CAN ID
+        while True:
+            rows = conn.execute(f'''
+                SELECT {select} FROM telemetry t
+                LEFT JOIN rpm_samples r ON r.raw_id = t.id
+                LEFT JOIN pto_samples p ON p.raw_id = t.id
+                LEFT JOIN fault_events f ON f.raw_id = t.id
+                WHERE t.can_id = ? AND t.timestamp < ? AND (t.timestamp, t.id) > (?, ?)
+                ORDER BY t.timestamp, t.id LIMIT ?
+            ''', (can_id, before_ms, *last, batch_size)).fetchall()
+            if not rows:
+                break
+            df = pd.DataFrame(rows, columns=[name for name, _, _ in COLUMNS])
+            df = df.astype({name: dtype for name, _, dtype in COLUMNS})
+            df["data"] = df["data"].map(bytes)
+            buckets = df["timestamp"].to_numpy() // DAY_MS
+            parts = [_write_part(pq, pa, root, can_id, day_of(int(bucket) * DAY_MS), df[buckets == bucket])
+                     for bucket in np.unique(buckets)]
+            touched.update(day_of(int(bucket) * DAY_MS) for bucket in np.unique(buckets))
+
+            first_ts, first_id = last
+            last = (rows[-1][1], rows[-1][0])
+            conn.execute("DELETE FROM telemetry WHERE can_id = ? AND timestamp < ? AND (timestamp, id) > (?, ?) AND (timestamp, id) <= (?, ?)",
+                         (can_id, before_ms, first_ts, first_id, *last))
+            for temporary, final in parts:
+                os.replace(temporary, final)
+            conn.commit()
+            moved += len(rows)
+    compact(root, day_of(before_ms), touched)
+    return moved
+
+# Merge the part files of each CAN ID partition of the given days (None = every archived day): days before
+# open_day into one file, the open day's part files once MAX_OPEN_PARTS accumulate. Returns files removed.
+# The merged file is published before the inputs are removed; a crash in between leaves rows in two files,
+# which readers de-duplicate by id.
+def compact(root, open_day, only_days=None):
+    import pyarrow as pa # Only needed for the archive
+    import pyarrow.parquet as pq
+
+    removed = 0
+    for day in days(root):
+        if only_days is not None and day not in only_days:
+            continue
+        day_dir = os.path.join(root, f"date={day}")
+        for name in sorted(os.listdir(day_dir)):
+            if not name.startswith("can_id="):
+                continue
+            directory = os.path.join(day_dir, name)
+            files = sorted(f for f in os.listdir(directory) if f.endswith(".parquet"))
+            if day < open_day:
+                merge = files if len(files) > 1 else []
+            else:
+                merge = [f for f in files if f.startswith("part-")]
+                merge = merge if len(merge) >= MAX_OPEN_PARTS else []
+            if not merge:
+                continue
+            df = pd.concat([pq.read_table(os.path.join(directory, f)).to_pandas() for f in merge], ignore_index=True)
+            df = df.drop_duplicates("id").sort_values(["timestamp", "id"], ignore_index=True)
+            temporary, final = _write_part(pq, pa, root, int(name[7:], 16), day, df, prefix="compact")
+            os.replace(temporary, final)
+            for f in merge:
+                if os.path.join(directory, f) != final:
+                    os.remove(os.path.join(directory, f))
+                    removed += 1
+    return removed
+
+# Part files that can hold rows of the given CAN ID PGNs in [start_ms, end_ms) (partition pruning on the paths)
+def partitions(root, pgns, start_ms=None, end_ms=None):
+    first = day_of(start_ms) if start_ms is not None else None
+    last = day_of(end_ms - 1) if end_ms is not None else None
+    paths = []
+    for day in days(root):
+        if (first and day < first) or (last and day > last):
+            continue
+        day_dir = os.path.join(root, f"date={day}")
+        for name in sorted(os.listdir(day_dir)):
+            if name.startswith("can_id=") and int(pgn_of([int(name[7:], 16)])[0]) in pgns:
+                part_dir = os.path.join(day_dir, name)
+                paths += [os.path.join(part_dir, f) for f in sorted(os.listdir(part_dir)) if f.endswith(".parquet")]
+    return paths
+
+# Row groups of the part files that can hold rows in [start_ms, end_ms), as (min timestamp, ParquetFile, index)
+# in min timestamp order (every file is sorted by timestamp)
+def _row_groups(pq, paths, start_ms, end_ms):
+    groups = []
+    for path in paths:
+        part = pq.ParquetFile(path)
+        column = part.schema_arrow.get_field_index("timestamp")
+        for i in range(part.metadata.num_row_groups):
+            stats = part.metadata.row_group(i).column(column).statistics
+            low, high = (stats.min, stats.max) if stats is not None and stats.has_min_max else (None, None)
+            if low is not None and ((start_ms is not None and high < start_ms) or (end_ms is not None and low >= end_ms)):
+                continue
+            groups.append((low if low is not None else -1, part, i))
+    groups.sort(key=lambda group: group[0])
+    return groups
+
+# Archived rows of a signal table in [start_ms, end_ms) with id, timestamp and the requested columns
+# (the table's decoded columns and/or vehicle_id), in (timestamp, id) order.
+# Only matching partitions are opened, only the needed columns are read, and row groups outside the
+# range are skipped using their timestamp statistics. after: (timestamp, id) keyset position to read from;
+# limit: stop reading row groups once the first limit rows are known, so a page costs O(limit), not O(range).
+def read_range(root, table, columns, start_ms=None, end_ms=None, after=None, limit=None):
+    names = ["id", "timestamp", *columns]
+    signal, values = TABLES[table]
+    pgns = {decoder.pgn for decoder in load_signals().values() if any(s.name == signal for s in decoder.signals)}
+    if after is not None:
+        start_ms = max(start_ms or 0, after[0])
+    paths = partitions(root, pgns, start_ms, end_ms)
+    empty = pd.DataFrame({name: pd.Series(dtype=dtype.lower()) for name, _, dtype in COLUMNS if name in names})[names]
+    if not paths:
+        return empty
+
+    import pyarrow.parquet as pq # Only needed for the archive
+    read_columns = list(dict.fromkeys(names + values))
+    frames, count, boundary = [], 0, None # boundary: timestamp of the limit-th row read so far
+    for low, part, i in _row_groups(pq, paths, start_ms, end_ms):
+        if boundary is not None and low > boundary:
+            break # Every remaining row group starts after the page
+        df = part.read_row_group(i, columns=read_columns).to_pandas().dropna(subset=values)
+        keep = np.ones(len(df), dtype=bool)
+        if start_ms is not None:
+            keep &= df["timestamp"].to_numpy() >= start_ms
+        if end_ms is not None:
+            keep &= df["timestamp"].to_numpy() < end_ms
+        if after is not None:
+            keep &= (df["timestamp"].to_numpy() > after[0]) | ((df["timestamp"].to_numpy() == after[0]) & (df["id"].to_numpy() > after[1]))
+        frames.append(df[keep][names])
+        count += int(keep.sum())
+        if limit is not None and count >= limit:
+            # Keep only the first limit rows (de-duplicated by id)
+            df = pd.concat(frames, ignore_index=True).drop_duplicates("id").sort_values(["timestamp", "id"]).head(limit)
+            frames, count = [df], len(df)
+            boundary = df["timestamp"].iloc[-1] if count >= limit else None
+    if not frames:
+        return empty
+
+    df = pd.concat(frames, ignore_index=True).drop_duplicates("id").sort_values(["timestamp", "id"], ignore_index=True)
+    return df.astype({name: "int64" if name in values else dtype for name, _, dtype in COLUMNS if name in columns and dtype == "Int64"})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move aged telemetry into the partitioned Parquet archive")
+    parser.add_argument("db_path", nargs="?", default="db/telemetry.db", help="SQLite database path")
+    parser.add_argument("--older-than", type=float, default=3600, help="Archive frames older than this many seconds")
+    parser.add_argument("--root", default=None, help="Archive directory (default: <db name>_archive next to the database)")
+    parser.add_argument("--batch-size", type=int, default=500000, help="Frames per archived batch (one commit each)")
+    parser.add_argument("--compact", action="store_true", help="Only compact the part files of every archived day")
+    args = parser.parse_args()
+
+    root = args.root or default_root(args.db_path)
+    cutoff = int(datetime.now(timezone.utc).timestamp() * 1000) - int(args.older_than * 1000)
+    if args.compact:
+        removed = compact(root, day_of(cutoff))
+        print(f"Compacted {root}: {removed:,} part files merged")
+    else:
+        conn = connect(args.db_path)
+        moved = archive(conn, root, cutoff, args.batch_size)
+        conn.close()
+        print(f"Archived {moved:,} telemetry rows to {root}")
@@ -0,0 +1,78 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+import decode
+from database import PAD_BYTE, PAYLOAD_BYTES, RPM_CAN_ID, PTO_CAN_ID, FAULT_CAN_ID
+
+# Micro-benchmark: legacy per-row .apply decoding vs. the vectorized, table-driven decode module
+# (same number of frames; the legacy decoders read the old simulator layout, the new ones the J1939 layout)
+
+# Build n random simulator-style payloads as 8-byte BLOBs and as the legacy 8-char hex strings
+def make_payloads(n, seed=0):
+    rng = np.random.default_rng(seed)
+    raw = rng.integers(0, 256, (n, 4), dtype=np.uint8)
+    hex_text = raw.tobytes().hex().upper()
+    hex_strings = pd.Series([hex_text[i:i + 8] for i in range(0, len(hex_text), 8)])
+    padded = np.full((n, PAYLOAD_BYTES), PAD_BYTE[0], dtype=np.uint8)
+    padded[:, :4] = raw
+    blobs = pd.Series([padded[i].tobytes() for i in range(n)])
+    return blobs, hex_strings
+
+# Original decoders from analyze.py / api.py
+def legacy_rpm(hex_strings):
+    return hex_strings.apply(lambda d: int(d[:4], 16) / 4)
+
+def legacy_pto(hex_strings):
+    return hex_strings.apply(lambda d: d[:2] == "01")
+
+def legacy_fault(hex_strings):
+    df = pd.DataFrame({"data": hex_strings})
+    df[['spn', 'fmi']] = df['data'].apply(lambda d: pd.Series((int(d[:4], 16), int(d[4:6], 16))))
+    return df
+
+# Table-driven decoders (payload matrix built once per column, then every signal of the PGN, as at ingest)
+def vectorized(can_id):
+    def run(payloads):
+        matrix, _ = decode.payload_matrix(payloads)
+        return decode.decode_frames(np.full(len(matrix), can_id), matrix)
+    return run
+
+vectorized_rpm = vectorized(RPM_CAN_ID)
+vectorized_pto = vectorized(PTO_CAN_ID)
+vectorized_fault = vectorized(FAULT_CAN_ID)
+
+# Best-of-N wall time in seconds
+def best_time(func, data, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark legacy vs. vectorized J1939 payload decoding")
+    parser.add_argument("--frames", type=int, default=1_000_000, help="Frames per decode run")
+    parser.add_argument("--legacy-fault-frames", type=int, default=50_000,
+                        help="Frames for the legacy fault path (pd.Series per row), extrapolated to --frames")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    blobs, hex_strings = make_payloads(args.frames)
+    fault_sample = hex_strings.iloc[:args.legacy_fault_frames]
+    scale = args.frames / len(fault_sample)
+
+    results = [
+        ("rpm", best_time(legacy_rpm, hex_strings, args.repeat), best_time(vectorized_rpm, blobs, args.repeat), best_time(vectorized_rpm, hex_strings, args.repeat)),
+        ("pto", best_time(legacy_pto, hex_strings, args.repeat), best_time(vectorized_pto, blobs, args.repeat), best_time(vectorized_pto, hex_strings, args.repeat)),
+        ("fault", best_time(legacy_fault, fault_sample, 1) * scale, best_time(vectorized_fault, blobs, args.repeat), best_time(vectorized_fault, hex_strings, args.repeat)),
+    ]
+
+    print(f"Decoding {args.frames:,} frames (best of {args.repeat})")
+    print(f"{'signal':<8}{'legacy .apply':>16}{'vectorized BLOB':>18}{'vectorized hex':>17}{'speedup':>10}")
+    for name, legacy, blob, hex_time in results:
+        print(f"{name:<8}{legacy:>15.3f}s{blob:>17.3f}s{hex_time:>16.3f}s{legacy / blob:>9.0f}x")
+    print("(legacy fault time extrapolated from a sample)" if scale > 1 else "")
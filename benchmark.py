@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import analyze
+import api
+from incremental import IncrementalAnalyzer
+from livebuffer import LiveBuffer
+from main import load_to_db
+from simulate import generate_data_vectorized
+from simulate_fleet import simulate_fleet
+
+# Reproducible benchmark suite for the whole pipeline: deterministic simulated datasets at several scales,
+# timing CSV loading (main.load_to_db), the analyze.get_* loaders, every API route (Flask test client) and
+# the dashboard's data-loading block. Results are written as JSON; --compare flags regressions against a
+# stored baseline run (exit status 1), e.g.:
+#   python benchmark.py --output baseline.json
+#   python benchmark.py --compare baseline.json
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc) # Fixed start so every run simulates identical frames
+START_MS = int(START.timestamp() * 1000)
+
+# Dataset scales: simulated seconds per vehicle, and the fleet size (None = one vehicle without an id)
+SCALES = {
+    "1h": {"seconds": 3600, "vehicles": None},
+    "1d": {"seconds": 86400, "vehicles": None},
+    "30d": {"seconds": 30 * 86400, "vehicles": None},
+    "fleet": {"seconds": 3600, "vehicles": 100},
+}
+
+LIVE_NAME = "telemetry_live_bench" # Separate shared memory segment so a running simulator isn't disturbed
+
+# Generate a scale's CSV files once (deterministic for a seed) and return their paths
+def dataset(scale, workdir, seed):
+    config = SCALES[scale]
+    directory = os.path.join(workdir, f"{scale}_seed{seed}")
+    done = os.path.join(directory, "complete")
+    if not os.path.exists(done):
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        if config["vehicles"]:
+            simulate_fleet(config["vehicles"], config["seconds"], workers=1, out_dir=directory, seed=seed, vectorized=True, start=START)
+        else:
+            generate_data_vectorized(os.path.join(directory, "telemetry.csv"), config["seconds"], seed=seed, start=START)
+        open(done, "w").close()
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".csv"))
+
+# Time func over repeat runs; setup() runs untimed before each run and its result is passed to func
+# Returns {"median", "min", "runs"} in seconds
+def measure(func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        times.append(time.perf_counter() - start)
+    return {"median": statistics.median(times), "min": min(times), "runs": repeat}
+
+def remove_db(db_path):
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+# Loaders start cold (the cache would otherwise turn every repeat after the first into a dictionary lookup)
+def cold():
+    analyze.loader_cache.clear()
+
+# analyze.get_* loaders and stats; ranged calls cover the middle hour of the dataset
+def analyze_benchmarks(db_path, seconds):
+    hour_start = START_MS + (seconds // 2) // 3600 * 3_600_000
+    hour_end = hour_start + 3_600_000
+    df_fault = analyze.get_fault_data(db_path)
+    df_episodes = analyze.get_fault_episodes(db_path)
+    return {
+        "get_rpm_data": lambda: analyze.get_rpm_data(db_path),
+        "get_rpm_data[hour]": lambda: analyze.get_rpm_data(db_path, hour_start, hour_end),
+        "get_rpm_stats": lambda: analyze.get_rpm_stats(db_path),
+        "get_rpm_stats[hour]": lambda: analyze.get_rpm_stats(db_path, hour_start, hour_end),
+        "get_pto_data": lambda: analyze.get_pto_data(db_path),
+        "get_pto_data[hour]": lambda: analyze.get_pto_data(db_path, hour_start, hour_end),
+        "get_pto_stats": lambda: analyze.get_pto_stats(db_path),
+        "get_pto_stats[hour]": lambda: analyze.get_pto_stats(db_path, hour_start, hour_end),
+        "get_range_totals": lambda: analyze.get_range_totals(db_path),
+        "get_fault_data": lambda: analyze.get_fault_data(db_path),
+        "get_fault_data[hour]": lambda: analyze.get_fault_data(db_path, start=hour_start, end=hour_end),
+        "get_fault_episodes": lambda: analyze.get_fault_episodes(db_path),
+        "get_anomaly_alerts": lambda: analyze.get_anomaly_alerts(db_path),
+        "get_mtbf": lambda: analyze.get_mtbf(df_episodes),
+        "get_fault_frequency": lambda: analyze.get_fault_frequency(df_episodes.copy()),
+        "get_fault_stats": lambda: analyze.get_fault_stats(df_fault),
+    }
+
+# ISO 8601 UTC timestamp that needs no escaping in a query string
+def iso(ts):
+    return ts.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+# (name, method, URL, JSON body) for every API route; write routes run last, after the timestamps of the dataset
+def api_requests(seconds):
+    hour_start = START + pd.Timedelta(seconds=seconds // 2 // 3600 * 3600)
+    hour = f"start={iso(hour_start)}&end={iso(hour_start + pd.Timedelta(hours=1))}"
+    reads = [("GET /", "/")]
+    for route in ("rpm", "pto"):
+        reads += [
+            (f"GET /api/{route}[hour]", f"/api/{route}?{hour}"),
+            (f"GET /api/{route}[page]", f"/api/{route}?limit=10000"),
+            (f"GET /api/{route}[points]", f"/api/{route}?points=1000"),
+            (f"GET /api/{route}[csv]", f"/api/{route}?format=csv&limit=100000"),
+            (f"GET /api/{route}[arrow]", f"/api/{route}?format=arrow&limit=100000"),
+            (f"GET /api/{route}/stats", f"/api/{route}/stats"),
+            (f"GET /api/{route}/stats[hour]", f"/api/{route}/stats?{hour}"),
+        ]
+    reads += [
+        ("GET /api/faults[hour]", f"/api/faults?{hour}"),
+        ("GET /api/faults[page]", "/api/faults?limit=10000"),
+        ("GET /api/faults[ndjson]", "/api/faults?format=ndjson&limit=100000"),
+        ("GET /api/faults/episodes", "/api/faults/episodes"),
+        ("GET /api/faults/stats", "/api/faults/stats"),
+        ("GET /api/alerts", "/api/alerts"),
+        ("GET /api/signals", "/api/signals"),
+        ("GET /api/signals/<name>", "/api/signals/engine_coolant_temperature?limit=10000"),
+    ]
+    frame = {"timestamp": iso(START + pd.Timedelta(seconds=seconds + 60)), "can_id": "0x0CF00400", "data": "FFFFFF401FFFFFFF"}
+    batch = [dict(frame, data=f"FFFFFF{i % 256:02X}1FFFFFFF") for i in range(1000)]
+    return [(name, "GET", url, None) for name, url in reads] + [
+        ("POST /api/telemetry", "POST", "/api/telemetry", frame),
+        ("POST /api/telemetry/batch", "POST", "/api/telemetry/batch", batch),
+        ("PATCH /api/telemetry/<id>", "PATCH", "/api/telemetry/{id}", {"data": "FFFFFF801FFFFFFF"}),
+        ("DELETE /api/telemetry/<id>", "DELETE", "/api/telemetry/{id}", None),
+    ]
+
+# Time every API route; each run reads the whole (possibly streamed) body
+def api_benchmarks(db_path, seconds, repeat):
+    api.DB_PATH = db_path
+    client = api.app.test_client()
+    post = {"timestamp": iso(START + pd.Timedelta(seconds=seconds + 60)), "can_id": "0x0CF00400", "data": "FFFFFF401FFFFFFF"}
+
+    def call(method, url, body):
+        response = client.open(url, method=method, json=body)
+        response.get_data()
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+    results = {}
+    for name, method, url, body in api_requests(seconds):
+        if "{id}" in url: # A fresh row per run to patch or delete
+            def setup():
+                cold()
+                return client.post("/api/telemetry", json=post).get_json()["id"]
+            results[name] = measure(lambda row_id: call(method, url.format(id=row_id), body), repeat, setup)
+        else:
+            results[name] = measure(lambda: (cold(), call(method, url, body)), repeat)
+    return results
+
+# The dashboard's data-loading block (analyze.load_dashboard_data) for its default "Last hour" view read
+# from SQLite, a fresh process's first refresh, a live-buffer read and a historical date range
+def dashboard_benchmarks(db_path, seconds, repeat):
+    hour = pd.Timedelta(hours=1)
+    history = (START_MS, START_MS + seconds * 1000)
+
+    def first_load(analyzer):
+        analyze.load_dashboard_data(db_path, analyzer, None, hour)
+        analyzer.rpm_stats(), analyzer.pto_stats(), analyzer.fault_frequency(), analyzer.fault_stats(), analyzer.mtbf()
+
+    analyzer = IncrementalAnalyzer(db_path).refresh()
+    results = {
+        "first_load": measure(first_load, repeat, lambda: (cold(), IncrementalAnalyzer(db_path))[1]),
+        "refresh": measure(lambda: (cold(), first_load(analyzer)), repeat),
+        "history": measure(lambda: (cold(), analyze.load_dashboard_data(db_path, analyzer, history, None)), repeat),
+    }
+
+    conn = sqlite3.connect(db_path)
+    live = LiveBuffer.create(LIVE_NAME)
+    try:
+        live.seed(conn)
+        results["get_live_data"] = measure(lambda: analyze.get_live_data(live, hour), repeat)
+    finally:
+        live.close()
+        conn.close()
+    return results
+
+# Run every benchmark for one scale; returns {"frames": n, "benchmarks": {name: timing}}
+def run_scale(scale, workdir, seed, repeat, load_repeat):
+    config = SCALES[scale]
+    files = dataset(scale, workdir, seed)
+    db_path = os.path.join(workdir, f"{scale}_seed{seed}.db")
+
+    def load(_):
+        for path in files:
+            load_to_db(path, db_path, progress=False)
+
+    results = {"main.load_to_db": measure(load, load_repeat, lambda: remove_db(db_path))}
+    frames = sqlite3.connect(db_path).execute("SELECT COUNT(*) FROM telemetry").fetchone()[0]
+    seconds = config["seconds"]
+    for name, func in analyze_benchmarks(db_path, seconds).items():
+        results[f"analyze.{name}"] = measure(lambda: (cold(), func()), repeat)
+    for name, timing in dashboard_benchmarks(db_path, seconds, repeat).items():
+        results[f"dashboard.{name}"] = timing
+    for name, timing in api_benchmarks(db_path, seconds, repeat).items(): # Last: write routes add rows
+        results[f"api.{name}"] = timing
+    return {"frames": frames, "benchmarks": results}
+
+# Environment details stored with the results, so baselines from other machines are recognisable
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "commit": commit,
+    }
+
+# Compare medians with a baseline run: a benchmark regressed if it is more than threshold (fraction)
+# slower and more than min_delta seconds slower (timer noise on fast calls is ignored). Returns the regressions
+def compare(results, baseline, threshold, min_delta):
+    regressions = []
+    print(f"{'benchmark':<52}{'baseline':>11}{'current':>11}{'change':>9}")
+    for scale, current in results["scales"].items():
+        base = baseline.get("scales", {}).get(scale, {}).get("benchmarks", {})
+        for name, timing in current["benchmarks"].items():
+            label = f"{scale} {name}"
+            if name not in base:
+                print(f"{label:<52}{'-':>11}{timing['median'] * 1000:>9.1f}ms{'new':>9}")
+                continue
+            before, after = base[name]["median"], timing["median"]
+            change = after / before - 1 if before else 0.0
+            flag = ""
+            if change > threshold and after - before > min_delta:
+                regressions.append((label, before, after))
+                flag = "  REGRESSION"
+            print(f"{label:<52}{before * 1000:>9.1f}ms{after * 1000:>9.1f}ms{change:>+9.0%}{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproducible pipeline benchmarks on deterministic simulated datasets")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=list(SCALES), help="Dataset scales to run")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark (median and min are reported)")
+    parser.add_argument("--load-repeat", type=int, default=1, help="Runs of main.load_to_db per scale (each reloads from scratch)")
+    parser.add_argument("--seed", type=int, default=42, help="Dataset seed (datasets are cached per scale and seed)")
+    parser.add_argument("--workdir", default="db/bench", help="Directory for generated datasets and benchmark databases")
+    parser.add_argument("--output", default="benchmark_results.json", help="Write results to this JSON file")
+    parser.add_argument("--compare", default=None, help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Slowdown (fraction of the baseline median) flagged as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore slowdowns smaller than this many milliseconds")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": environment(),
+        "config": {"seed": args.seed, "repeat": args.repeat, "load_repeat": args.load_repeat, "start": START.isoformat()},
+        "scales": {},
+    }
+    for scale in args.scales:
+        print(f"Running {scale} ...", flush=True)
+        results["scales"][scale] = run_scale(scale, args.workdir, args.seed, args.repeat, args.load_repeat)
+        timings = results["scales"][scale]["benchmarks"]
+        print(f"  {results['scales'][scale]['frames']:,} frames, load {timings['main.load_to_db']['median']:.2f} s, "
+              f"{len(timings)} benchmarks", flush=True)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms / 1000)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%} and {args.min_delta_ms:g} ms")
+            sys.exit(1)
+        print("No regressions")
@@ -0,0 +1,108 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from database import BUSY_TIMEOUT_MS, file_identity
+
+# Process-wide cache for analyze.py loaders, shared by every Streamlit session (threads) and API request.
+# Entries are keyed by loader + arguments and validated against a cheap database change token.
+
+# Change token for a database file: its identity, PRAGMA data_version (bumped when any other connection commits)
+# and MAX(id) of telemetry, read on one long-lived connection per file (reopened if the file is replaced)
+class ChangeToken:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {} # db_file -> (connection, file identity)
+
+    def get(self, db_file):
+        with self.lock:
+            identity = file_identity(db_file)
+            conn, opened = self.connections.get(db_file, (None, None))
+            if conn is None or identity is None or identity != opened:
+                if conn is not None:
+                    conn.close()
+                conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+                opened = file_identity(db_file)
+                self.connections[db_file] = (conn, opened)
+            try:
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                max_id = conn.execute("SELECT MAX(id) FROM telemetry").fetchone()[0]
+            except sqlite3.OperationalError:
+                return None # No telemetry table yet: never cache
+            return (opened, version, max_id) # File identity: a recreated database never matches old entries
+
+# Approximate memory used by a cached value (DataFrames are measured, other values count as 0)
+def value_size(value):
+    memory_usage = getattr(value, "memory_usage", None)
+    if memory_usage is None:
+        return 0
+    return int(memory_usage(index=True, deep=True).sum())
+
+# LRU cache bounded by entry count and total bytes; a stale token forces a reload
+class LoaderCache:
+    def __init__(self, max_entries=32, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.tokens = ChangeToken()
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> (token, value, size)
+        self.key_locks = {} # key -> [lock, callers using it]; dropped when the last caller is done
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    # Return the cached value for key if the database hasn't changed, otherwise call loader() once
+    # (concurrent callers for the same key wait for that single load instead of all hitting the DB)
+    def get(self, key, db_file, loader):
+        token = self.tokens.get(db_file)
+        if token is None:
+            return loader()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] == token:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            key_lock = self.key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+
+        try:
+            with key_lock[0]:
+                with self.lock: # Another session may have loaded it while we waited
+                    entry = self.entries.get(key)
+                    if entry and entry[0] == token:
+                        self.hits += 1
+                        return entry[1]
+                    self.misses += 1
+                value = loader()
+                self._store(key, token, value)
+                return value
+        finally:
+            with self.lock: # Keys include API-supplied ranges, so unused locks must not accumulate
+                key_lock[1] -= 1
+                if key_lock[1] == 0:
+                    del self.key_locks[key]
+
+    def _store(self, key, token, value):
+        size = value_size(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.total_bytes -= old[2]
+            if size > self.max_bytes:
+                return # Too large to cache
+            self.entries[key] = (token, value, size)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False) # Evict least recently used
+                self.total_bytes -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,168 @@
+import argparse
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+
+from database import PAYLOAD_BYTES, PAD_BYTE
+from decode import load_signals
+from main import INGEST_PRAGMAS, start_load, load_rows
+
+# Streaming importer for raw CAN logs: the file is split into line-aligned byte ranges that worker
+# processes parse in parallel; only frames whose J1939 PGN is wanted are kept, and the results are fed
+# to main.load_rows in file order with a bounded number of chunks in flight (constant memory).
+#
+# Supported text formats (extended 29-bit frames only; 11-bit frames are skipped):
+#   candump -l:   (1436509052.249713) can0 0CF00400#1122334455667788
+#   candump -ta:  (1436509052.249713)  can0  0CF00400   [8]  11 22 33 44 55 66 77 88
+#   Vector ASC:   0.010000 1  CF00400x       Rx   d 8 11 22 33 44 55 66 77 88  (times relative to the "date" header)
+
+LINE_PATTERNS = {
+    "candump": re.compile(rb"^\s*\((\d+\.\d+)\)\s+\S+\s+([0-9A-Fa-f]{8})(?:#|\s+\[\d+\]\s+)((?:[0-9A-Fa-f]{2} ?)*)", re.M),
+    "asc": re.compile(rb"^\s*(\d+\.\d+)\s+\d+\s+([0-9A-Fa-f]{1,8})x\s+(?:Rx|Tx)\s+d\s+\d+\s+((?:[0-9A-Fa-f]{2} ?)*)", re.M),
+}
+
+# ASC "date" header formats (12- and 24-hour clocks)
+ASC_DATE_FORMATS = ("%a %b %d %I:%M:%S.%f %p %Y", "%a %b %d %H:%M:%S.%f %Y", "%a %b %d %I:%M:%S %p %Y", "%a %b %d %H:%M:%S %Y")
+
+# Split a 29-bit CAN ID into (priority, PGN, source address) per J1939-21
+# PDU1 (PF < 240) PGNs carry a destination address in PS, which is not part of the PGN
+def split_can_id(can_id):
+    priority = (can_id >> 26) & 0x7
+    data_page = (can_id >> 24) & 0x3 # Extended data page + data page
+    pf = (can_id >> 16) & 0xFF
+    ps = (can_id >> 8) & 0xFF
+    pgn = (data_page << 16) | (pf << 8) | (ps if pf >= 240 else 0)
+    return priority, pgn, can_id & 0xFF
+
+# PGNs with signal definitions (data/j1939_signals.csv)
+DEFAULT_PGNS = frozenset(load_signals())
+
+# Guess the log format from its first lines; returns (format, base epoch ms for relative timestamps)
+def sniff(path, sample_bytes=65536):
+    with open(path, "rb") as f:
+        head = f.read(sample_bytes)
+    if LINE_PATTERNS["candump"].search(head):
+        return "candump", 0
+    if LINE_PATTERNS["asc"].search(head):
+        return "asc", asc_base_ms(head)
+    raise ValueError(f"{path}: not a candump or ASC log")
+
+# Absolute start time of an ASC log from its "date" header line (UTC if no zone is given; 0 if missing)
+def asc_base_ms(head):
+    match = re.search(rb"^date\s+(.+?)\s*$", head, re.M)
+    if match:
+        text = match.group(1).decode(errors="replace")
+        for fmt in ASC_DATE_FORMATS:
+            try:
+                value = datetime.strptime(text, fmt).replace(tzinfo=timezone.utc)
+            except ValueError:
+                continue
+            return int(value.timestamp() * 1000)
+    return 0
+
+# Byte ranges of about chunk_bytes each, adjusted so every range starts at the beginning of a line
+def chunk_ranges(path, chunk_bytes):
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        while bounds[-1] + chunk_bytes < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            f.readline() # Move to the next line start
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+# Parse one byte range into typed frames (timestamp ms, can_id, payload, None) for the wanted PGNs
+# Runs in a worker process; returns (frames, lines matched)
+def parse_chunk(path, start, end, fmt, base_ms, pgns):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    wanted = {} # can_id -> keep?  (few distinct IDs per log)
+    frames = []
+    matches = LINE_PATTERNS[fmt].findall(data)
+    for ts, can_id, payload in matches:
+        can_id = int(can_id, 16)
+        keep = wanted.get(can_id)
+        if keep is None:
+            keep = wanted[can_id] = pgns is None or split_can_id(can_id)[1] in pgns
+        if not keep:
+            continue
+        payload = bytes.fromhex(payload.decode())
+        if len(payload) > PAYLOAD_BYTES: # CAN FD frames don't fit the classic payload column
+            continue
+        frames.append((base_ms + round(float(ts) * 1000), can_id, payload.ljust(PAYLOAD_BYTES, PAD_BYTE), None))
+    return frames, len(matches)
+
+# Yield typed frames from a log in file order, parsing chunks in parallel with at most 2 per worker in flight
+def iter_frames(path, fmt=None, pgns=DEFAULT_PGNS, workers=None, chunk_bytes=16 * 1024 * 1024, stats=None):
+    base_ms = 0
+    if fmt is None:
+        fmt, base_ms = sniff(path)
+    elif fmt == "asc":
+        with open(path, "rb") as f:
+            base_ms = asc_base_ms(f.read(65536))
+    workers = workers or os.cpu_count() or 1
+    ranges = iter(chunk_ranges(path, chunk_bytes))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for start, end in islice(ranges, workers * 2):
+            pending.append(pool.submit(parse_chunk, path, start, end, fmt, base_ms, pgns))
+        while pending:
+            frames, matched = pending.popleft().result()
+            for start, end in islice(ranges, 1): # Keep the pipeline full
+                pending.append(pool.submit(parse_chunk, path, start, end, fmt, base_ms, pgns))
+            if stats is not None:
+                stats["lines"] = stats.get("lines", 0) + matched
+                stats["kept"] = stats.get("kept", 0) + len(frames)
+            yield from frames
+
+# Import a CAN log into the telemetry database (resumable like main.load_to_db); returns frames inserted
+def load_log(path, db_file, fmt=None, pgns=DEFAULT_PGNS, workers=None, chunk_bytes=16 * 1024 * 1024,
+             batch_size=10000, txn_size=100000, pragmas=None, resume=True, progress=True):
+    started = start_load(path, db_file, pragmas, resume, progress)
+    if started is None:
+        return 0
+    conn, source, fingerprint, skip = started
+
+    stats = {}
+    try:
+        frames = islice(iter_frames(path, fmt, pgns, workers, chunk_bytes, stats), skip, None)
+        loaded = load_rows(conn, frames, source, fingerprint, skip, batch_size, txn_size, progress, convert=None, kind="canlog")
+    finally:
+        conn.close() # Uncommitted rows are rolled back; committed batches are recorded in load_progress
+
+    if progress:
+        print(f"{source}: kept {stats.get('kept', 0):,} of {stats.get('lines', 0):,} frames")
+    return loaded - skip
+
+# Parse "0xF004", "F004" (hex) or "61444" (decimal) PGN arguments
+def parse_pgn(value):
+    return int(value, 16) if value.lower().startswith("0x") or not value.isdigit() else int(value)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import candump or ASC CAN logs into the SQLite database")
+    parser.add_argument("log_files", nargs="+", help="CAN log files")
+    parser.add_argument("--db", default="db/telemetry.db", help="SQLite database path")
+    parser.add_argument("--format", choices=sorted(LINE_PATTERNS), default=None, help="Log format (default: detect)")
+    parser.add_argument("--pgn", action="append", type=parse_pgn, default=None,
+                        help="PGN to keep, hex or decimal (repeatable; default: PGNs in the signal definitions)")
+    parser.add_argument("--all-pgns", action="store_true", help="Keep every extended (29-bit) frame")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+    parser.add_argument("--chunk-mb", type=int, default=16, help="Bytes of log parsed per task (MiB)")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Rows per executemany batch")
+    parser.add_argument("--txn-size", type=int, default=100000, help="Rows per committed transaction")
+    parser.add_argument("--no-resume", action="store_true", help="Reload files even if already (partially) loaded")
+    args = parser.parse_args()
+
+    pgns = None if args.all_pgns else frozenset(args.pgn) if args.pgn else DEFAULT_PGNS
+    for log_file in args.log_files:
+        load_log(log_file, args.db, args.format, pgns, args.workers, args.chunk_mb * 1024 * 1024,
+                 args.batch_size, args.txn_size, INGEST_PRAGMAS, resume=not args.no_resume)
@@ -12,9 +12,15 @@ fi
 
 # Delete telemetry database in SQLite
 if [ -e db/telemetry.db ]; then
-    rm db/telemetry.db
+    rm -f db/telemetry.db db/telemetry.db-wal db/telemetry.db-shm # WAL mode keeps two side files
     echo "Cleared telemetry database."
 else
     echo "Error: db/telemetry.db does not exist."
 fi
 
+
+# Delete the Parquet cold archive (archive.py)
+if [ -d db/telemetry_archive ]; then
+    rm -rf db/telemetry_archive
+    echo "Cleared telemetry archive."
+fi
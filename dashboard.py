@@ -9,15 +9,19 @@ st.set_page_config(
 import altair as alt
 import time
 from analyze import (
-    get_rpm_data,
-    get_rpm_stats,
-    get_pto_data,
-    get_pto_stats,
-    get_fault_data,
+    get_anomaly_alerts,
+    get_fault_episodes,
     get_fault_frequency,
     get_fault_stats,
-    get_mtbf
+    get_mtbf,
+    get_pto_stats,
+    get_rpm_stats,
+    load_dashboard_data
 ) # Importing functions from analyze.py
+from anomaly import ALERT_KINDS
+from incremental import IncrementalAnalyzer
+from downsample import downsample
+import pandas as pd
 
 # Import Auto Refresh
 from streamlit_autorefresh import st_autorefresh
@@ -27,16 +31,60 @@ live_refresh = st.sidebar.checkbox("Live Refresh (every 5s)", value=True)
 if live_refresh:
     st_autorefresh(interval=5000, key="dashboard_refresh")
 
-# Load SQLite data
+# Chart time range and the number of points sent to the browser for it
+TIME_RANGES = {
+    "Last 15 minutes": (pd.Timedelta(minutes=15), 900),
+    "Last hour": (pd.Timedelta(hours=1), 1200),
+    "Last 6 hours": (pd.Timedelta(hours=6), 1500),
+    "Last 24 hours": (pd.Timedelta(hours=24), 2000),
+    "Last 7 days": (pd.Timedelta(days=7), 2000),
+    "All data": (None, 2000),
+}
+time_range = st.sidebar.selectbox("Chart Time Range", list(TIME_RANGES), index=1)
+range_length, point_budget = TIME_RANGES[time_range]
+
+# Optional historical dates (UTC): charts load that range, including rows moved to the Parquet archive
+history = None
+if st.sidebar.checkbox("Historical Range", value=False):
+    today = pd.Timestamp.now(tz="UTC").normalize()
+    dates = st.sidebar.date_input("Dates (UTC)", value=((today - pd.Timedelta(days=7)).date(), today.date()))
+    if len(dates) == 2:
+        start, end = pd.Timestamp(dates[0], tz="UTC"), pd.Timestamp(dates[1], tz="UTC") + pd.Timedelta(days=1)
+        history = (int(start.timestamp() * 1000), int(end.timestamp() * 1000)) # Epoch ms, end exclusive
+        time_range, range_length = f"{dates[0]} to {dates[1]}", None
+
+# Keep rows within the selected range, ending at the newest sample
+def select_range(df):
+    if range_length is None or df.empty:
+        return df
+    return df[df["timestamp"] >= df["timestamp"].max() - range_length]
+
+# One incremental analyzer per process, shared by all browser sessions
+@st.cache_resource
+def get_analyzer(db_path):
+    return IncrementalAnalyzer(db_path)
+
+# Load data (live buffer, SQLite or the archive) and refresh the stats (analyze.load_dashboard_data)
 DB_PATH = "db/telemetry.db"
-df_rpm = get_rpm_data(DB_PATH)
-df_pto = get_pto_data(DB_PATH)
-rpm_stats = get_rpm_stats(DB_PATH)
-pto_stats = get_pto_stats(DB_PATH)
-df_fault = get_fault_data(DB_PATH)
-fault_freq = get_fault_frequency(df_fault)
-fault_stats = get_fault_stats(df_fault)
-mtbf = get_mtbf(df_fault)
+analyzer = get_analyzer(DB_PATH)
+df_rpm, df_pto, df_fault, live_data = load_dashboard_data(DB_PATH, analyzer, history, range_length)
+df_episodes = get_fault_episodes(DB_PATH, start=history[0], end=history[1]) if history else get_fault_episodes(DB_PATH)
+if history:
+    # Stats over the same range as the charts, archived rows included: RPM/PTO from the rollups (raw edges
+    # from SQLite and the archive) and faults from the episodes, which both outlive the archived raw rows
+    rpm_stats = get_rpm_stats(DB_PATH, *history)
+    pto_stats = get_pto_stats(DB_PATH, *history)
+    fault_freq = get_fault_frequency(df_episodes) # Adds wrapped_description, which the most recent fault shows
+    fault_stats = get_fault_stats(df_episodes)
+    mtbf = get_mtbf(df_episodes)
+    stats_source = f"{time_range}, including archived data"
+else:
+    rpm_stats = analyzer.rpm_stats()
+    pto_stats = analyzer.pto_stats()
+    fault_freq = analyzer.fault_frequency()
+    fault_stats = analyzer.fault_stats()
+    mtbf = analyzer.mtbf()
+    stats_source = "all data in SQLite (not the archive)"
 
 # Function to color code fault codes based on severity
 def highlight_severity(val):
@@ -51,13 +99,14 @@ st.title("Vehicle Telemetry Dashboard")
 st.markdown("Analyze simulated J1939 vehicle data: engine RPM, PTO activation, fault codes, and more.")
 
 # Tabbed layout
-tab0, tab1, tab2, tab3, tab4 = st.tabs(["Dashboard Summary","Engine RPM", "PTO Activation", "Fault Codes", "About"])
+tab0, tab1, tab2, tab3, tab4, tab5 = st.tabs(["Dashboard Summary","Engine RPM", "PTO Activation", "Fault Codes", "Anomalies", "About"])
 
 # Dashboard Summary Tab
 with tab0:
     st.subheader("System Summary")
     refresh_status = "Active" if live_refresh else "Paused"
-    st.caption(f"Live Refresh: {refresh_status} — Last updated {time.strftime('%H:%M:%S')}")
+    source = "shared-memory live buffer" if live_data else "SQLite"
+    st.caption(f"Live Refresh: {refresh_status} — Last updated {time.strftime('%H:%M:%S')} — Charts from {source} — Stats over {stats_source}")
 
     col1, col2, col3 = st.columns(3)
 
@@ -77,8 +126,8 @@ with tab0:
         if df_fault.empty:
             st.success("No fault codes detected.")
         else:
-            st.metric("Total Faults", f"{fault_stats['total_faults']}")
-            st.metric("Critical Faults", f"{fault_stats['critical_count']}")
+            st.metric("Fault Episodes", f"{fault_stats['total_faults']}")
+            st.metric("Critical Episodes", f"{fault_stats['critical_count']}")
             if mtbf:
                 st.metric("Mean Time Between Faults", f"{mtbf:.1f} sec")
             else:
@@ -94,7 +143,10 @@ with tab0:
 # Engine RPM Tab
 with tab1:
     st.subheader("Engine RPM Over Time")
-    st.line_chart(df_rpm.set_index("timestamp")["rpm"])
+    # Downsampled with LTTB so long ranges keep their shape without sending every sample
+    rpm_chart = downsample(select_range(df_rpm), "rpm", point_budget, method="lttb")
+    st.line_chart(rpm_chart.set_index("timestamp")["rpm"])
+    st.caption(f"{time_range}: showing {len(rpm_chart):,} of {len(select_range(df_rpm)):,} samples")
     
     st.subheader("RPM Statistics")
     st.markdown(f"""
@@ -117,7 +169,10 @@ with tab1:
 # PTO Activation Tab
 with tab2:
     st.subheader("PTO Activation Timeline")
-    st.line_chart(df_pto.set_index("timestamp")["pto_on"].astype(int))
+    # Min/max buckets keep every on/off edge of the step signal
+    pto_chart = select_range(df_pto).assign(pto_on=lambda d: d["pto_on"].astype(int))
+    pto_chart = downsample(pto_chart, "pto_on", point_budget, method="minmax")
+    st.line_chart(pto_chart.set_index("timestamp")["pto_on"])
     
     st.subheader("PTO Activity Statistics")
     st.markdown(f"""
@@ -144,7 +199,7 @@ with tab3:
     # Create Altair bar chart
     chart = alt.Chart(fault_freq).mark_bar().encode(
         x=alt.X("wrapped_description:N", sort="-y", title="Fault Description"),
-        y=alt.Y("count:Q", title="Count"),
+        y=alt.Y("count:Q", title="Episodes"),
         color=alt.Color("severity:N", scale=alt.Scale(domain=["Critical", "Warning", "Info"], range=["red", "orange", "green"])),
         tooltip=["wrapped_description", "count", "severity"]
     ).properties(
@@ -166,17 +221,25 @@ with tab3:
     else:
         with col1:
             st.markdown(f"""
-            - Total Faults: {fault_stats['total_faults']}
-            - Critical Faults: {fault_stats['critical_count']}
-            - Warning Faults: {fault_stats['warning_count']}
-            - Info Faults: {fault_stats['info_count']}
-            - Mean Time Between Faults: {mtbf:.1f} sec
+            - Fault Episodes: {fault_stats['total_faults']}
+            - Critical Episodes: {fault_stats['critical_count']}
+            - Warning Episodes: {fault_stats['warning_count']}
+            - Info Episodes: {fault_stats['info_count']}
+            - Mean Time Between Faults: {f'{mtbf:.1f} sec' if mtbf else 'n/a (needs two episodes)'}
             """)
         with col2:
             st.write(f"• Most Recent Fault: {most_recent['wrapped_description']}")
             st.write(f"• Time: {fault_stats['last_fault_time']}")
             st.write(f"• Severity: {most_recent['severity']}")
 
+    # Fault episodes: repeated DM1 broadcasts of one SPN/FMI collapsed into start, end, duration and count
+    st.subheader("Fault Episodes")
+    if df_episodes.empty:
+        st.success("No fault episodes recorded.")
+    else:
+        styled_episodes = df_episodes[["timestamp", "end_time", "duration_sec", "occurrences", "spn", "fmi", "description", "severity"]]
+        st.dataframe(styled_episodes.style.map(highlight_severity, subset=["severity"]), use_container_width=True)
+
     # Display fault code data with severity highlighting
     st.subheader("Fault Code Data")
     if df_fault.empty:
@@ -198,8 +261,38 @@ with tab3:
     # List number of faults and overview of fault codes
     st.markdown("Fault codes are represented by SPN (Suspect Parameter Number) and FMI (Failure Mode Identifier).")
 
-# About Tab
+# Anomalies Tab
 with tab4:
+    st.subheader("RPM & PTO Anomalies")
+    st.markdown("Alerts raised by the streaming detector as data is ingested: over-revs, RPM spikes against the recent average, rapid RPM changes, RPM hunting and high RPM while the PTO is engaged.")
+
+    df_alerts = get_anomaly_alerts(DB_PATH, *history) if history else get_anomaly_alerts(DB_PATH)
+    if range_length is not None and not df_alerts.empty and not df_rpm.empty:
+        df_alerts = df_alerts[df_alerts["end_time"] >= df_rpm["timestamp"].max() - range_length]
+
+    cols = st.columns(len(ALERT_KINDS))
+    counts = df_alerts["kind"].value_counts()
+    for col, (kind, (label, _)) in zip(cols, ALERT_KINDS.items()):
+        col.metric(label, int(counts.get(kind, 0)))
+
+    if df_alerts.empty:
+        st.success("No anomalies detected in the selected range.")
+    else:
+        # RPM with a rule at the start of each alert
+        rpm_line = alt.Chart(rpm_chart).mark_line().encode(x=alt.X("timestamp:T", title="Time"), y=alt.Y("rpm:Q", title="RPM"))
+        alert_rules = alt.Chart(df_alerts).mark_rule(strokeWidth=2).encode(
+            x="timestamp:T",
+            color=alt.Color("alert:N", title="Alert"),
+            tooltip=["alert", "timestamp", "duration_sec", "peak", "unit"]
+        )
+        st.altair_chart((rpm_line + alert_rules).properties(height=350), use_container_width=True)
+
+        st.subheader("Alerts")
+        st.dataframe(df_alerts.sort_values("timestamp", ascending=False)[
+            ["timestamp", "end_time", "duration_sec", "vehicle_id", "alert", "samples", "peak", "unit"]], use_container_width=True)
+
+# About Tab
+with tab5:
     st.subheader("About This Dashboard")
     st.markdown("""
     This dashboard provides an interactive way to analyze simulated J1939 vehicle telemetry data.
@@ -207,6 +300,7 @@ with tab4:
     - **Engine RPM**: Displays engine RPM over time with key statistics.
     - **PTO Activation**: Shows PTO activation timeline and stats.
     - **Fault Codes**: Shows detected fault codes with severity levels and frequency.
+    - **Anomalies**: Lists over-rev, RPM spike, rapid change, hunting and PTO/RPM alerts detected at ingest.
     - **SQLite database** for telemetry storage
     - **REST API access** via Postman for CRUD operations
     
@@ -0,0 +1,410 @@
+import argparse
+import math
+import numbers
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+# Schema version stored in PRAGMA user_version (0 = original TEXT schema)
+SCHEMA_VERSION = 7
+
+# CAN IDs from standardized J1939 PGNs used by the simulators, stored as integers
+RPM_CAN_ID = 0x0CF00400 # EEC1 (engine speed)
+PTO_CAN_ID = 0x18FEF100 # CCVS1 (PTO state)
+FAULT_CAN_ID = 0x18FECA00 # DM1 (active diagnostic trouble codes)
+LEGACY_FAULT_CAN_ID = 0x0CFE6CEE # Fault frames of the original simulators (rewritten to DM1 by migrate)
+
+# Rollup tables and their bucket size in ms (finest first)
+ROLLUP_RESOLUTIONS = {"rollup_1m": 60_000, "rollup_1h": 3_600_000, "rollup_1d": 86_400_000}
+
+# Shared connection settings for the simulator, dashboard and API: WAL lets readers run while the
+# simulator writes, and busy_timeout makes a blocked writer wait instead of failing with "database is locked"
+BUSY_TIMEOUT_MS = 5000
+CONNECTION_PRAGMAS = {
+    "journal_mode": "WAL", # Persistent: stored in the database file once set
+    "synchronous": "NORMAL", # Safe with WAL; skips an fsync per commit
+    "busy_timeout": BUSY_TIMEOUT_MS,
+}
+
+PAYLOAD_BYTES = 8 # Classic CAN frame payload
+PAD_BYTE = b"\xff" # J1939 "not available" filler for unused bytes
+
+# Schema statements per version, applied in order by ensure_schema()
+SCHEMA = {
+    # 1: typed telemetry table: epoch-ms timestamps, integer CAN IDs and 8-byte payload BLOBs
+    1: [
+        '''
+        CREATE TABLE IF NOT EXISTS telemetry (
+            id INTEGER PRIMARY KEY,
+            timestamp INTEGER NOT NULL,
+            can_id INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            vehicle_id INTEGER
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_telemetry_can_id_timestamp ON telemetry (can_id, timestamp)",
+    ],
+    # 2: signal tables decoded once at ingest (raw_id = telemetry.id); telemetry stays the source of truth
+    2: [
+        "CREATE TABLE IF NOT EXISTS rpm_samples (raw_id INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL, vehicle_id INTEGER, rpm REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS pto_samples (raw_id INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL, vehicle_id INTEGER, pto_on INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS fault_events (raw_id INTEGER PRIMARY KEY, timestamp INTEGER NOT NULL, vehicle_id INTEGER, spn INTEGER NOT NULL, fmi INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_rpm_samples_timestamp ON rpm_samples (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_pto_samples_timestamp ON pto_samples (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_fault_events_timestamp ON fault_events (timestamp)",
+        # Deleting a raw frame (API, retention) removes its decoded row
+        '''
+        CREATE TRIGGER IF NOT EXISTS telemetry_delete_decoded AFTER DELETE ON telemetry BEGIN
+            DELETE FROM rpm_samples WHERE raw_id = OLD.id;
+            DELETE FROM pto_samples WHERE raw_id = OLD.id;
+            DELETE FROM fault_events WHERE raw_id = OLD.id;
+        END
+        ''',
+    ],
+    # 3: continuous RPM/PTO rollups per minute, hour and day (not pruned by retention)
+    3: [
+        *(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket INTEGER PRIMARY KEY,
+            rpm_min REAL,
+            rpm_max REAL,
+            rpm_sum REAL NOT NULL DEFAULT 0,
+            rpm_count INTEGER NOT NULL DEFAULT 0,
+            pto_engaged_sec INTEGER NOT NULL DEFAULT 0,
+            pto_activations INTEGER NOT NULL DEFAULT 0
+        )
+        ''' for table in ROLLUP_RESOLUTIONS),
+        # Last PTO state per vehicle (0 = no vehicle id) so activations are counted across ingest batches
+        "CREATE TABLE IF NOT EXISTS rollup_state (vehicle_key INTEGER PRIMARY KEY, pto_on INTEGER NOT NULL)",
+    ],
+    # 4: values of the other decoded signals (store=1 in data/j1939_signals.csv), one row per frame, signal and instance
+    4: [
+        '''
+        CREATE TABLE IF NOT EXISTS signal_values (
+            raw_id INTEGER NOT NULL,
+            signal TEXT NOT NULL,
+            instance INTEGER NOT NULL DEFAULT 0,
+            timestamp INTEGER NOT NULL,
+            vehicle_id INTEGER,
+            value REAL NOT NULL,
+            PRIMARY KEY (raw_id, signal, instance)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_signal_values_signal_timestamp ON signal_values (signal, timestamp)",
+        "DROP TRIGGER IF EXISTS telemetry_delete_decoded",
+        '''
+        CREATE TRIGGER telemetry_delete_decoded AFTER DELETE ON telemetry BEGIN
+            DELETE FROM rpm_samples WHERE raw_id = OLD.id;
+            DELETE FROM pto_samples WHERE raw_id = OLD.id;
+            DELETE FROM fault_events WHERE raw_id = OLD.id;
+            DELETE FROM signal_values WHERE raw_id = OLD.id;
+        END
+        ''',
+    ],
+    # 5: fault episodes, consecutive DM1 frames of one vehicle/SPN/FMI collapsed into one row (not pruned by retention)
+    5: [
+        '''
+        CREATE TABLE IF NOT EXISTS fault_episodes (
+            id INTEGER PRIMARY KEY,
+            vehicle_id INTEGER,
+            spn INTEGER NOT NULL,
+            fmi INTEGER NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            occurrences INTEGER NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_fault_episodes_key_end ON fault_episodes (spn, fmi, vehicle_id, end_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_fault_episodes_start ON fault_episodes (start_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_fault_episodes_end ON fault_episodes (end_ts)",
+    ],
+    # 6: RPM/PTO anomaly alerts from the streaming detector (anomaly.py) and its per-vehicle state (0 = no vehicle id)
+    6: [
+        '''
+        CREATE TABLE IF NOT EXISTS anomaly_alerts (
+            id INTEGER PRIMARY KEY,
+            vehicle_id INTEGER,
+            kind TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            peak REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_anomaly_alerts_key_end ON anomaly_alerts (kind, vehicle_id, end_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_anomaly_alerts_start ON anomaly_alerts (start_ts)",
+        "CREATE INDEX IF NOT EXISTS idx_anomaly_alerts_end ON anomaly_alerts (end_ts)",
+        '''
+        CREATE TABLE IF NOT EXISTS anomaly_state (
+            vehicle_key INTEGER PRIMARY KEY,
+            rpm_ts INTEGER,
+            samples INTEGER NOT NULL,
+            mean REAL NOT NULL,
+            var REAL NOT NULL,
+            ref_ts INTEGER,
+            ref_rpm REAL,
+            direction INTEGER NOT NULL,
+            hunt REAL NOT NULL,
+            hunt_ts INTEGER,
+            pto_on INTEGER NOT NULL,
+            pto_since INTEGER
+        )
+        ''',
+    ],
+    # 7: PTO engaged time counts distinct engaged seconds per vehicle instead of samples (rollups are corrected in place);
+    # the last counted second per vehicle keeps a second split across ingest batches from counting twice
+    7: [
+        "ALTER TABLE rollup_state ADD COLUMN pto_sec INTEGER",
+    ],
+}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+# Convert an ISO 8601 string, datetime or epoch-ms number to integer epoch milliseconds (naive = UTC);
+# anything else (booleans, None, lists...) raises ValueError
+def to_epoch_ms(value):
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real): # JSON numbers such as 1718000000000.0
+        if not math.isfinite(value):
+            raise ValueError(f"Invalid timestamp: {value!r}")
+        return round(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    if not isinstance(value, datetime):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // MILLISECOND # Exact integer math (float seconds can lose a millisecond)
+
+# Parse a CAN ID given as "0x0CF00400", "0CF00400" or an integer
+def parse_can_id(value):
+    if isinstance(value, int):
+        can_id = value
+    else:
+        can_id = int(str(value).strip(), 16)
+    if not 0 <= can_id < 1 << 29:
+        raise ValueError(f"CAN ID out of 29-bit range: {value!r}")
+    return can_id
+
+# Pack a hex payload string into an 8-byte BLOB, padding unused bytes with 0xFF
+def pack_payload(value):
+    payload = bytes(value) if isinstance(value, (bytes, bytearray)) else bytes.fromhex(str(value).strip())
+    if len(payload) > PAYLOAD_BYTES:
+        raise ValueError(f"Payload longer than {PAYLOAD_BYTES} bytes: {value!r}")
+    return payload.ljust(PAYLOAD_BYTES, PAD_BYTE)
+
+# Format stored values back into the text representation used by the CSV files and API
+def format_can_id(can_id):
+    return f"0x{can_id:08X}"
+
+def format_payload(payload):
+    return payload.hex().upper()
+
+# Convert (timestamp, can_id, data[, vehicle_id]) rows into typed rows for the telemetry table; bad rows are
+# reported instead of raising (timestamps may also be epoch ms numbers or datetimes, as for to_epoch_ms)
+# Returns (typed rows, input positions of the typed rows, [(position, error message)])
+def convert_rows_checked(rows):
+    rows = list(rows)
+    texts = pd.Series([r[0] if isinstance(r[0], str) else None for r in rows], dtype=object)
+    parsed = pd.to_datetime(texts, utc=True, format='ISO8601', errors='coerce') # Bad strings become NaT
+    timestamps = parsed.dt.as_unit('ms').dt.tz_localize(None).to_numpy().astype('int64').tolist()
+    missing = parsed.isna().tolist()
+
+    can_ids = {} # Few distinct CAN IDs, so parse each once
+    typed, positions, errors = [], [], []
+    for position, (row, ts, ts_missing) in enumerate(zip(rows, timestamps, missing)):
+        try:
+            if not isinstance(row[0], str):
+                ts = to_epoch_ms(row[0]) # Epoch ms numbers (int or float) and datetimes; rejects bool, NaN, None...
+            elif ts_missing:
+                raise ValueError(f"Invalid timestamp: {row[0]!r}")
+            key = row[1] if isinstance(row[1], (int, str)) else repr(row[1])
+            can_id = can_ids.get(key)
+            if can_id is None:
+                can_id = can_ids[key] = parse_can_id(row[1])
+            vehicle_id = int(row[3]) if len(row) > 3 and row[3] not in (None, "") else None
+            typed.append((ts, can_id, pack_payload(row[2]), vehicle_id))
+            positions.append(position)
+        except (ValueError, TypeError, AttributeError) as e:
+            errors.append((position, str(e)))
+    return typed, positions, errors
+
+# Current schema version of a connection's database
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# True if the database still has the original TEXT telemetry table
+def is_legacy_schema(conn):
+    columns = {row[1]: row[2].upper() for row in conn.execute("PRAGMA table_info(telemetry)")}
+    return bool(columns) and columns.get("timestamp") == "TEXT"
+
+# Create or upgrade the typed schema; legacy TEXT databases must be migrated first
+def ensure_schema(conn):
+    version = get_schema_version(conn)
+    if version == SCHEMA_VERSION:
+        return
+    if is_legacy_schema(conn):
+        raise RuntimeError("Telemetry database uses the old TEXT schema; run: python database.py migrate <db_path>")
+
+    for step in range(version + 1, SCHEMA_VERSION + 1):
+        for statement in SCHEMA[step]:
+            conn.execute(statement)
+
+    # Backfill the new tables once every step's tables exist
+    # Step 4 has no backfill: frames written before the J1939 signal definitions keep their decoded rows
+    # (python ingest.py rebuild re-decodes everything with the definitions)
+    if version < 2:
+        from ingest import rebuild_decoded # Local import: ingest depends on this module
+        rebuild_decoded(conn) # Signal tables (and then the rollups, fault episodes and anomaly alerts) from existing raw frames
+    else:
+        if version < 3:
+            from rollups import rebuild_rollups # Local import: rollups depends on this module
+            rebuild_rollups(conn) # Rollups from the decoded signal tables
+        elif version < 7:
+            from rollups import upgrade_engaged_seconds # Local import: rollups depends on this module
+            upgrade_engaged_seconds(conn) # Existing rollups keep their history; engaged seconds fixed where raw rows remain
+        if version < 5:
+            from episodes import rebuild_fault_episodes # Local import: episodes depends on this module
+            rebuild_fault_episodes(conn) # Episodes from the decoded fault_events rows
+        if version < 6:
+            from anomaly import rebuild_anomalies # Local import: anomaly depends on this module
+            rebuild_anomalies(conn) # Alerts from the decoded RPM/PTO samples
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+# Open a connection to the telemetry database in WAL mode with the schema in place
+def connect(db_path):
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    for name, value in CONNECTION_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    ensure_schema(conn)
+    return conn
+
+# (device, inode) of a database file, or None if it doesn't exist
+def file_identity(db_path):
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return (stat.st_dev, stat.st_ino)
+
+# Long-lived connections, one per thread and database file (Flask request threads, Streamlit sessions).
+# A connection is reopened if its file was deleted or replaced (e.g. by clear.sh); callers must not close it.
+class ConnectionPool:
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, db_path):
+        connections = self.local.__dict__.setdefault("connections", {})
+        entry = connections.get(db_path)
+        identity = file_identity(db_path)
+        if entry is not None and identity is not None and entry[1] == identity:
+            return entry[0]
+        if entry is not None:
+            entry[0].close()
+        conn = connect(db_path)
+        connections[db_path] = (conn, file_identity(db_path))
+        return conn
+
+    # Roll back an uncommitted transaction on this thread's connection (e.g. after a failed request)
+    def rollback(self, db_path):
+        entry = self.local.__dict__.get("connections", {}).get(db_path)
+        if entry is not None and entry[0].in_transaction:
+            entry[0].rollback()
+
+    # Close this thread's connections
+    def close(self):
+        for conn, _ in self.local.__dict__.pop("connections", {}).values():
+            conn.close()
+
+# Process-wide pool shared by analyze.py, incremental.py and api.py
+pool = ConnectionPool()
+
+# Rewrite a frame of the original simulator layouts into the J1939 layout decoded now; returns (can_id, payload).
+# Those simulators wrote at most 4 bytes: RPM x4 in bytes 0-1 (big-endian), PTO engaged = 0x01 in byte 0, and
+# SPN in bytes 0-1 + FMI in byte 2 on LEGACY_FAULT_CAN_ID. Full 8-byte frames are kept as they are.
+def legacy_frame(can_id, data):
+    payload = pack_payload(data)
+    if len(str(data).strip()) >= 2 * PAYLOAD_BYTES:
+        return can_id, payload
+    word = payload[0] << 8 | payload[1]
+    if can_id == RPM_CAN_ID: # EEC1 engine speed, bytes 4-5 little-endian at 0.125 rpm/bit
+        raw = word * 2 if word * 2 <= 0xFAFF else 0xFFFF # Out of range = not available
+        return can_id, bytes([0xFF, 0xFF, 0xFF, raw & 0xFF, raw >> 8, 0xFF, 0xFF, 0xFF])
+    if can_id == PTO_CAN_ID: # CCVS1 PTO state in byte 7 (5 = engaged, 0 = off)
+        return can_id, bytes([0xFF] * 6 + [0xE5 if payload[0] == 0x01 else 0xE0, 0xFF])
+    if can_id == LEGACY_FAULT_CAN_ID: # DM1 with one DTC (SPN 0 = no active fault when the FMI is not available)
+        spn, fmi = (word, payload[2] & 0x1F) if payload[2] != 0xFF else (0, 0)
+        lamp = 0x00 if not spn else 0x10 if fmi in (0, 1) else 0x04 # Red stop lamp for FMI 0/1, amber otherwise
+        return FAULT_CAN_ID, bytes([lamp, 0xFF, spn & 0xFF, spn >> 8, fmi, 0x01 if spn else 0x00, 0xFF, 0xFF])
+    return can_id, payload
+
+# Migrate a database from the TEXT schema to the typed schema in place, preserving row ids.
+# Frames in the original simulator layouts are rewritten to EEC1/CCVS1/DM1 (legacy_frame) so they decode.
+# Rows that can't be parsed are kept in telemetry_rejected instead of being dropped
+def migrate(db_path, batch_size=50000):
+    conn = sqlite3.connect(db_path)
+    if not is_legacy_schema(conn):
+        ensure_schema(conn)
+        print(f"{db_path} is already at schema version {get_schema_version(conn)}")
+        conn.close()
+        return 0
+
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    cur.execute(SCHEMA[1][0].replace("telemetry (", "telemetry_new (", 1))
+    cur.execute("CREATE TABLE IF NOT EXISTS telemetry_rejected (id INTEGER PRIMARY KEY, timestamp TEXT, can_id TEXT, data TEXT, error TEXT)")
+
+    last_id, migrated, rejected = 0, 0, 0
+    while True:
+        rows = cur.execute("SELECT id, timestamp, can_id, data FROM telemetry WHERE id > ? ORDER BY id LIMIT ?",
+                           (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        good, bad = [], []
+        for row_id, ts, can_id, data in rows:
+            try:
+                good.append((row_id, to_epoch_ms(ts), *legacy_frame(parse_can_id(can_id), data)))
+            except (ValueError, TypeError, AttributeError) as e:
+                bad.append((row_id, ts, can_id, data, str(e)))
+        cur.executemany("INSERT INTO telemetry_new (id, timestamp, can_id, data) VALUES (?, ?, ?, ?)", good)
+        cur.executemany("INSERT INTO telemetry_rejected VALUES (?, ?, ?, ?, ?)", bad)
+        migrated += len(good)
+        rejected += len(bad)
+
+    cur.execute("DROP TABLE telemetry")
+    cur.execute("ALTER TABLE telemetry_new RENAME TO telemetry")
+    for statement in SCHEMA[1][1:]:
+        cur.execute(statement)
+    cur.execute("PRAGMA user_version = 1")
+    conn.commit()
+    ensure_schema(conn) # Apply the remaining schema versions
+    decoded = sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                  for table in ("rpm_samples", "pto_samples", "fault_events", "signal_values"))
+    conn.close()
+    if migrated and not decoded:
+        raise RuntimeError(f"Migrated {migrated:,} rows but none of them decoded; the frames are kept in telemetry. Check their "
+                           "CAN IDs and payload layouts against data/j1939_signals.csv, then run: python ingest.py rebuild " + db_path)
+
+    print(f"Migrated {migrated:,} rows to schema version {SCHEMA_VERSION}"
+          + (f" ({rejected:,} unparseable rows kept in telemetry_rejected)" if rejected else ""))
+    return migrated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telemetry database schema tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Migrate a database to the typed, indexed schema in place")
+    migrate_parser.add_argument("db_path", nargs="?", default="db/telemetry.db", help="SQLite database path")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate(args.db_path)
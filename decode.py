@@ -0,0 +1,197 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from database import PAYLOAD_BYTES, PAD_BYTE
+
+# Whole-column J1939 payload decoding used at ingest
+# Payloads are turned into an (n, 8) uint8 matrix once, then each signal is a few array operations
+
+# Convert a column of payloads (8-byte BLOBs or hex strings) into an (n_valid, 8) uint8 matrix
+# Returns the matrix and a boolean mask of the rows that were valid, so invalid frames can be dropped in bulk
+def payload_matrix(payloads):
+    values = payloads.to_numpy(dtype=object) if isinstance(payloads, pd.Series) else np.asarray(payloads, dtype=object)
+    n = len(values)
+    if n == 0:
+        return np.empty((0, PAYLOAD_BYTES), dtype=np.uint8), np.zeros(0, dtype=bool)
+
+    # Fast path: a column of BLOBs (as stored) decodes with one join; only exact 8-byte payloads are valid
+    if isinstance(values[0], bytes):
+        try:
+            lengths = np.fromiter(map(len, values), dtype=np.int64, count=n)
+            valid = lengths == PAYLOAD_BYTES
+            joined = b"".join(values if valid.all() else values[valid])
+            return np.frombuffer(joined, dtype=np.uint8).reshape(-1, PAYLOAD_BYTES), valid
+        except TypeError:
+            pass # Mixed types or missing values: validate row by row below
+
+    # Fast path: equal-length hex strings (CSV files, API batches) decode with one join
+    try:
+        width = len(values[0]) // 2
+        joined = bytes.fromhex("".join(values))
+        if 1 <= width <= PAYLOAD_BYTES and len(joined) == n * width and len(values[0]) == 2 * width:
+            lengths = np.fromiter(map(len, values), dtype=np.int64, count=n)
+            if (lengths == 2 * width).all():
+                matrix = np.full((n, PAYLOAD_BYTES), PAD_BYTE[0], dtype=np.uint8) # Pad short payloads with FF
+                matrix[:, :width] = np.frombuffer(joined, dtype=np.uint8).reshape(n, width)
+                return matrix, np.ones(n, dtype=bool)
+    except (TypeError, ValueError):
+        pass # Missing values or bad hex: validate row by row below
+
+    is_bytes = np.fromiter((isinstance(v, bytes) for v in values), dtype=bool, count=n)
+    # Hex text (CSV files, API payloads): validate with vectorized string ops, pad to 8 bytes with FF
+    text = pd.Series(values, dtype=object)
+    if is_bytes.any():
+        text[is_bytes] = text[is_bytes].map(bytes.hex) # Mixed column: treat BLOBs as their hex text
+    is_str = np.fromiter((isinstance(v, str) for v in text), dtype=bool, count=n)
+    text = text.where(is_str).astype("string").str.strip() # Non-text values become NA and are dropped
+    valid = text.str.fullmatch(r"(?:[0-9A-Fa-f]{2}){1,8}").fillna(False).to_numpy(dtype=bool)
+    padded = text[valid].str.ljust(2 * PAYLOAD_BYTES, "F")
+    matrix = np.frombuffer(bytes.fromhex("".join(padded.tolist())), dtype=np.uint8).reshape(-1, PAYLOAD_BYTES)
+    return matrix, valid
+
+# Table-driven signal decoding: data/j1939_signals.csv defines each signal's PGN, bit layout, scale,
+# offset and unit (like a DBC file). Definitions are compiled once per PGN into shift/mask operations on
+# the payload read as a little-endian 64-bit word, frames are matched on PGN regardless of source
+# address, and new signals only need a CSV row.
+#
+# bits: "start:length" in J1939 bit order (bit 0 = byte 1 bit 1), with "+start:length" for fields split
+# across bytes (least significant part first), e.g. the DM1 SPN "16:16+37:3"
+# valid_max: largest valid raw value (default: the J1939 "not available"/"error" ranges for the field size)
+# repeat_bits: stride of repeated groups, e.g. the DTCs packed in a DM1 message
+# store: 1 = keep decoded values in the signal_values table (signals with their own tables use 0)
+SIGNALS_PATH = "data/j1939_signals.csv"
+
+# PGN of each 29-bit CAN ID: data page, PDU format and PDU specific, where PDU1 PGNs (PF < 240)
+# carry a destination address in PS that is not part of the PGN; the source address is ignored
+def pgn_of(can_ids):
+    pgn = (np.asarray(can_ids, dtype=np.int64) >> 8) & 0x3FFFF
+    return np.where(((pgn >> 8) & 0xFF) < 240, pgn & 0x3FF00, pgn)
+
+# Payload matrix rows as little-endian 64-bit words (byte 1 in the low bits)
+def payload_words(matrix):
+    return np.ascontiguousarray(matrix, dtype=np.uint8).view("<u8").ravel()
+
+# One signal definition; raw() extracts every instance of the field from an array of payload words at once
+class Signal:
+    def __init__(self, pgn, name, spn, segments, scale=1.0, offset=0.0, unit="", valid_max=None, repeat_bits=0, store=False):
+        self.pgn = pgn
+        self.name = name
+        self.spn = spn
+        self.segments = segments # [(start bit, length)], least significant part first
+        self.scale = scale
+        self.offset = offset
+        self.unit = unit
+        self.length = sum(length for _, length in segments)
+        self.end = max(start + length for start, length in segments)
+        if valid_max is None:
+            # Whole bytes: 0xFB.. and above are reserved/error/not available; bit fields: all ones = not available
+            valid_max = (0xFB << (self.length - 8)) - 1 if self.length % 8 == 0 else max(1, (1 << self.length) - 2)
+        self.valid_max = valid_max
+        self.repeat_bits = repeat_bits
+        self.store = store
+
+    # Number of complete instances in a payload of width_bits
+    def instances(self, width_bits):
+        if not self.repeat_bits:
+            return 1 if self.end <= width_bits else 0
+        return max(0, (width_bits - self.end) // self.repeat_bits + 1)
+
+    # Raw field values as an (n, instances) uint64 array
+    def raw(self, words, instances):
+        base = np.arange(instances, dtype=np.uint64) * np.uint64(self.repeat_bits)
+        value = np.zeros((len(words), instances), dtype=np.uint64)
+        shift = 0
+        for start, length in self.segments:
+            part = (words[:, None] >> (base + np.uint64(start))) & np.uint64((1 << length) - 1)
+            value |= part << np.uint64(shift)
+            shift += length
+        return value
+
+    # Scaled values as an (n, instances) float array; raw values above valid_max are NaN
+    def values(self, words, instances):
+        raw = self.raw(words, instances)
+        scaled = raw.astype(np.float64) * self.scale + self.offset
+        scaled[raw > np.uint64(self.valid_max)] = np.nan
+        return scaled
+
+# The signals of one PGN; repeated signals share one instance count so their values line up
+# (e.g. dtc_spn[i] and dtc_fmi[i] belong to the same DTC)
+class PGNDecoder:
+    def __init__(self, pgn, name, signals, width_bits=PAYLOAD_BYTES * 8):
+        self.pgn = pgn
+        self.name = name
+        self.signals = signals
+        self.repeated = min((s.instances(width_bits) for s in signals if s.repeat_bits), default=0)
+        for s in signals:
+            if not s.repeat_bits and s.end > width_bits:
+                raise ValueError(f"{name} signal {s.name} ends at bit {s.end}, past the {width_bits}-bit payload")
+
+    # Decode frames of this PGN: {signal: (rows, instance, values)} with values flattened frame by frame
+    def decode(self, rows, words):
+        out = {}
+        for s in self.signals:
+            instances = self.repeated if s.repeat_bits else 1
+            values = s.values(words, instances)
+            out[s.name] = (np.repeat(rows, instances), np.tile(np.arange(instances), len(rows)), values.ravel())
+        return out
+
+# Parse "start:length[+start:length...]"
+def _segments(bits):
+    segments = []
+    for part in bits.split("+"):
+        start, length = part.split(":")
+        segments.append((int(start), int(length)))
+    if any(start < 0 or length < 1 for start, length in segments):
+        raise ValueError(f"Invalid bit layout: {bits!r}")
+    return segments
+
+@lru_cache(maxsize=4)
+def _load_signals(path, mtime):
+    table = pd.read_csv(path, dtype=str, keep_default_na=False)
+    signals, names = {}, {}
+    for line, row in enumerate(table.itertuples(index=False), start=2):
+        try:
+            pgn = int(row.pgn, 0)
+            signal = Signal(pgn, row.signal, int(row.spn) if row.spn else None, _segments(row.bits),
+                            float(row.scale or 1), float(row.offset or 0), row.unit,
+                            int(row.valid_max, 0) if row.valid_max else None,
+                            int(row.repeat_bits) if row.repeat_bits else 0, row.store.strip() == "1")
+        except ValueError as e:
+            raise ValueError(f"{path} line {line}: {e}")
+        if signal.name in names:
+            raise ValueError(f"{path} line {line}: duplicate signal name {signal.name!r}")
+        names[signal.name] = row.pgn_name
+        signals.setdefault(pgn, []).append(signal)
+    return {pgn: PGNDecoder(pgn, names[group[0].name], group) for pgn, group in signals.items()}
+
+# Compiled decoders per PGN from a signal definitions file, reloaded when the file changes
+def load_signals(path=SIGNALS_PATH):
+    return _load_signals(path, os.path.getmtime(path))
+
+# Names of the signals kept in the signal_values table
+def stored_signals(decoders):
+    return [s.name for decoder in decoders.values() for s in decoder.signals if s.store]
+
+# Decode every defined signal in a batch of frames (can_ids and an (n, 8) payload matrix)
+# Returns {signal: (frame rows, instance, values)}; values are NaN where the field is not available
+def decode_frames(can_ids, matrix, decoders=None):
+    decoders = load_signals() if decoders is None else decoders
+    pgns = pgn_of(can_ids)
+    words = payload_words(matrix)
+    out = {}
+    for pgn in np.unique(pgns).tolist():
+        decoder = decoders.get(pgn)
+        if decoder is not None:
+            rows = np.flatnonzero(pgns == pgn)
+            out.update(decoder.decode(rows, words[rows]))
+    return out
+
+# Format payload rows back into uppercase hex strings (for display, downloads and the API)
+def payload_hex(matrix):
+    if len(matrix) == 0:
+        return np.empty(0, dtype=object)
+    text = np.ascontiguousarray(matrix).tobytes().hex().upper().encode("ascii")
+    return np.frombuffer(text, dtype=f"S{2 * PAYLOAD_BYTES}").astype(f"U{2 * PAYLOAD_BYTES}").astype(object)
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+# Server-side downsampling for long time series so charts and API responses carry a bounded number of points
+
+# Largest-Triangle-Three-Buckets: keeps the visual shape of a line with n_out points
+# Returns sorted row positions (first and last points always kept)
+def lttb_indices(x, y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (n - 2) / (n_out - 2)
+    bounds = (np.arange(n_out - 1) * every).astype(np.int64) + 1 # Bucket edges over points 1..n-2
+    bounds[-1] = n - 1
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = bounds[i], bounds[i + 1]
+        # Average of the next bucket (or the last point for the final bucket)
+        if i + 2 < len(bounds):
+            next_x, next_y = x[end:bounds[i + 2]].mean(), y[end:bounds[i + 2]].mean()
+        else:
+            next_x, next_y = x[n - 1], y[n - 1]
+        # Pick the point forming the largest triangle with the previous pick and the next bucket's average
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+# Min/max per bucket: keeps every peak and edge (good for step signals like PTO on/off)
+# Returns sorted row positions, at most n_out of them
+def minmax_indices(y, n_out):
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    buckets = (n_out - 2) // 2
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+
+    # First position in each bucket where the bucket's min (or max) occurs
+    bucket_min = np.minimum.reduceat(y, edges[:-1])
+    bucket_max = np.maximum.reduceat(y, edges[:-1])
+    min_pos = np.flatnonzero(y == bucket_min[bucket_of])
+    max_pos = np.flatnonzero(y == bucket_max[bucket_of])
+    min_pos = min_pos[np.unique(bucket_of[min_pos], return_index=True)[1]]
+    max_pos = max_pos[np.unique(bucket_of[max_pos], return_index=True)[1]]
+    return np.unique(np.concatenate(([0, n - 1], min_pos, max_pos)))
+
+# Downsample a DataFrame to about n_out rows using the y column's shape; other columns come along
+def downsample(df, y_col, n_out, method="lttb", x_col="timestamp"):
+    if n_out is None or len(df) <= n_out:
+        return df
+    y = df[y_col].to_numpy(dtype=np.float64)
+    if method == "minmax":
+        positions = minmax_indices(y, n_out)
+    elif method == "lttb":
+        x = df[x_col]
+        x = x.astype("int64").to_numpy() if pd.api.types.is_datetime64_any_dtype(x) else x.to_numpy()
+        positions = lttb_indices(x, y, n_out)
+    else:
+        raise ValueError(f"Unknown downsampling method: {method!r} (use 'lttb' or 'minmax')")
+    return df.iloc[positions]
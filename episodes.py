@@ -0,0 +1,80 @@
+import argparse
+import sqlite3
+
+import numpy as np
+
+from database import ensure_schema
+
+# Fault episodes: DM1 rebroadcasts an active fault every second, so one fault produces a row per second in
+# fault_events. Episodes collapse consecutive frames of the same vehicle/SPN/FMI into one row with start, end
+# and occurrence count, updated at ingest. MTBF, severity counts and fault frequency are computed over
+# episodes. Like the rollups, episodes keep history after retention prunes raw rows;
+# `python episodes.py rebuild` recomputes them from the fault_events rows that are still present.
+
+# Frames of one SPN/FMI at most this far apart belong to the same episode (a few missed 1 s rebroadcasts)
+EPISODE_GAP_MS = 5000
+
+# Add a batch of decoded fault frames (epoch-ms timestamps, vehicle ids, SPNs, FMIs) to fault_episodes; caller commits.
+# Each vehicle/SPN/FMI run extends the stored episode it is within EPISODE_GAP_MS of, otherwise starts a new one.
+def update_fault_episodes(conn, timestamps, vehicle_ids, spns, fmis):
+    if len(timestamps) == 0:
+        return
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    keys = np.array([v if v is not None else -1 for v in vehicle_ids], dtype=np.int64) # -1 = no vehicle id
+    spns = np.asarray(spns, dtype=np.int64)
+    fmis = np.asarray(fmis, dtype=np.int64)
+
+    # Sort by vehicle/SPN/FMI, then time; a run breaks where the key changes or the gap is too long
+    order = np.lexsort((timestamps, fmis, spns, keys))
+    keys, spns, fmis, timestamps = keys[order], spns[order], fmis[order], timestamps[order]
+    gap = np.ones(len(order), dtype=bool)
+    gap[1:] = (keys[1:] != keys[:-1]) | (spns[1:] != spns[:-1]) | (fmis[1:] != fmis[:-1]) | \
+              (np.diff(timestamps) > EPISODE_GAP_MS)
+    starts = np.flatnonzero(gap)
+    last = np.append(starts[1:], len(order)) - 1
+
+    for first, final in zip(starts.tolist(), last.tolist()):
+        vehicle_id = int(keys[first]) if keys[first] >= 0 else None
+        spn, fmi = int(spns[first]), int(fmis[first])
+        start, end, count = int(timestamps[first]), int(timestamps[final]), final - first + 1
+        episode = conn.execute('''
+            SELECT id FROM fault_episodes
+            WHERE vehicle_id IS ? AND spn = ? AND fmi = ? AND end_ts >= ? AND start_ts <= ?
+            ORDER BY end_ts DESC LIMIT 1
+        ''', (vehicle_id, spn, fmi, start - EPISODE_GAP_MS, end + EPISODE_GAP_MS)).fetchone()
+        if episode:
+            conn.execute('''
+                UPDATE fault_episodes SET start_ts = MIN(start_ts, ?), end_ts = MAX(end_ts, ?), occurrences = occurrences + ?
+                WHERE id = ?
+            ''', (start, end, count, episode[0]))
+        else:
+            conn.execute("INSERT INTO fault_episodes (vehicle_id, spn, fmi, start_ts, end_ts, occurrences) VALUES (?, ?, ?, ?, ?, ?)",
+                         (vehicle_id, spn, fmi, start, end, count))
+
+# Recompute fault_episodes from fault_events in raw_id order; caller commits
+def rebuild_fault_episodes(conn, batch_size=100000):
+    conn.execute("DELETE FROM fault_episodes")
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT raw_id, timestamp, vehicle_id, spn, fmi FROM fault_events WHERE raw_id > ? ORDER BY raw_id LIMIT ?",
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        update_fault_episodes(conn, *list(zip(*rows))[1:])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fault episode table tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recompute fault_episodes from the fault_events table")
+    rebuild_parser.add_argument("db_path", nargs="?", default="db/telemetry.db", help="SQLite database path")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        conn = sqlite3.connect(args.db_path)
+        ensure_schema(conn)
+        rebuild_fault_episodes(conn)
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM fault_episodes").fetchone()[0]
+        conn.close()
+        print(f"Rebuilt fault_episodes: {count:,} episodes")
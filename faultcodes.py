@@ -0,0 +1,95 @@
+import os
+import textwrap
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Process-wide SPN/FMI fault dictionary (data/spn_fmi_decoder.csv), loaded once and reloaded only when the
+# file changes. Codes are packed as spn << 5 | fmi and kept sorted, so a column of faults is described with
+# one searchsorted; descriptions, chart labels and severities are categoricals built from precomputed tables.
+
+DECODER_PATH = "data/spn_fmi_decoder.csv"
+UNKNOWN = "Unknown SPN/FMI"
+WRAP_WIDTH = 25 # Fault chart label width
+SEVERITIES = ["Critical", "Warning", "Info"]
+SENTINEL = np.int64(1) << 62 # Above every packed code, so a lookup never runs off the end
+
+# Severity category per FMI (0-31): 0-1 Critical, 2-4 Warning, everything else Info
+SEVERITY_BY_FMI = np.full(32, 2, dtype=np.int8)
+SEVERITY_BY_FMI[[0, 1]] = 0
+SEVERITY_BY_FMI[[2, 3, 4]] = 1
+
+# Packed dictionary key; SPNs are 19 bits and FMIs 5 bits in a DM1 DTC
+def pack_code(spn, fmi):
+    return np.asarray(spn, dtype=np.int64) << 5 | np.asarray(fmi, dtype=np.int64)
+
+# Severity category codes (index into SEVERITIES) for a column of FMIs
+def severity_codes(fmis):
+    fmis = np.asarray(fmis, dtype=np.int64)
+    return np.where((fmis >= 0) & (fmis < 32), SEVERITY_BY_FMI[np.clip(fmis, 0, 31)], 2)
+
+# Chart label for a description: wrapped at WRAP_WIDTH, with a line break at the nearest space
+@lru_cache(maxsize=65536)
+def wrap_label(description):
+    return "\n".join(textwrap.wrap(description, width=WRAP_WIDTH))
+
+class FaultDictionary:
+    def __init__(self, codes, description_codes, descriptions):
+        if UNKNOWN not in descriptions:
+            descriptions = descriptions + [UNKNOWN]
+        self.descriptions = descriptions # Unique descriptions (categories)
+        self.unknown = descriptions.index(UNKNOWN) # Description index of codes not in the file
+        self.codes = np.append(codes, SENTINEL) # Sorted packed codes
+        self.description_codes = np.append(description_codes, self.unknown) # Index into descriptions per code
+        # Wrapped once per unique description; label_codes maps a description index to its label category
+        self.label_of = {d: wrap_label(d) for d in descriptions}
+        label_codes, labels = pd.factorize(pd.Series([self.label_of[d] for d in descriptions]))
+        self.label_codes, self.labels = label_codes.astype(np.int64), list(labels)
+
+    def __len__(self):
+        return len(self.codes) - 1
+
+    # Description index per (spn, fmi) pair; unknown codes get the UNKNOWN index
+    def lookup(self, spns, fmis):
+        keys = pack_code(spns, fmis)
+        position = np.searchsorted(self.codes, keys)
+        return np.where(self.codes[position] == keys, self.description_codes[position], self.unknown)
+
+    # Categorical description, wrapped label and severity columns for a column of faults
+    def describe(self, spns, fmis):
+        index = self.lookup(spns, fmis)
+        return (pd.Categorical.from_codes(index, self.descriptions),
+                pd.Categorical.from_codes(self.label_codes[index], self.labels),
+                pd.Categorical.from_codes(severity_codes(fmis), SEVERITIES))
+
+    # (description, wrapped label, severity) of one fault
+    def describe_one(self, spn, fmi):
+        index = int(self.lookup([spn], [fmi])[0])
+        description = self.descriptions[index]
+        return description, self.label_of[description], SEVERITIES[int(severity_codes([fmi])[0])]
+
+    # Wrapped label for any description (precomputed for the dictionary's own)
+    def label(self, description):
+        label = self.label_of.get(description)
+        return label if label is not None else wrap_label(description)
+
+@lru_cache(maxsize=4)
+def _load_fault_codes(path, mtime):
+    table = pd.read_csv(path, dtype={"spn": "int64", "fmi": "int64", "description": str}, keep_default_na=False)
+    spns, fmis = table["spn"].to_numpy(), table["fmi"].to_numpy()
+    bad = np.flatnonzero((spns < 0) | (spns >= 1 << 19) | (fmis < 0) | (fmis >= 32))
+    if len(bad):
+        raise ValueError(f"{path} line {bad[0] + 2}: SPN must be 0-524287 and FMI 0-31")
+    codes = pack_code(spns, fmis)
+    order = np.argsort(codes, kind="stable")
+    duplicate = np.flatnonzero(np.diff(codes[order]) == 0)
+    if len(duplicate):
+        line = order[duplicate[0] + 1] + 2
+        raise ValueError(f"{path} line {line}: duplicate SPN/FMI {spns[line - 2]}/{fmis[line - 2]}")
+    description_codes, descriptions = pd.factorize(table["description"])
+    return FaultDictionary(codes[order], description_codes[order].astype(np.int64), list(descriptions))
+
+# The fault dictionary for a decoder file, reloaded when the file changes
+def load_fault_codes(path=DECODER_PATH):
+    return _load_fault_codes(path, os.path.getmtime(path))
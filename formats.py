@@ -0,0 +1,126 @@
+import io
+
+import numpy as np
+
+# Response formats for bulk reads: rows are encoded chunk by chunk straight from a SQLite cursor,
+# so memory stays bounded by the chunk size instead of the result size
+
+# Format name -> MIME type (JSON first so it wins for */* and missing Accept headers)
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Column kinds used to type the chunks: "int", "float", "bool" or "timestamp" (epoch ms)
+DTYPES = {"int": np.int64, "float": np.float64, "bool": np.int64, "timestamp": np.int64}
+
+# Pick a format from ?format= or the Accept header
+def negotiate(format_arg, accept):
+    if format_arg:
+        if format_arg not in FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+        return format_arg
+    best = accept.best_match(list(FORMATS.values()), default=FORMATS["json"])
+    return next(name for name, mime in FORMATS.items() if mime == best)
+
+# Yield {column: numpy array} chunks from an executed cursor; columns is a list of (name, kind)
+def cursor_chunks(cursor, columns, chunk_size=10000):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield {name: np.asarray(values, dtype=DTYPES[kind]) for (name, kind), values in zip(columns, zip(*rows))}
+
+# A single chunk from a DataFrame (e.g. after downsampling) with timestamps already as epoch ms
+def frame_chunks(df, columns):
+    yield {name: df[name].to_numpy(dtype=DTYPES[kind]) for name, kind in columns}
+
+# Text values per column: ISO 8601 UTC timestamps, true/false booleans, numbers as-is
+def _text_columns(chunk, columns, quote_timestamps):
+    out = []
+    for name, kind in columns:
+        values = chunk[name]
+        if kind == "timestamp":
+            text = np.datetime_as_string(values.astype("datetime64[ms]"), unit="ms", timezone="UTC")
+            out.append(np.char.add(np.char.add('"', text), '"') if quote_timestamps else text)
+        elif kind == "bool":
+            out.append(np.where(values != 0, "true", "false"))
+        else:
+            out.append(values.astype(str))
+    return out
+
+def _ndjson(chunks, columns):
+    template = "{{" + ",".join(f'"{name}":{{}}' for name, _ in columns) + "}}"
+    for chunk in chunks:
+        values = _text_columns(chunk, columns, quote_timestamps=True)
+        yield ("\n".join(template.format(*row) for row in zip(*values)) + "\n").encode()
+
+def _csv(chunks, columns):
+    yield (",".join(name for name, _ in columns) + "\n").encode()
+    for chunk in chunks:
+        values = _text_columns(chunk, columns, quote_timestamps=False)
+        yield ("\n".join(",".join(row) for row in zip(*values)) + "\n").encode()
+
+# Write-only file object that hands pyarrow's output back between record batches
+class _ByteSink(io.RawIOBase):
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+def _arrow_schema(pa, columns):
+    types = {"int": pa.int64(), "float": pa.float64(), "bool": pa.bool_(), "timestamp": pa.timestamp("ms", tz="UTC")}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+def _record_batch(pa, chunk, schema):
+    arrays = []
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_boolean(field.type):
+            values = values != 0
+        arrays.append(pa.array(values).cast(field.type))
+    return pa.record_batch(arrays, schema=schema)
+
+# Arrow IPC stream or Parquet file, one record batch / row group per chunk
+def _columnar(chunks, columns, parquet):
+    import pyarrow as pa # Only needed for the columnar formats
+    schema = _arrow_schema(pa, columns)
+    sink = _ByteSink()
+    if parquet:
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+    for chunk in chunks:
+        writer.write_batch(_record_batch(pa, chunk, schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+# Encode chunks in the given format; returns a generator of bytes
+def encode(fmt, chunks, columns):
+    if fmt == "ndjson":
+        return _ndjson(chunks, columns)
+    if fmt == "csv":
+        return _csv(chunks, columns)
+    if fmt in ("arrow", "parquet"):
+        return _columnar(chunks, columns, parquet=fmt == "parquet")
+    raise ValueError(f"Unsupported streaming format: {fmt!r}")
@@ -0,0 +1,287 @@
+import threading
+from collections import Counter, OrderedDict, deque
+
+import pandas as pd
+
+from database import pool
+from faultcodes import load_fault_codes
+from episodes import EPISODE_GAP_MS
+
+# Running aggregates are kept per block of BLOCK_IDS raw ids, so evicting pruned rows drops whole block
+# summaries and re-reads at most one partly pruned block instead of keeping every retained row in memory
+BLOCK_IDS = 4096
+
+# Sliding min or max over rows in id order: a monotonic deque of (id, value), evicting the oldest ids
+class WindowExtreme:
+    def __init__(self, is_max):
+        self.is_max = is_max
+        self.items = deque()
+
+    def push(self, row_id, value):
+        items = self.items
+        if self.is_max:
+            while items and items[-1][1] <= value:
+                items.pop()
+        else:
+            while items and items[-1][1] >= value:
+                items.pop()
+        items.append((row_id, value))
+
+    def evict_before(self, min_id):
+        while self.items and self.items[0][0] < min_id:
+            self.items.popleft()
+
+    def value(self):
+        return self.items[0][1] if self.items else None
+
+# Stateful analyzer for the dashboard: remembers the last processed raw_id per signal table,
+# fetches only newer rows on refresh and keeps running aggregates (O(new rows) per refresh).
+# Rows pruned from the front by retention are evicted using each table's MIN(raw_id): the aggregates of
+# whole blocks are subtracted and a block that is only partly pruned is re-read (at most BLOCK_IDS ids).
+# Fault stats count fault episodes (episodes.py) that end within the retained fault_events rows.
+class IncrementalAnalyzer:
+    def __init__(self, db_file, decoder_path="data/spn_fmi_decoder.csv"):
+        self.db_file = db_file
+        self.decoder_path = decoder_path
+        self.lock = threading.Lock() # Shared between Streamlit sessions (threads)
+        self.reset()
+
+    # Clear all running state (next refresh reloads everything)
+    def reset(self):
+        self.last_id = {"rpm_samples": 0, "pto_samples": 0, "fault_episodes": 0}
+
+        # RPM: block -> [first id, count, sum], running count and sum, sliding min/max
+        self.rpm_blocks = OrderedDict()
+        self.rpm_count = 0
+        self.rpm_sum = 0.0
+        self.rpm_min = WindowExtreme(is_max=False)
+        self.rpm_max = WindowExtreme(is_max=True)
+
+        # PTO: block -> [first id, engaged seconds, activations, {vehicle: [first state, last state]}], running
+        # engaged seconds and activations. As in the rollups, both are per vehicle: an activation is an off -> on
+        # change from the vehicle's previous row (or an engaged first row), engaged seconds are distinct seconds.
+        self.pto_blocks = OrderedDict()
+        self.pto_engaged = 0
+        self.pto_activations = 0
+        self.pto_state = {} # Vehicle -> state of its newest row
+        self.engaged_second = {} # Vehicle -> its last counted engaged second
+        self.pto_vehicle_blocks = Counter() # Vehicle -> number of blocks holding its rows
+
+        # Faults: episode id -> (start, id, spn, fmi, description, wrapped, severity, end) in id order, with counters
+        self.episodes = OrderedDict()
+        self.severity_counts = Counter()
+        self.fault_counts = Counter()
+        self.latest_end = 0 # Newest episode end seen; episodes ending near it may still be extended
+
+    # Fetch rows added since the last refresh and update the aggregates
+    def refresh(self):
+        with self.lock:
+            conn = pool.get(self.db_file) # Long-lived connection for the calling session's thread
+            bounds = {table: self._bounds(conn, table, "id" if table == "fault_episodes" else "raw_id") for table in self.last_id}
+            # A table whose newest id went backwards was cleared or recreated: start over
+            if any((max_id or 0) < self.last_id[table] for table, (_, max_id) in bounds.items()):
+                self.reset()
+            self._update_rpm(conn, bounds["rpm_samples"][0])
+            self._update_pto(conn, bounds["pto_samples"][0])
+            self._update_faults(conn)
+        return self
+
+    # MIN/MAX id of a table (two primary-key lookups)
+    def _bounds(self, conn, table, column="raw_id"):
+        return conn.execute(f"SELECT (SELECT MIN({column}) FROM {table}), (SELECT MAX({column}) FROM {table})").fetchone()
+
+    # Rows with raw_id above the high-water mark, in id order
+    def _new_rows(self, conn, table, columns):
+        rows = conn.execute(f"SELECT raw_id, {columns} FROM {table} WHERE raw_id > ? ORDER BY raw_id",
+                            (self.last_id[table],)).fetchall()
+        if rows:
+            self.last_id[table] = rows[-1][0]
+        return rows
+
+    # Drop the summaries of blocks entirely below min_id; returns the first remaining block if it is partly
+    # pruned (its summary must be recomputed from the rows still present), else None
+    def _evict_blocks(self, blocks, min_id, drop):
+        while blocks:
+            block, summary = next(iter(blocks.items()))
+            if (block + 1) * BLOCK_IDS > min_id:
+                return block if summary[0] < min_id else None
+            del blocks[block]
+            drop(summary)
+        return None
+
+    def _update_rpm(self, conn, min_id):
+        min_id = min_id if min_id is not None else self.last_id["rpm_samples"] + 1
+        def drop(summary):
+            self.rpm_count -= summary[1]
+            self.rpm_sum -= summary[2]
+        block = self._evict_blocks(self.rpm_blocks, min_id, drop)
+        if block is not None: # Partly pruned: recount the rows that are left
+            drop(self.rpm_blocks.pop(block))
+            count, total = conn.execute("SELECT COUNT(*), TOTAL(rpm) FROM rpm_samples WHERE raw_id >= ? AND raw_id < ? AND raw_id <= ?",
+                                        (min_id, (block + 1) * BLOCK_IDS, self.last_id["rpm_samples"])).fetchone()
+            if count:
+                self.rpm_blocks[block] = [min_id, count, total]
+                self.rpm_blocks.move_to_end(block, last=False)
+                self.rpm_count += count
+                self.rpm_sum += total
+        self.rpm_min.evict_before(min_id)
+        self.rpm_max.evict_before(min_id)
+
+        for row_id, rpm in self._new_rows(conn, "rpm_samples", "rpm"):
+            summary = self.rpm_blocks.get(row_id // BLOCK_IDS)
+            if summary is None:
+                summary = self.rpm_blocks[row_id // BLOCK_IDS] = [row_id, 0, 0.0]
+            summary[1] += 1
+            summary[2] += rpm
+            self.rpm_count += 1
+            self.rpm_sum += rpm
+            self.rpm_min.push(row_id, rpm)
+            self.rpm_max.push(row_id, rpm)
+
+    # Forget the rows of a dropped block summary (except vehicles in keep, whose rows are still in its block).
+    # A vehicle's next retained row loses its previous row, so it now counts as an activation if engaged.
+    def _drop_pto_vehicles(self, summary, keep=()):
+        for vehicle, (_, last_on) in summary[3].items():
+            if vehicle in keep:
+                continue
+            self.pto_vehicle_blocks[vehicle] -= 1
+            if not self.pto_vehicle_blocks[vehicle]: # No rows of this vehicle left
+                del self.pto_vehicle_blocks[vehicle]
+                self.pto_state.pop(vehicle, None)
+                self.engaged_second.pop(vehicle, None)
+            elif last_on:
+                following = next(s for s in self.pto_blocks.values() if vehicle in s[3])
+                if following[3][vehicle][0]: # On after on: not counted until now
+                    following[2] += 1
+                    self.pto_activations += 1
+
+    def _update_pto(self, conn, min_id):
+        min_id = min_id if min_id is not None else self.last_id["pto_samples"] + 1
+        def drop(summary, keep=()):
+            self.pto_engaged -= summary[1]
+            self.pto_activations -= summary[2]
+            self._drop_pto_vehicles(summary, keep)
+        block = self._evict_blocks(self.pto_blocks, min_id, drop)
+        if block is not None: # Partly pruned: recount the rows that are left
+            old = self.pto_blocks.pop(block)
+            rows = conn.execute("SELECT timestamp, vehicle_id, pto_on FROM pto_samples WHERE raw_id >= ? AND raw_id < ? AND raw_id <= ? ORDER BY raw_id",
+                                (min_id, (block + 1) * BLOCK_IDS, self.last_id["pto_samples"])).fetchall()
+            state, vehicles, activations = {}, {}, 0
+            for _, vehicle_id, pto_on in rows:
+                activations += pto_on and not state.get(vehicle_id, 0)
+                state[vehicle_id] = pto_on
+                vehicles.setdefault(vehicle_id, [pto_on, pto_on])[1] = pto_on
+            engaged = len({(vehicle_id, timestamp // 1000) for timestamp, vehicle_id, pto_on in rows if pto_on})
+            if rows:
+                self.pto_blocks[block] = [min_id, engaged, activations, vehicles]
+                self.pto_blocks.move_to_end(block, last=False)
+                self.pto_engaged += engaged
+                self.pto_activations += activations
+            drop(old, keep=vehicles)
+
+        for row_id, timestamp, vehicle_id, pto_on in self._new_rows(conn, "pto_samples", "timestamp, vehicle_id, pto_on"):
+            activation = bool(pto_on and not self.pto_state.get(vehicle_id, 0)) # Off -> on, including across refreshes
+            self.pto_state[vehicle_id] = pto_on
+            engaged = bool(pto_on and self.engaged_second.get(vehicle_id) != timestamp // 1000) # A new engaged second
+            if engaged:
+                self.engaged_second[vehicle_id] = timestamp // 1000
+            summary = self.pto_blocks.get(row_id // BLOCK_IDS)
+            if summary is None:
+                summary = self.pto_blocks[row_id // BLOCK_IDS] = [row_id, 0, 0, {}]
+            if vehicle_id not in summary[3]:
+                summary[3][vehicle_id] = [pto_on, pto_on]
+                self.pto_vehicle_blocks[vehicle_id] += 1
+            summary[3][vehicle_id][1] = pto_on
+            summary[1] += engaged
+            summary[2] += activation
+            self.pto_engaged += engaged
+            self.pto_activations += activation
+
+    # New episodes, plus open episodes extended since the last refresh; episodes that ended before the oldest
+    # retained fault frame are evicted from the front (id order)
+    def _update_faults(self, conn):
+        codes = load_fault_codes(self.decoder_path) # Process-wide dictionary, reloaded if the file changed
+        oldest = conn.execute("SELECT MIN(timestamp) FROM fault_events").fetchone()[0]
+        rows = conn.execute("SELECT id, start_ts, end_ts, spn, fmi FROM fault_episodes WHERE id > ? OR end_ts >= ? ORDER BY id",
+                            (self.last_id["fault_episodes"], self.latest_end - EPISODE_GAP_MS)).fetchall()
+        for episode_id, start, end, spn, fmi in rows:
+            if episode_id not in self.episodes:
+                if episode_id <= self.last_id["fault_episodes"]:
+                    continue # Already evicted
+                fault = (start, episode_id, spn, fmi, *codes.describe_one(spn, fmi), end)
+                self.severity_counts[fault[6]] += 1
+                self.fault_counts[(fault[5], fault[6])] += 1
+            else:
+                fault = self.episodes[episode_id][:7] + (end,)
+            self.episodes[episode_id] = fault
+            self.latest_end = max(self.latest_end, end)
+        if rows:
+            self.last_id["fault_episodes"] = max(self.last_id["fault_episodes"], rows[-1][0])
+
+        while self.episodes:
+            fault = next(iter(self.episodes.values()))
+            if oldest is not None and fault[7] >= oldest:
+                break
+            del self.episodes[fault[1]]
+            self.severity_counts[fault[6]] -= 1
+            self.fault_counts[(fault[5], fault[6])] -= 1
+
+    # Same keys as analyze.get_rpm_stats
+    def rpm_stats(self):
+        count = self.rpm_count
+        return {
+            "min_rpm": round(self.rpm_min.value(), 2) if count else None,
+            "max_rpm": round(self.rpm_max.value(), 2) if count else None,
+            "avg_rpm": round(self.rpm_sum / count, 2) if count else None,
+        }
+
+    # Same keys as analyze.get_pto_stats
+    def pto_stats(self):
+        return {
+            "pto_usage_count": int(self.pto_activations),
+            "pto_duration_sec": int(self.pto_engaged),
+            "pto_duration_min": round(self.pto_engaged / 60, 2)
+        }
+
+    # Same keys as analyze.get_fault_stats over get_fault_episodes rows
+    def fault_stats(self):
+        if not self.episodes:
+            return {
+                "most_recent": None,
+                "last_fault_time": None,
+                "critical_count": 0,
+                "severity_counts": {}
+            }
+
+        timestamp, _, spn, fmi, description, wrapped, severity, _ = next(reversed(self.episodes.values()))
+        last_fault_time = pd.Timestamp(timestamp, unit="ms", tz="UTC")
+        return {
+            "total_faults": len(self.episodes),
+            "most_recent": {
+                "timestamp": last_fault_time,
+                "spn": spn,
+                "fmi": fmi,
+                "description": description,
+                "wrapped_description": wrapped,
+                "severity": severity
+            },
+            "last_fault_time": last_fault_time,
+            "critical_count": self.severity_counts["Critical"],
+            "warning_count": self.severity_counts["Warning"],
+            "info_count": self.severity_counts["Info"],
+            "severity_counts": {k: v for k, v in self.severity_counts.items() if v > 0}
+        }
+
+    # Mean time between fault episodes in seconds, as analyze.get_mtbf: (last start - first start) / (n - 1),
+    # from the oldest and newest retained episodes (ids are assigned in start order)
+    def mtbf(self):
+        count = len(self.episodes)
+        if count < 2:
+            return None
+        first, last = next(iter(self.episodes.values())), next(reversed(self.episodes.values()))
+        return (last[0] - first[0]) / 1000 / (count - 1)
+
+    # Top N fault codes, same columns as analyze.get_fault_frequency
+    def fault_frequency(self, top_n=10):
+        top = [(wrapped, severity, count) for (wrapped, severity), count in self.fault_counts.most_common() if count > 0][:top_n]
+        return pd.DataFrame(top, columns=["wrapped_description", "severity", "count"])
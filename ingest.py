@@ -0,0 +1,155 @@
+import argparse
+import sqlite3
+from itertools import repeat
+
+import numpy as np
+
+import decode
+from database import ensure_schema
+from rollups import update_rpm_rollups, update_pto_rollups, rebuild_rollups
+from episodes import update_fault_episodes, rebuild_fault_episodes
+from anomaly import update_anomalies, rebuild_anomalies
+from metrics import DECODE_SECONDS, ROWS_DECODED, INGEST_FRAMES, INGEST_SECONDS, ANOMALY_EVENTS
+
+# Decode-on-ingest: frames are decoded once when written (decode.decode_frames, driven by the J1939 signal
+# definitions) and stored as typed rows in rpm_samples, pto_samples, fault_events and signal_values;
+# the raw telemetry table stays the source of truth
+
+# Decode typed raw rows and write them to the signal tables (raw_id links back to telemetry.id)
+# Columns: ids, timestamps (epoch ms), can_ids, payloads (8-byte BLOBs), vehicle_ids; caller commits
+# New RPM/PTO samples and faults are also added to the rollup, fault episode and anomaly tables unless rollups=False, and to the shared-memory
+# live buffer if one is given (livebuffer.LiveBuffer)
+def write_decoded(conn, ids, timestamps, can_ids, payloads, vehicle_ids, rollups=True, live=None):
+    if len(ids) == 0:
+        return
+    with DECODE_SECONDS.time(step="payload_matrix"):
+        matrix, valid = decode.payload_matrix(payloads) # Invalid payloads are dropped in bulk
+    ids = np.asarray(ids, dtype=np.int64)[valid]
+    timestamps = np.asarray(timestamps, dtype=np.int64)[valid]
+    can_ids = np.asarray(can_ids, dtype=np.int64)[valid]
+    vehicle_ids = np.asarray(vehicle_ids, dtype=object)[valid]
+
+    decoders = decode.load_signals() # Compiled J1939 signal definitions (reloaded if the CSV changes)
+    with DECODE_SECONDS.time(step="decode_frames"):
+        signals = decode.decode_frames(can_ids, matrix, decoders)
+
+    # Rows of one decoded signal that have a value: (frame rows, values, mask over the decoded values)
+    def available(name):
+        rows, _, values = signals.get(name, (np.empty(0, dtype=np.int64), None, np.empty(0)))
+        mask = ~np.isnan(values)
+        return rows[mask], values[mask], mask
+
+    def rows(index, *values):
+        return list(zip(ids[index].tolist(), timestamps[index].tolist(), vehicle_ids[index].tolist(),
+                        *(v.tolist() for v in values)))
+
+    rpm, rpm_values, _ = available("engine_speed") # EEC1 engine speed (SPN 190)
+    conn.executemany("INSERT OR REPLACE INTO rpm_samples (raw_id, timestamp, vehicle_id, rpm) VALUES (?, ?, ?, ?)",
+                     rows(rpm, rpm_values))
+    ROWS_DECODED.inc(len(rpm), table="rpm_samples")
+
+    pto, pto_state, _ = available("pto_state") # CCVS1 PTO state (SPN 976): 0 = off, any other state = engaged
+    pto_on = (pto_state != 0).astype(np.int64)
+    conn.executemany("INSERT OR REPLACE INTO pto_samples (raw_id, timestamp, vehicle_id, pto_on) VALUES (?, ?, ?, ?)",
+                     rows(pto, pto_on))
+    ROWS_DECODED.inc(len(pto), table="pto_samples")
+
+    if rollups:
+        update_rpm_rollups(conn, timestamps[rpm], rpm_values)
+        update_pto_rollups(conn, timestamps[pto], pto_on, vehicle_ids[pto])
+        with DECODE_SECONDS.time(step="anomaly_detect"):
+            events = update_anomalies(conn, timestamps[rpm], vehicle_ids[rpm], rpm_values, timestamps[pto], vehicle_ids[pto], pto_on)
+        ANOMALY_EVENTS.inc(events)
+
+    # DM1 DTCs: dtc_spn and dtc_fmi line up instance by instance; SPN 0 means no active fault.
+    # fault_events holds one DTC per frame (the first; a single 8-byte DM1 frame carries one)
+    fault, spn, mask = available("dtc_spn")
+    fmi = np.empty(0)
+    if len(spn):
+        _, instance, fmi = signals["dtc_fmi"]
+        instance, fmi = instance[mask], fmi[mask]
+        first = (spn > 0) & (instance == 0) & ~np.isnan(fmi)
+        fault, spn, fmi = fault[first], spn[first].astype(np.int64), fmi[first].astype(np.int64)
+        conn.executemany("INSERT OR REPLACE INTO fault_events (raw_id, timestamp, vehicle_id, spn, fmi) VALUES (?, ?, ?, ?, ?)",
+                         rows(fault, spn, fmi))
+        ROWS_DECODED.inc(len(fault), table="fault_events")
+        if rollups:
+            update_fault_episodes(conn, timestamps[fault], vehicle_ids[fault], spn, fmi)
+
+    if live is not None:
+        live.append_decoded(timestamps, (rpm, rpm_values), (pto, pto_on), (fault, spn, fmi))
+
+    # Every other signal marked store=1 in the definitions
+    for name in decode.stored_signals(decoders):
+        if name in signals:
+            index, instance, values = signals[name]
+            mask = ~np.isnan(values)
+            conn.executemany("INSERT OR REPLACE INTO signal_values (raw_id, signal, instance, timestamp, vehicle_id, value) VALUES (?, ?, ?, ?, ?, ?)",
+                             zip(ids[index[mask]].tolist(), repeat(name), instance[mask].tolist(), timestamps[index[mask]].tolist(),
+                                 vehicle_ids[index[mask]].tolist(), values[mask].tolist()))
+            ROWS_DECODED.inc(int(mask.sum()), table="signal_values")
+
+# Insert typed frames (timestamp_ms, can_id, payload, vehicle_id) into telemetry and decode them in the same transaction
+# Returns the new telemetry ids; the caller commits. live: optional LiveBuffer that also receives the decoded samples
+# source labels the ingest metrics (csv, simulator, api, ...)
+def ingest_frames(conn, frames, live=None, source="other"):
+    frames = list(frames)
+    if not frames:
+        return []
+    with INGEST_SECONDS.time(source=source):
+        cur = conn.cursor()
+        cur.executemany("INSERT INTO telemetry (timestamp, can_id, data, vehicle_id) VALUES (?, ?, ?, ?)", frames)
+
+        # Rowids of a single-writer executemany are consecutive, ending at last_insert_rowid()
+        last_id = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids = list(range(last_id - len(frames) + 1, last_id + 1))
+        timestamps, can_ids, payloads, vehicle_ids = zip(*frames)
+        write_decoded(conn, ids, timestamps, can_ids, payloads, vehicle_ids, live=live)
+    INGEST_FRAMES.inc(len(frames), source=source)
+    return ids
+
+# Re-decode specific telemetry rows (e.g. after a PATCH changed their CAN ID or payload); caller commits
+# Rollups and fault episodes are append-only and keep the originally ingested values (rollups.py / episodes.py rebuild recompute them)
+def redecode(conn, ids):
+    ids = list(ids)
+    placeholders = ", ".join("?" * len(ids))
+    for table in ("rpm_samples", "pto_samples", "fault_events", "signal_values"):
+        conn.execute(f"DELETE FROM {table} WHERE raw_id IN ({placeholders})", ids)
+    rows = conn.execute(f"SELECT id, timestamp, can_id, data, vehicle_id FROM telemetry WHERE id IN ({placeholders})", ids).fetchall()
+    if rows:
+        write_decoded(conn, *zip(*rows), rollups=False)
+
+# Rebuild all signal tables (and then the rollups, fault episodes and anomaly alerts, unless rollups=False) from the raw telemetry table in id order; caller commits
+def rebuild_decoded(conn, batch_size=100000, rollups=True):
+    for table in ("rpm_samples", "pto_samples", "fault_events", "signal_values"):
+        conn.execute(f"DELETE FROM {table}")
+
+    last_id, total = 0, 0
+    while True:
+        rows = conn.execute("SELECT id, timestamp, can_id, data, vehicle_id FROM telemetry WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        write_decoded(conn, *zip(*rows), rollups=False)
+        total += len(rows)
+    if rollups:
+        rebuild_rollups(conn)
+        rebuild_fault_episodes(conn)
+        rebuild_anomalies(conn)
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode-on-ingest signal table tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Re-decode all raw telemetry into the signal and rollup tables")
+    rebuild_parser.add_argument("db_path", nargs="?", default="db/telemetry.db", help="SQLite database path")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        conn = sqlite3.connect(args.db_path)
+        ensure_schema(conn)
+        total = rebuild_decoded(conn)
+        conn.commit()
+        conn.close()
+        print(f"Decoded {total:,} telemetry rows into rpm_samples, pto_samples, fault_events, signal_values, the rollup tables, fault_episodes and anomaly_alerts")
@@ -1,5 +1,5 @@
 #!/bin/bash
 
 # Bash script to run the live demo for the telemetry dashboard.
-python simulate_loop.py &  # Generate new telemetry.csv
+python simulate_loop.py --live-buffer &  # Generate live telemetry (shared-memory buffer for the dashboard)
 streamlit run dashboard.py  # Run the Streamlit dashboard
\ No newline at end of file
@@ -0,0 +1,162 @@
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Shared-memory ring buffer of decoded samples for the live view: the simulator writes every decoded frame
+# into a fixed-size NumPy structured array in shared memory, and the dashboard maps the same memory
+# (no copy, no SQLite query, no decoding) to chart the last hour. SQLite stays the store for history.
+#
+# Layout: a 64-byte header (samples written so far, capacity, coverage start) followed by capacity samples.
+# There is one writer; samples are appended in timestamp order. Readers copy the slice they need and
+# retry if the writer lapped it while copying.
+
+LIVE_NAME = "telemetry_live" # Shared memory segment name (/dev/shm/telemetry_live on Linux)
+DEFAULT_CAPACITY = 1 << 19 # 524,288 samples (~11 MB): over an hour of high-rate simulator output
+
+# One decoded frame; fields a frame doesn't carry hold the missing markers (rpm NaN, pto_on -1, spn 0)
+SAMPLE = np.dtype([
+    ("timestamp", "<i8"), # Epoch ms
+    ("rpm", "<f8"),
+    ("pto_on", "i1"),
+    ("spn", "<i4"), # First active DM1 fault code
+    ("fmi", "i1"),
+])
+HEADER = np.dtype([
+    ("written", "<i8"), # Samples written since creation (slot = index % capacity)
+    ("capacity", "<i8"),
+    ("since", "<i8"), # Every sample at or after this timestamp (epoch ms) is still in the buffer
+])
+HEADER_BYTES = 64
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        # Older versions track attached segments too and would unlink the writer's segment when a reader exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+class LiveBuffer:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner # The creating process unlinks the segment on close
+        self.header = np.ndarray((), HEADER, buffer=shm.buf)
+        self.capacity = int(self.header["capacity"])
+        self.samples = np.ndarray((self.capacity,), SAMPLE, buffer=shm.buf, offset=HEADER_BYTES) # Zero-copy view, slot order
+
+    # Create the segment for a writer, replacing one left behind by a process that didn't exit cleanly
+    @classmethod
+    def create(cls, name=LIVE_NAME, capacity=DEFAULT_CAPACITY):
+        size = HEADER_BYTES + capacity * SAMPLE.itemsize
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((), HEADER, buffer=shm.buf)
+        header["written"], header["capacity"], header["since"] = 0, capacity, 0
+        del header # Release the export so close() can unmap
+        return cls(shm, owner=True)
+
+    # Map an existing segment for reading; None if no writer has created it
+    @classmethod
+    def attach(cls, name=LIVE_NAME):
+        try:
+            return cls(_attach(name), owner=False)
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        del self.header, self.samples # NumPy views must go before the mapping is closed
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Append samples (SAMPLE records in timestamp order); only the newest capacity samples are kept
+    def write(self, records):
+        records = records[-self.capacity:]
+        written = int(self.header["written"])
+        slots = (written + np.arange(len(records))) % self.capacity
+        self.samples[slots] = records
+        written += len(records)
+        self.header["written"] = written # Publish after the samples are in place
+        if written > self.capacity:
+            # Samples sharing the oldest remaining timestamp may have been overwritten
+            self.header["since"] = self.samples[written % self.capacity]["timestamp"] + 1
+
+    # Append decoded frames: timestamps for all frames, and (frame rows, values) per signal
+    # (fault: frame rows, SPNs, FMIs); frames without any of these signals are skipped
+    def append_decoded(self, timestamps, rpm, pto, fault):
+        records = np.zeros(len(timestamps), SAMPLE)
+        records["timestamp"] = timestamps
+        records["rpm"] = np.nan
+        records["pto_on"] = -1
+        records["rpm"][rpm[0]] = rpm[1]
+        records["pto_on"][pto[0]] = pto[1]
+        records["spn"][fault[0]] = fault[1]
+        records["fmi"][fault[0]] = fault[2]
+        keep = ~np.isnan(records["rpm"]) | (records["pto_on"] >= 0) | (records["spn"] > 0)
+        self.write(records[keep])
+
+    # Fill the buffer with the newest decoded samples already in SQLite, so it covers the history the
+    # live view needs from the start instead of only what the writer adds after it starts
+    def seed(self, conn):
+        limit = self.capacity
+        tables = [
+            ("SELECT timestamp, rpm FROM rpm_samples", ["rpm"]),
+            ("SELECT timestamp, pto_on FROM pto_samples", ["pto_on"]),
+            ("SELECT timestamp, spn, fmi FROM fault_events", ["spn", "fmi"]),
+        ]
+        parts, since = [], 0 # since: just after the oldest timestamp of any table (or the merge) that was cut off
+        for sql, fields in tables:
+            rows = conn.execute(f"{sql} ORDER BY timestamp DESC LIMIT ?", (limit,)).fetchall()
+            if len(rows) == limit: # Older rows of this table may be missing
+                since = max(since, rows[-1][0] + 1)
+            part = np.zeros(len(rows), SAMPLE)
+            part["rpm"], part["pto_on"] = np.nan, -1
+            if rows:
+                columns = list(zip(*rows))
+                part["timestamp"] = columns[0]
+                for field, values in zip(fields, columns[1:]):
+                    part[field] = values
+            parts.append(part)
+        records = np.concatenate(parts)
+        records = records[np.argsort(records["timestamp"], kind="stable")]
+        if len(records) > limit:
+            records = records[-limit:]
+            since = max(since, int(records["timestamp"][0]) + 1)
+        self.write(records)
+        if since:
+            self.header["since"] = since
+
+    # True if the buffer holds every sample at or after start_ms
+    def covers(self, start_ms):
+        return start_ms >= int(self.header["since"])
+
+    # Timestamp (epoch ms) of the newest sample, or None if the buffer is empty
+    def newest(self):
+        written = int(self.header["written"])
+        return int(self.samples[(written - 1) % self.capacity]["timestamp"]) if written else None
+
+    # Copy of the samples at or after start_ms (None = all), oldest first
+    def window(self, start_ms=None, retries=5):
+        for _ in range(retries):
+            written = int(self.header["written"])
+            head = written % self.capacity
+            parts = [self.samples[head:], self.samples[:head]] if written > self.capacity else [self.samples[:written]]
+            if start_ms is not None:
+                parts = [part[np.searchsorted(part["timestamp"], start_ms):] for part in parts]
+            out = np.concatenate(parts)
+            # Samples lapped while copying were overwritten by index written - capacity onwards
+            if int(self.header["written"]) - written <= self.capacity - len(out):
+                return out
+        raise RuntimeError("live buffer overwritten while reading; increase its capacity")
@@ -1,33 +1,173 @@
-import sqlite3
+import argparse
 import csv
 import os
+import time
+from itertools import islice
 
-# Function to load telemetry data from CSV to SQLite database
-def load_to_db(csv_file, db_file):
+from database import connect, ensure_schema, convert_rows_checked
+from ingest import ingest_frames
+from metrics import REGISTRY, COMMIT_SECONDS, INGEST_RATE
+
+# Ingest-time PRAGMAs: WAL journal, fewer fsyncs and a large page cache for bulk loads
+INGEST_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -262144, # Negative value is in KiB (256 MiB)
+    "temp_store": "MEMORY",
+}
+
+# Create the telemetry and load progress tables if they don't exist
+def ensure_tables(conn):
+    ensure_schema(conn) # Typed telemetry table and index
+
+    # One row per source file: how many rows are committed, so interrupted loads can resume
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS load_progress (
+            source TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            rows_loaded INTEGER,
+            completed INTEGER DEFAULT 0
+        )
+    ''')
+
+# Apply PRAGMA settings to a connection
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name}={value}")
+
+# Identify a source file by size and modification time so a regenerated CSV isn't treated as a resume
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+# Record load progress (called inside the same transaction as the inserted rows)
+def save_progress(cur, source, fingerprint, rows_loaded, completed=False):
+    cur.execute('''
+        INSERT INTO load_progress (source, fingerprint, rows_loaded, completed) VALUES (?, ?, ?, ?)
+        ON CONFLICT(source) DO UPDATE SET
+            fingerprint = excluded.fingerprint,
+            rows_loaded = excluded.rows_loaded,
+            completed = excluded.completed
+    ''', (source, fingerprint, rows_loaded, int(completed)))
+
+MAX_REPORTED_ERRORS = 5 # Invalid rows listed (line number and error) at the end of a load
+
+# Stream (timestamp, can_id, data[, vehicle_id]) text tuples into the telemetry table with executemany batches
+# (convert turns a batch into (typed frames, positions, [(position, error)]) as database.convert_rows_checked;
+# pass None for rows that are already typed). Invalid rows are skipped and counted, and the count and first
+# offending line numbers (first_line = line number of the first row of the source) are reported at the end.
+# Commits every txn_size rows together with the progress checkpoint; returns total rows read from the source
+# kind labels the ingest metrics (csv for CSV files, canlog for CAN logs)
+def load_rows(conn, rows, source, fingerprint, skip=0, batch_size=10000, txn_size=100000, progress=True,
+              convert=convert_rows_checked, kind="csv", first_line=1):
+    cur = conn.cursor()
+    loaded = skip
+    pending = 0
+    invalid, errors = 0, []
+    start = time.perf_counter()
+    last_commit, committed = start, skip
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+
+        frames, bad = (batch, []) if convert is None else convert(batch)[::2]
+        for position, message in bad:
+            invalid += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append(f"line {first_line + loaded + position}: {message}")
+        ingest_frames(conn, frames, source=kind) # Typed raw rows plus decoded signal rows
+        loaded += len(batch)
+        pending += len(batch)
+
+        if pending >= txn_size:
+            save_progress(cur, source, fingerprint, loaded)
+            with COMMIT_SECONDS.time(source=kind):
+                conn.commit() # Rows and checkpoint become durable together
+            pending = 0
+            now = time.perf_counter()
+            INGEST_RATE.set((loaded - committed) / max(now - last_commit, 1e-9), source=kind)
+            last_commit, committed = now, loaded
+            if progress:
+                rate = (loaded - skip) / max(time.perf_counter() - start, 1e-9)
+                print(f"Loaded {loaded:,} rows from {source} ({rate:,.0f} rows/s)")
+
+    save_progress(cur, source, fingerprint, loaded, completed=True)
+    with COMMIT_SECONDS.time(source=kind):
+        conn.commit()
+    if progress:
+        elapsed = time.perf_counter() - start
+        print(f"Finished {source}: {loaded - skip - invalid:,} rows inserted in {elapsed:.1f} s")
+    if invalid:
+        print(f"Skipped {invalid:,} invalid rows in {source}" + "".join(f"\n  {error}" for error in errors) +
+              (f"\n  ... and {invalid - len(errors):,} more" if invalid > len(errors) else ""))
+    return loaded
+
+# Open the database for loading a source file and find where a previous load of the same file stopped
+# Returns (conn, source, fingerprint, rows to skip), or None if the file is already fully loaded
+def start_load(path, db_file, pragmas=None, resume=True, progress=True):
     db_dir = os.path.dirname(db_file)
     if db_dir and not os.path.exists(db_dir):
         os.makedirs(db_dir) # Ensure the folder for the database exists
-        
-    conn = sqlite3.connect(db_file) # Connect to SQLite database
+
+    conn = connect(db_file) # WAL connection with busy timeout, shared settings with the simulator/dashboard/API
+    apply_pragmas(conn, INGEST_PRAGMAS if pragmas is None else pragmas)
+    ensure_tables(conn)
+    conn.commit()
     cur = conn.cursor() # Create a cursor object to execute SQL commands
 
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS telemetry (
-            id INTEGER PRIMARY KEY,
-            timestamp TEXT,
-            can_id TEXT,
-            data TEXT
-        )
-    ''') # Create and format table if it doesn't exist
+    source = os.path.abspath(path)
+    fingerprint = file_fingerprint(path)
+    skip = 0
+    if resume:
+        cur.execute("SELECT fingerprint, rows_loaded, completed FROM load_progress WHERE source = ?", (source,))
+        previous = cur.fetchone()
+        if previous and previous[0] == fingerprint: # Same file as the previous load
+            if previous[2]:
+                if progress:
+                    print(f"Skipping {source}: already loaded ({previous[1]:,} rows)")
+                conn.close()
+                return None
+            skip = previous[1]
+            if progress and skip:
+                print(f"Resuming {source} after {skip:,} rows")
+    return conn, source, fingerprint, skip
+
+# Function to load telemetry data from CSV to SQLite database
+# Streams the file in batches and resumes an interrupted load of the same file without duplicating rows
+def load_to_db(csv_file, db_file, batch_size=10000, txn_size=100000, pragmas=None, resume=True, progress=True):
+    started = start_load(csv_file, db_file, pragmas, resume, progress)
+    if started is None:
+        return 0
+    conn, source, fingerprint, skip = started
 
-    with open(csv_file, newline='') as f: # Open CSV file
-        reader = csv.DictReader(f)
-        for row in reader:
-            cur.execute("INSERT INTO telemetry (timestamp, can_id, data) VALUES (?, ?, ?)",
-                        (row['timestamp'], row['can_id'], row['data'])) # Insert data into table
+    try:
+        with open(csv_file, newline='') as f: # Open CSV file
+            reader = csv.reader(f)
+            header = next(reader)
+            columns = [header.index(c) for c in ('timestamp', 'can_id', 'data', 'vehicle_id') if c in header] # vehicle_id only in fleet files
+            rows = (tuple(r[c] for c in columns) for r in islice(reader, skip, None))
+            loaded = load_rows(conn, rows, source, fingerprint, skip, batch_size, txn_size, progress, first_line=2) # Line 1 is the header
+    finally:
+        conn.close() # Uncommitted rows are rolled back; committed batches are recorded in load_progress
 
-    conn.commit()
-    conn.close() # Commit changes and close connection
+    return loaded - skip
 
 if __name__ == "__main__":
-    load_to_db('data/telemetry.csv', 'db/telemetry.db') 
+    parser = argparse.ArgumentParser(description="Load telemetry CSV files into the SQLite database")
+    parser.add_argument("csv_files", nargs="*", default=["data/telemetry.csv"], help="CSV files to load")
+    parser.add_argument("--db", default="db/telemetry.db", help="SQLite database path")
+    parser.add_argument("--batch-size", type=int, default=10000, help="Rows per executemany batch")
+    parser.add_argument("--txn-size", type=int, default=100000, help="Rows per committed transaction")
+    parser.add_argument("--cache-mb", type=int, default=256, help="SQLite page cache size during load (MiB)")
+    parser.add_argument("--synchronous", default="NORMAL", help="PRAGMA synchronous during load (OFF, NORMAL, FULL)")
+    parser.add_argument("--no-resume", action="store_true", help="Reload files even if already (partially) loaded")
+    parser.add_argument("--metrics-file", default=None, help="Write ingest metrics in Prometheus text format to this file when done (e.g. for node_exporter's textfile collector)")
+    args = parser.parse_args()
+
+    pragmas = dict(INGEST_PRAGMAS, cache_size=-args.cache_mb * 1024, synchronous=args.synchronous)
+    for csv_file in args.csv_files:
+        load_to_db(csv_file, args.db, args.batch_size, args.txn_size, pragmas, resume=not args.no_resume)
+    if args.metrics_file:
+        REGISTRY.write(args.metrics_file)
@@ -0,0 +1,264 @@
+import cProfile
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Lightweight in-process instrumentation: counters, gauges and latency histograms rendered in the Prometheus
+# text format (no client library needed). The API serves them on /metrics; the simulator can serve its own
+# with --metrics-port and main.py can write them to a file for node_exporter's textfile collector.
+# Recording is one lock and a few additions, cheap enough for every batch, query and request.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Latency buckets in seconds: 0.5 ms (cached lookups) to 10 s (month-long range reads)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {} # Label values tuple -> value (or histogram state)
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, (), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.label_names, key, extra)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+# Gauge set by the code, or read at scrape time from function() (a dict of label values tuple -> value)
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        return [(self.name, tuple(map(str, key)), (), value) for key, value in sorted(self.function().items())]
+
+# Timer usable as a context manager or a decorator; observes the elapsed seconds into a histogram
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0] # Per-bucket counts, sum, count
+            i = bisect_left(self.buckets, value) # First bucket with bound >= value
+            if i < len(self.buckets):
+                state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    # Time a block or function: `with HISTOGRAM.time(step="x"):` or `@HISTOGRAM.time(step="x")`
+    def time(self, **labels):
+        self._key(labels) # Fail at definition time on wrong labels
+        return _Timer(self, labels)
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    out.append((f"{self.name}_bucket", key, (("le", _format_value(float(bound))),), cumulative))
+                out.append((f"{self.name}_bucket", key, (("le", "+Inf"),), count))
+                out.append((f"{self.name}_sum", key, (), total))
+                out.append((f"{self.name}_count", key, (), count))
+        return out
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    # Get or create a metric, so modules can declare the same metric without import order mattering
+    def _get(self, cls, name, help, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.label_names != tuple(labels):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=(), function=None):
+        return self._get(Gauge, name, help, labels, function=function)
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    # Prometheus text exposition of every metric
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    # Write the exposition atomically (node_exporter textfile collector reads *.prom files)
+    def write(self, path):
+        with open(path + ".tmp", "w") as f:
+            f.write(self.render())
+        os.replace(path + ".tmp", path)
+
+REGISTRY = Registry() # Process-wide registry
+
+# Metrics shared by the pipeline modules
+DB_QUERY_SECONDS = REGISTRY.histogram("telemetry_db_query_seconds", "Latency of database reads", ["source", "table"])
+ROWS_SCANNED = REGISTRY.counter("telemetry_rows_scanned_total", "Rows returned by database reads", ["source", "table"])
+DECODE_SECONDS = REGISTRY.histogram("telemetry_decode_seconds", "Latency of decoding steps", ["step"])
+ROWS_DECODED = REGISTRY.counter("telemetry_rows_decoded_total", "Decoded rows written at ingest", ["table"])
+AGGREGATION_SECONDS = REGISTRY.histogram("telemetry_aggregation_seconds", "Latency of stats and aggregations", ["name"])
+SERIALIZE_SECONDS = REGISTRY.histogram("telemetry_serialize_seconds", "Time spent encoding API response bodies", ["format"])
+INGEST_FRAMES = REGISTRY.counter("telemetry_ingest_frames_total", "Telemetry frames ingested", ["source"])
+INGEST_SECONDS = REGISTRY.histogram("telemetry_ingest_seconds", "Latency of ingesting one batch (insert and decode, before commit)", ["source"])
+INGEST_RATE = REGISTRY.gauge("telemetry_ingest_frames_per_second", "Frames per second over the last reporting interval", ["source"])
+ANOMALY_EVENTS = REGISTRY.counter("telemetry_anomaly_events_total", "Samples that broke an anomaly rule (anomaly.py)")
+COMMIT_SECONDS = REGISTRY.histogram("telemetry_commit_seconds", "Latency of ingest commits", ["source"])
+
+# Gauge of database file sizes (main file, WAL and shared memory index) read at scrape time;
+# path_of() returns the current database path
+def db_size_gauge(path_of):
+    def sizes():
+        db_path, out = path_of(), {}
+        for suffix, part in (("", "db"), ("-wal", "wal"), ("-shm", "shm")):
+            if os.path.exists(db_path + suffix):
+                out[(db_path, part)] = os.path.getsize(db_path + suffix)
+        return out
+    return REGISTRY.gauge("telemetry_db_file_bytes", "Size of the SQLite database files", ["path", "file"], function=sizes)
+
+# Time a generator's own work (not its consumer's): the time spent producing each chunk is summed and
+# observed once when the generator is exhausted or closed. Used for streamed response bodies.
+def timed_iter(iterable, histogram, **labels):
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            yield chunk
+    finally:
+        histogram.observe(elapsed, **labels)
+
+# Profile a block and dump the profile to directory only if it took at least threshold_sec (the path is then
+# in .path). Only one profiler can run at a time, so a block that starts while another is profiled runs unprofiled.
+class SlowProfile:
+    def __init__(self, directory, threshold_sec, name):
+        self.directory = directory
+        self.threshold_sec = threshold_sec
+        self.name = name
+        self.path = None
+
+    def __enter__(self):
+        self.profile = cProfile.Profile()
+        self.start = time.perf_counter()
+        try:
+            self.profile.enable()
+        except ValueError: # Another profiler is active (concurrent request)
+            self.profile = None
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        elapsed = time.perf_counter() - self.start
+        if elapsed >= self.threshold_sec:
+            os.makedirs(self.directory, exist_ok=True)
+            now = time.time()
+            stamp = time.strftime("%Y%m%dT%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+            self.path = os.path.join(self.directory, f"{stamp}-{self.name}-{elapsed * 1000:.0f}ms.prof")
+            self.profile.dump_stats(self.path) # Inspect with python -m pstats or snakeviz
+
+# Serve REGISTRY on http://<host>:<port>/metrics from a daemon thread (for processes without a web server)
+def serve(port, host="0.0.0.0"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass # Scrapes would flood the simulator's output
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,101 @@
+import argparse
+import time
+from datetime import datetime, timezone
+
+from database import connect, SCHEMA
+
+# Retention for the telemetry table: drop (or archive) frames older than an age limit and/or beyond a
+# row count, using index range deletes instead of sorting the table. Decoded rows go with their frames
+# (telemetry_delete_decoded trigger); the rollup tables keep their history. Aged frames can also be moved
+# to the partitioned Parquet archive (archive.py) instead of telemetry_archive.
+
+ARCHIVE_TABLE = "telemetry_archive"
+
+# Distinct CAN IDs via index seeks on (can_id, timestamp): one lookup per ID instead of a table scan
+def can_ids(conn):
+    return [row[0] for row in conn.execute('''
+        WITH RECURSIVE ids(can_id) AS (
+            SELECT MIN(can_id) FROM telemetry
+            UNION ALL
+            SELECT (SELECT MIN(can_id) FROM telemetry WHERE can_id > ids.can_id) FROM ids WHERE ids.can_id IS NOT NULL
+        )
+        SELECT can_id FROM ids WHERE can_id IS NOT NULL
+    ''')]
+
+# Archive table with the telemetry columns (ids are kept so rows can be traced or restored)
+def ensure_archive(conn):
+    conn.execute(SCHEMA[1][0].replace("telemetry (", f"{ARCHIVE_TABLE} (", 1))
+
+# Delete (and optionally archive) the telemetry rows matching a WHERE clause; returns rows removed
+def remove_rows(conn, where, params, archive=False):
+    if archive:
+        ensure_archive(conn)
+        conn.execute(f'''
+            INSERT OR REPLACE INTO {ARCHIVE_TABLE} (id, timestamp, can_id, data, vehicle_id)
+            SELECT id, timestamp, can_id, data, vehicle_id FROM telemetry WHERE {where}
+        ''', params)
+    return conn.execute(f"DELETE FROM telemetry WHERE {where}", params).rowcount
+
+# Apply a retention policy once; returns rows removed. The caller commits.
+# max_age_sec: keep frames with timestamps within this many seconds of now_ms (default: current time)
+# max_rows: keep at most this many of the newest frames (by id)
+# parquet_root: move frames past max_age_sec to this Parquet archive directory (commits per archived batch)
+def prune(conn, max_age_sec=None, max_rows=None, archive=False, now_ms=None, parquet_root=None):
+    removed = 0
+    if max_rows is not None:
+        # Newest id past the limit, found by walking the primary key from the end
+        row = conn.execute("SELECT id FROM telemetry ORDER BY id DESC LIMIT 1 OFFSET ?", (max_rows,)).fetchone()
+        if row:
+            removed += remove_rows(conn, "id <= ?", (row[0],), archive)
+    if max_age_sec is not None:
+        if now_ms is None:
+            now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        cutoff = now_ms - int(max_age_sec * 1000)
+        if parquet_root:
+            from archive import archive as archive_parquet # Local import: archive depends on this module
+            removed += archive_parquet(conn, parquet_root, cutoff)
+        for can_id in can_ids(conn): # Range delete per CAN ID on the (can_id, timestamp) index
+            removed += remove_rows(conn, "can_id = ? AND timestamp < ?", (can_id, cutoff), archive)
+    return removed
+
+# Retention policy run on a schedule: call maybe_prune() as often as convenient (e.g. every tick)
+# and it prunes at most once every every_sec seconds
+class Retention:
+    def __init__(self, max_age_sec=3600, max_rows=None, archive=False, every_sec=60, parquet_root=None):
+        self.max_age_sec = max_age_sec
+        self.max_rows = max_rows
+        self.archive = archive
+        self.every_sec = every_sec
+        self.parquet_root = parquet_root
+        self.last_run = None
+
+    # Prune and commit if the interval has passed; returns rows removed (0 when skipped)
+    def maybe_prune(self, conn, now=None):
+        now = time.monotonic() if now is None else now
+        if self.last_run is not None and now - self.last_run < self.every_sec:
+            return 0
+        self.last_run = now
+        removed = prune(conn, self.max_age_sec, self.max_rows, self.archive, parquet_root=self.parquet_root)
+        conn.commit()
+        return removed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune old telemetry rows once")
+    parser.add_argument("db_path", nargs="?", default="db/telemetry.db", help="SQLite database path")
+    parser.add_argument("--max-age", type=float, default=None, help="Keep frames newer than this many seconds")
+    parser.add_argument("--max-rows", type=int, default=None, help="Keep at most this many of the newest frames")
+    parser.add_argument("--archive", action="store_true", help=f"Move pruned frames to {ARCHIVE_TABLE} instead of deleting them")
+    parser.add_argument("--parquet", action="store_true", help="Move frames past --max-age to the Parquet archive next to the database")
+    args = parser.parse_args()
+    if args.max_age is None and args.max_rows is None:
+        parser.error("give --max-age and/or --max-rows")
+
+    conn = connect(args.db_path)
+    parquet_root = None
+    if args.parquet:
+        from archive import default_root
+        parquet_root = default_root(args.db_path)
+    removed = prune(conn, args.max_age, args.max_rows, args.archive, parquet_root=parquet_root)
+    conn.commit()
+    conn.close()
+    print(f"Removed {removed:,} telemetry rows" + (f" (archived to {ARCHIVE_TABLE})" if args.archive else ""))
@@ -0,0 +1,212 @@
+import argparse
+import sqlite3
+
+import numpy as np
+
+from database import ensure_schema, ROLLUP_RESOLUTIONS
+
+# Continuous aggregates: per-minute, per-hour and per-day RPM/PTO rollups updated at ingest.
+# Range stats read whole buckets from the coarsest table that fits and only touch raw samples
+# for the partial minutes at the edges, so a month of data costs a few dozen rows instead of millions.
+# Rollups keep history after retention prunes raw rows; `python rollups.py rebuild` recomputes them
+# from the signal tables that are still present.
+# PTO engaged time is the number of distinct seconds in which a vehicle reported the PTO engaged, so it
+# doesn't depend on the CCVS1 period (1 s by default, 100 ms in high-rate mode).
+
+RPM_UPSERT = '''
+    INSERT INTO {table} (bucket, rpm_min, rpm_max, rpm_sum, rpm_count) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(bucket) DO UPDATE SET
+        rpm_min = MIN(COALESCE(rpm_min, excluded.rpm_min), excluded.rpm_min),
+        rpm_max = MAX(COALESCE(rpm_max, excluded.rpm_max), excluded.rpm_max),
+        rpm_sum = rpm_sum + excluded.rpm_sum,
+        rpm_count = rpm_count + excluded.rpm_count
+'''
+
+PTO_UPSERT = '''
+    INSERT INTO {table} (bucket, pto_engaged_sec, pto_activations) VALUES (?, ?, ?)
+    ON CONFLICT(bucket) DO UPDATE SET
+        pto_engaged_sec = pto_engaged_sec + excluded.pto_engaged_sec,
+        pto_activations = pto_activations + excluded.pto_activations
+'''
+
+# The minute before a raw segment supplies each vehicle's previous PTO state so activations match the rollups
+PTO_LOOKBACK_MS = ROLLUP_RESOLUTIONS["rollup_1m"]
+
+# Group values by bucket start: returns (buckets, inverse index) for the bincount/ufunc.at aggregations below
+def _group(timestamps, size):
+    return np.unique(timestamps // size * size, return_inverse=True)
+
+# Add a batch of decoded RPM samples (epoch-ms timestamps, rpm values) to every rollup table; caller commits
+def update_rpm_rollups(conn, timestamps, rpm):
+    if len(timestamps) == 0:
+        return
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    rpm = np.asarray(rpm, dtype=np.float64)
+    for table, size in ROLLUP_RESOLUTIONS.items():
+        buckets, inverse = _group(timestamps, size)
+        low = np.full(len(buckets), np.inf)
+        high = np.full(len(buckets), -np.inf)
+        np.minimum.at(low, inverse, rpm)
+        np.maximum.at(high, inverse, rpm)
+        total = np.bincount(inverse, weights=rpm)
+        count = np.bincount(inverse)
+        conn.executemany(RPM_UPSERT.format(table=table), zip(
+            buckets.tolist(), low.tolist(), high.tolist(), total.tolist(), count.tolist()))
+
+# Add a batch of decoded PTO samples in raw_id order to every rollup table; caller commits.
+# An activation is an off -> on change per vehicle, continuing from the state left by the previous batch.
+# Engaged seconds are distinct (vehicle, second) pairs, skipping the second the previous batch already counted.
+def update_pto_rollups(conn, timestamps, pto_on, vehicle_ids):
+    if len(timestamps) == 0:
+        return
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    pto_on = np.asarray(pto_on, dtype=bool)
+    keys = np.array([v or 0 for v in vehicle_ids], dtype=np.int64) # 0 = no vehicle id
+
+    # Previous state of each sample within its vehicle's stream (stable sort keeps raw_id order)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys, sorted_on = keys[order], pto_on[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    previous = np.empty(len(order), dtype=bool)
+    previous[1:] = sorted_on[:-1]
+    vehicles = sorted_keys[first].tolist()
+    placeholders = ", ".join("?" * len(vehicles))
+    state = {row[0]: row[1:] for row in conn.execute(
+        f"SELECT vehicle_key, pto_on, pto_sec FROM rollup_state WHERE vehicle_key IN ({placeholders})", vehicles)}
+    previous[first] = [bool(state.get(v, (0, None))[0]) for v in vehicles]
+    activations = np.empty(len(order), dtype=bool)
+    activations[order] = sorted_on & ~previous
+
+    # Distinct engaged (vehicle, second) pairs, minus each vehicle's second counted by the previous batch
+    engaged_keys, engaged_seconds = np.unique(np.stack([keys[pto_on], timestamps[pto_on] // 1000]), axis=1)
+    counted = np.array([state.get(v, (0, None))[1] for v in engaged_keys.tolist()], dtype=object)
+    new = counted != engaged_seconds
+    engaged_keys, engaged_seconds = engaged_keys[new], engaged_seconds[new]
+    last_second = dict(zip(engaged_keys.tolist(), engaged_seconds.tolist())) # Pairs are sorted: the last one per vehicle wins
+
+    last = np.append(first[1:], True) # Last sample of each vehicle in this batch
+    conn.executemany("INSERT OR REPLACE INTO rollup_state (vehicle_key, pto_on, pto_sec) VALUES (?, ?, ?)",
+                     [(v, on, last_second.get(v, state.get(v, (0, None))[1]))
+                      for v, on in zip(vehicles, sorted_on[last].astype(np.int64).tolist())])
+
+    for table, size in ROLLUP_RESOLUTIONS.items():
+        buckets, inverse = _group(timestamps, size)
+        # Bucket sizes are whole seconds, so an engaged second falls in the bucket of its samples
+        engaged = np.bincount(np.searchsorted(buckets, engaged_seconds * 1000 // size * size), minlength=len(buckets))
+        started = np.bincount(inverse, weights=activations).astype(np.int64)
+        conn.executemany(PTO_UPSERT.format(table=table), zip(buckets.tolist(), engaged.tolist(), started.tolist()))
+
+# Recompute every rollup table from rpm_samples and pto_samples in raw_id order; caller commits
+def rebuild_rollups(conn, batch_size=100000):
+    for table in (*ROLLUP_RESOLUTIONS, "rollup_state"):
+        conn.execute(f"DELETE FROM {table}")
+
+    for table, columns, update in (("rpm_samples", "timestamp, rpm", update_rpm_rollups),
+                                   ("pto_samples", "timestamp, pto_on, vehicle_id", update_pto_rollups)):
+        last_id = 0
+        while True:
+            rows = conn.execute(f"SELECT raw_id, {columns} FROM {table} WHERE raw_id > ? ORDER BY raw_id LIMIT ?",
+                                (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            update(conn, *list(zip(*rows))[1:])
+
+# Schema 7 upgrade: rollups written before it counted one engaged second per engaged sample. In place, swap the
+# sample count of the PTO samples still present for their distinct (vehicle, second) count; buckets whose raw
+# rows were pruned keep their value (the same at the default 1 s CCVS1 period). Caller commits.
+def upgrade_engaged_seconds(conn):
+    seconds = '''
+        SELECT COALESCE(vehicle_id, 0) AS vehicle_key, timestamp / 1000 AS second, COUNT(*) AS samples
+        FROM pto_samples WHERE pto_on GROUP BY vehicle_key, second
+    '''
+    for table, size in ROLLUP_RESOLUTIONS.items():
+        conn.execute(f'''
+            UPDATE {table} SET pto_engaged_sec = pto_engaged_sec - counted.samples + counted.seconds
+            FROM (SELECT second * 1000 / {size} * {size} AS bucket, SUM(samples) AS samples, COUNT(*) AS seconds
+                  FROM ({seconds}) GROUP BY bucket) AS counted
+            WHERE {table}.bucket = counted.bucket
+        ''')
+    # Last engaged second per vehicle, so the next batch doesn't count it again
+    conn.execute(f'''
+        UPDATE rollup_state SET pto_sec = latest.second
+        FROM (SELECT vehicle_key, MAX(second) AS second FROM ({seconds}) GROUP BY vehicle_key) AS latest
+        WHERE rollup_state.vehicle_key = latest.vehicle_key
+    ''')
+
+# Split [start, end) into (source, start, end) segments: whole buckets from the coarsest rollup table
+# that fits, finer tables for the remainders, and "raw" for the sub-minute edges
+def plan_range(start, end, tables=None):
+    tables = list(ROLLUP_RESOLUTIONS)[::-1] if tables is None else tables # Coarsest first
+    if start >= end:
+        return []
+    if not tables:
+        return [("raw", start, end)]
+    size = ROLLUP_RESOLUTIONS[tables[0]]
+    first = -(-start // size) * size # First bucket boundary at or after start
+    last = end // size * size
+    if first >= last:
+        return plan_range(start, end, tables[1:])
+    return plan_range(start, first, tables[1:]) + [(tables[0], first, last)] + plan_range(last, end, tables[1:])
+
+# RPM min/max/sum/count and PTO engaged seconds/activations for [start, end) in epoch ms.
+# Activations are off -> on changes that happen inside the range.
+# raw_totals(start, end) computes the sub-minute edges (default: from the SQLite signal tables)
+def range_totals(conn, start, end, raw_totals=None):
+    raw_totals = raw_totals or (lambda a, b: raw_segment_totals(conn, a, b))
+    totals = {"rpm_min": None, "rpm_max": None, "rpm_sum": 0.0, "rpm_count": 0, "pto_engaged_sec": 0, "pto_activations": 0}
+
+    def merge(rpm_min, rpm_max, rpm_sum, rpm_count, engaged, activations):
+        if rpm_count:
+            totals["rpm_min"] = rpm_min if totals["rpm_min"] is None else min(totals["rpm_min"], rpm_min)
+            totals["rpm_max"] = rpm_max if totals["rpm_max"] is None else max(totals["rpm_max"], rpm_max)
+            totals["rpm_sum"] += rpm_sum
+            totals["rpm_count"] += rpm_count
+        totals["pto_engaged_sec"] += engaged or 0
+        totals["pto_activations"] += activations or 0
+
+    for source, a, b in plan_range(start, end):
+        if source == "raw":
+            merge(*raw_totals(a, b))
+        else:
+            merge(*conn.execute(f'''
+                SELECT MIN(rpm_min), MAX(rpm_max), SUM(rpm_sum), SUM(rpm_count), SUM(pto_engaged_sec), SUM(pto_activations)
+                FROM {source} WHERE bucket >= ? AND bucket < ?
+            ''', (a, b)).fetchone())
+    return totals
+
+# RPM min/max/sum/count and PTO engaged seconds/activations for a sub-minute raw segment
+def raw_segment_totals(conn, start, end):
+    rpm = conn.execute("SELECT MIN(rpm), MAX(rpm), SUM(rpm), COUNT(*) FROM rpm_samples WHERE timestamp >= ? AND timestamp < ?",
+                       (start, end)).fetchone()
+    pto = conn.execute("SELECT timestamp, vehicle_id, pto_on FROM pto_samples WHERE timestamp >= ? AND timestamp < ? ORDER BY raw_id",
+                       (start - PTO_LOOKBACK_MS, end)).fetchall()
+    return (*rpm, *pto_totals(pto, start))
+
+# PTO engaged seconds (distinct per vehicle) and activations from (timestamp, vehicle_id, pto_on) rows in
+# raw_id order, counting only rows at or after start (earlier rows are the lookback)
+def pto_totals(rows, start):
+    previous, engaged, activations = {}, set(), 0
+    for timestamp, vehicle_id, pto_on in rows:
+        if timestamp >= start:
+            if pto_on:
+                engaged.add((vehicle_id, timestamp // 1000))
+            activations += pto_on and not previous.get(vehicle_id, 0)
+        previous[vehicle_id] = pto_on
+    return len(engaged), activations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RPM/PTO rollup table tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser("rebuild", help="Recompute the rollup tables from the signal tables")
+    rebuild_parser.add_argument("db_path", nargs="?", default="db/telemetry.db", help="SQLite database path")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        conn = sqlite3.connect(args.db_path)
+        ensure_schema(conn)
+        rebuild_rollups(conn)
+        conn.commit()
+        conn.close()
+        print(f"Rebuilt {', '.join(ROLLUP_RESOLUTIONS)}")
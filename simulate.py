@@ -1,6 +1,26 @@
+import argparse
 import csv
 import random
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+# J1939 payloads (hex) for the simulated PGNs, laid out as in data/j1939_signals.csv; unused bytes are FF (not available)
+# EEC1: engine speed in bytes 4-5, little-endian at 0.125 rpm/bit
+def eec1_hex(rpm):
+    raw = int(rpm * 8)
+    return f"FFFFFF{raw & 0xFF:02X}{raw >> 8:02X}FFFFFF"
+
+# CCVS1: PTO state in byte 7 bits 1-5 (5 = set/engaged, 0 = off), cruise control states not available
+def ccvs1_hex(pto_on):
+    return f"FFFFFFFFFFFF{0xE5 if pto_on else 0xE0:02X}FF"
+
+# DM1 with one active DTC: lamp status (red stop lamp for FMI 0/1, amber warning otherwise),
+# then SPN (19 bits, little-endian) + FMI (5 bits) and an occurrence count of 1
+def dm1_hex(spn, fmi):
+    lamp = 0x10 if fmi in (0, 1) else 0x04
+    return f"{lamp:02X}FF{spn & 0xFF:02X}{(spn >> 8) & 0xFF:02X}{(spn >> 16) << 5 | fmi:02X}01FFFF"
 
 # Generate realistic RPM hex data based on PTO state 
 class RPMGenerator:
@@ -18,8 +38,7 @@ class RPMGenerator:
         else:
             self.current_rpm = target
 
-        scaled = int(self.current_rpm * 4) # Match the hex_to_rpm scaling (÷4)
-        return f"{scaled:04X}" + "0000" # 4-digit hex + 4 zeroes 
+        return eec1_hex(self.current_rpm) # EEC1 engine speed
 
 # PTO state machine for realistic engagement patterns
 class PTOStateMachine:
@@ -35,8 +54,7 @@ class PTOStateMachine:
         return self.pto_on
 
     def simulate_pto_hex(self):
-        prefix = "01" if self.pto_on else "00" # PTO engaged vs. not engaged format
-        return prefix + ''.join(random.choices('0123456789ABCDEF', k=6)), self.pto_on # Pad to 8 chars
+        return ccvs1_hex(self.pto_on), self.pto_on # CCVS1 PTO state
 
 # Simulate a generic fault code in hex format based on SAE J1939 specification
 VALID_SPNS = [100, 190, 723, 84, 91, 108, 639, 110, 111]
@@ -55,17 +73,19 @@ RELEVANT_FMIS = {
 class FaultGenerator:
     def __init__(self):
         self.active = False
+        self.dtc = None # DM1 payload of the active fault, repeated for the whole burst
         self.timer = random.randint(300, 2400)  # Initial fault timer (5-40 minutes)
 
     def simulate_fault_hex(self):
         spn = random.choice(VALID_SPNS)  # SPN (Suspect Parameter Number)
         fmi = random.choice(RELEVANT_FMIS[spn])    # FMI (Failure Mode Identifier)
-        return f"{spn:04X}{fmi:02X}00"   # SPN(4 hex) + FMI(2 hex) + pad to 8 chars
+        return dm1_hex(spn, fmi) # DM1 with one active DTC
 
     def maybe_emit_fault(self):
         if self.timer <= 0:
             if not self.active:
                 self.active = True
+                self.dtc = self.simulate_fault_hex() # One SPN/FMI per burst, rebroadcast like a real DM1
                 self.timer = random.randint(5, 30)  # Emit fault for 5-30 seconds
             else:
                 self.active = False
@@ -74,13 +94,16 @@ class FaultGenerator:
             self.timer -= 1 # Decrement timer
 
         if self.active:
-            return self.simulate_fault_hex() # Emit fault code
+            return self.dtc # Emit fault code
         return None
 
 # Generate 3600 rows (equivalent 1 hour) of telemetry data
-def generate_data(file="data/telemetry.csv", rows=3600):
-    can_ids = ['0x0CF00400', '0x18FEF100', '0x0CFE6CEE'] # Example CAN IDs from standardized J1939 PGNs
+def generate_data(file="data/telemetry.csv", rows=3600, seed=None):
+    can_ids = ['0x0CF00400', '0x18FEF100', '0x18FECA00'] # EEC1, CCVS1 and DM1 CAN IDs (source address 00)
     timestamp = datetime.now(timezone.utc) # Start from current UTC time
+
+    if seed is not None:
+        random.seed(seed) # Reproducible run for a fixed seed
     
     # Name assignment for each class
     pto_state = PTOStateMachine()
@@ -106,9 +129,128 @@ def generate_data(file="data/telemetry.csv", rows=3600):
             # Simulate error/fault code data
             fault_data = fault_gen.maybe_emit_fault()
             if fault_data:
-                writer.writerow([ts, '0x0CFE6CEE', fault_data])
+                writer.writerow([ts, '0x18FECA00', fault_data])
 
             timestamp += timedelta(seconds=1) # Increment timestamp by 1 second
 
+# Hex lookup table so whole byte columns can be formatted by indexing instead of per-value f-strings
+@lru_cache(maxsize=None)
+def _hex_table():
+    return np.array([f"{i:02X}" for i in range(256)], dtype=object)
+
+# Draw alternating idle/active run lengths covering n seconds and return the cumulative run ends
+# Run 0 is idle (first_range), then active/idle alternate; *_extra matches the generator's extra toggle tick
+def _run_ends(rng, n, first_range, active_range, idle_range, active_extra=0, idle_extra=0):
+    ends = [rng.integers(first_range[0], first_range[1] + 1)]
+    total = ends[0]
+    while total < n:
+        batch = max(16, int((n - total) // (active_range[0] + idle_range[0])) + 2) # Enough pairs to finish in one or two passes
+        active = rng.integers(active_range[0], active_range[1] + 1, batch) + active_extra
+        idle = rng.integers(idle_range[0], idle_range[1] + 1, batch) + idle_extra
+        runs = np.empty(2 * batch, dtype=np.int64)
+        runs[0::2], runs[1::2] = active, idle
+        ends.extend((total + np.cumsum(runs)).tolist())
+        total = ends[-1]
+    return np.asarray(ends, dtype=np.int64)
+
+# Active state for seconds [start, stop) given cumulative run ends (odd runs are active)
+def _active_mask(ends, start, stop):
+    run_idx = np.searchsorted(ends, np.arange(start, stop), side='right')
+    return (run_idx % 2) == 1
+
+# RPM smoothing is a sequential recurrence (each step clamps towards a fresh target),
+# so targets and step sizes are drawn in bulk and only the clamp runs per element
+def _rpm_trajectory(rng, pto_on, current_rpm):
+    n = len(pto_on)
+    targets = np.where(pto_on, rng.integers(900, 1301, n), rng.integers(1200, 3201, n)).tolist()
+    steps = rng.integers(25, 61, n).tolist()
+    out = [0] * n
+    cur = current_rpm
+    for i in range(n):
+        delta = targets[i] - cur
+        if delta > steps[i]:
+            cur += steps[i]
+        elif delta < -steps[i]:
+            cur -= steps[i]
+        else:
+            cur = targets[i]
+        out[i] = cur
+    return np.asarray(out, dtype=np.int64), cur
+
+# Yield CSV text chunks of simulated frames for one vehicle using bulk array operations
+# Same PTO dwell times, RPM step limits and fault burst lengths as the classes above
+def generate_chunks(rng, rows, start, chunk_size=86400, vehicle_id=None):
+    hex2 = _hex_table()
+    start64 = np.datetime64(start.astimezone(timezone.utc).replace(tzinfo=None), 'us')
+    sep = "," if vehicle_id is None else f",{vehicle_id}," # Optional vehicle id column between timestamp and CAN ID
+
+    # PTO: off 20-30 min first, then on 60-180 s / off 20-30 min (PTOStateMachine)
+    pto_ends = _run_ends(rng, rows, (1200, 1800), (60, 180), (1200, 1800))
+    # Faults: quiet 5-40 min first, then bursts of 5-30 s (+1 toggle tick) / gaps of 10-30 min (+1 toggle tick) (FaultGenerator)
+    fault_ends = _run_ends(rng, rows, (300, 2400), (5, 30), (600, 1800), active_extra=1, idle_extra=1)
+
+    # SPN/FMI lookup arrays so each fault burst (run) can pick a random SPN and one of its relevant FMIs
+    spns = np.array(VALID_SPNS)
+    fmi_counts = np.array([len(RELEVANT_FMIS[s]) for s in VALID_SPNS])
+    fmi_table = np.zeros((len(VALID_SPNS), fmi_counts.max()), dtype=np.int64)
+    for i, s in enumerate(VALID_SPNS):
+        fmi_table[i, :fmi_counts[i]] = RELEVANT_FMIS[s]
+    run_spn_idx = rng.integers(0, len(VALID_SPNS), len(fault_ends) + 1)
+    run_fmi = fmi_table[run_spn_idx, (rng.random(len(fault_ends) + 1) * fmi_counts[run_spn_idx]).astype(np.int64)]
+
+    current_rpm = int(rng.integers(1000, 1301)) # Initial RPM between 1000 and 1300 for realistic cold start
+
+    for chunk_start in range(0, rows, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, rows)
+        n = chunk_stop - chunk_start
+
+        seconds = np.arange(chunk_start, chunk_stop).astype('timedelta64[s]')
+        ts = np.datetime_as_string(start64 + seconds, unit='us').astype(object) + "+00:00"
+
+        # PTO frames: CCVS1 with the PTO state in byte 7 (as ccvs1_hex)
+        pto_on = _active_mask(pto_ends, chunk_start, chunk_stop)
+        pto_hex = np.where(pto_on, ccvs1_hex(True), ccvs1_hex(False)).astype(object)
+
+        # RPM frames: EEC1 with RPM x8 little-endian in bytes 4-5 (as eec1_hex)
+        rpm, current_rpm = _rpm_trajectory(rng, pto_on, current_rpm)
+        raw = rpm * 8
+        rpm_hex = "FFFFFF" + hex2[raw & 0xFF] + hex2[raw >> 8] + "FFFFFF"
+
+        # Fault frames: the burst's SPN + relevant FMI on every active second
+        fault_on = _active_mask(fault_ends, chunk_start, chunk_stop)
+        fault_run = np.searchsorted(fault_ends, np.arange(chunk_start, chunk_stop), side='right')
+        fmi = run_fmi[fault_run]
+        spn = spns[run_spn_idx[fault_run]]
+        lamp = np.where(fmi <= 1, "10", "04").astype(object) # As dm1_hex
+        fault_hex = lamp + "FF" + hex2[spn & 0xFF] + hex2[(spn >> 8) & 0xFF] + hex2[(spn >> 16) << 5 | fmi] + "01FFFF"
+
+        # Interleave PTO, RPM and fault rows per second in the same order as generate_data()
+        lines = np.empty(3 * n, dtype=object)
+        lines[0::3] = ts + (sep + "0x18FEF100,") + pto_hex + "\r\n"
+        lines[1::3] = ts + (sep + "0x0CF00400,") + rpm_hex + "\r\n"
+        lines[2::3] = np.where(fault_on, ts + (sep + "0x18FECA00,") + fault_hex + "\r\n", "")
+        yield "".join(lines)
+
+# Array-based equivalent of generate_data() for large datasets (e.g. 30 days at 1 Hz), written in chunks
+def generate_data_vectorized(file="data/telemetry.csv", rows=3600, seed=None, chunk_size=86400, start=None):
+    rng = np.random.default_rng(seed)
+    start = start or datetime.now(timezone.utc) # Start from current UTC time
+
+    with open(file, 'w', newline='') as f:
+        f.write("timestamp,can_id,data\r\n") # Header row (csv.writer line terminator)
+        for chunk in generate_chunks(rng, rows, start, chunk_size):
+            f.write(chunk)
+
 if __name__ == "__main__":
-    generate_data()
+    parser = argparse.ArgumentParser(description="Generate simulated J1939 telemetry CSV data")
+    parser.add_argument("--file", default="data/telemetry.csv", help="Output CSV path")
+    parser.add_argument("--rows", type=int, default=3600, help="Number of seconds to simulate")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible output")
+    parser.add_argument("--vectorized", action="store_true", help="Use the array-based generator for large datasets")
+    parser.add_argument("--chunk-size", type=int, default=86400, help="Seconds generated per chunk in vectorized mode")
+    args = parser.parse_args()
+
+    if args.vectorized:
+        generate_data_vectorized(args.file, args.rows, seed=args.seed, chunk_size=args.chunk_size)
+    else:
+        generate_data(args.file, args.rows, seed=args.seed)
@@ -0,0 +1,96 @@
+import argparse
+import csv
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+
+from simulate import RPMGenerator, PTOStateMachine, FaultGenerator, generate_chunks
+
+# Simulate one vehicle with its own generator state and write its frames tagged with the vehicle id
+def simulate_vehicle(writer, vehicle_id, rows, start):
+    # Independent state per vehicle
+    pto_state = PTOStateMachine()
+    rpm_gen = RPMGenerator()
+    fault_gen = FaultGenerator()
+
+    batch = []
+    timestamp = start
+    for i in range(rows):
+        ts = timestamp.isoformat() # ISO format and UTC timezone
+
+        # Same frame order as simulate.generate_data(): PTO, RPM, then optional fault
+        pto_engaged = pto_state.next_state()
+        pto_data, _ = pto_state.simulate_pto_hex()
+        batch.append((ts, vehicle_id, '0x18FEF100', pto_data))
+        batch.append((ts, vehicle_id, '0x0CF00400', rpm_gen.get_next(pto_engaged)))
+
+        fault_data = fault_gen.maybe_emit_fault()
+        if fault_data:
+            batch.append((ts, vehicle_id, '0x18FECA00', fault_data))
+
+        timestamp += timedelta(seconds=1) # Increment timestamp by 1 second
+
+    writer.writerows(batch) # One buffered write per vehicle
+
+# Worker entry point: simulate a shard of vehicles into the worker's own CSV file
+def simulate_shard(worker, vehicle_ids, rows, start, out_dir, seed=None, vectorized=False):
+    path = os.path.join(out_dir, f"telemetry_w{worker:02d}.csv")
+    shard_start = time.perf_counter()
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['timestamp', 'vehicle_id', 'can_id', 'data']) # Header row
+
+        for vehicle_id in vehicle_ids:
+            if vectorized:
+                # Per-vehicle generator seeded from the fleet seed so shards stay reproducible
+                rng = np.random.default_rng(None if seed is None else [seed, vehicle_id])
+                for chunk in generate_chunks(rng, rows, start, vehicle_id=vehicle_id):
+                    f.write(chunk)
+            else:
+                if seed is not None:
+                    random.seed(seed * 1_000_003 + vehicle_id) # Per-vehicle seed independent of shard layout
+                simulate_vehicle(writer, vehicle_id, rows, start)
+
+    return path, len(vehicle_ids), time.perf_counter() - shard_start
+
+# Split vehicle ids into contiguous shards, one per worker
+def shard_vehicles(vehicles, workers):
+    ids = list(range(1, vehicles + 1))
+    size = -(-len(ids) // workers) # Ceiling division
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+# Simulate a fleet of vehicles in parallel, writing one CSV file per worker
+def simulate_fleet(vehicles=500, rows=3600, workers=None, out_dir="data/fleet", seed=None, vectorized=False, start=None):
+    workers = workers or os.cpu_count() or 1
+    start = start or datetime.now(timezone.utc) # Shared start time so vehicles line up
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards = shard_vehicles(vehicles, workers)
+    run_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+        futures = [
+            pool.submit(simulate_shard, worker, ids, rows, start, out_dir, seed, vectorized)
+            for worker, ids in enumerate(shards)
+        ]
+        results = [future.result() for future in futures]
+
+    elapsed = time.perf_counter() - run_start
+    print(f"Simulated {vehicles} vehicles x {rows} s on {len(shards)} workers in {elapsed:.1f} s")
+    return [path for path, _, _ in results]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a fleet of J1939 vehicles across a process pool")
+    parser.add_argument("--vehicles", type=int, default=500, help="Number of vehicles in the fleet")
+    parser.add_argument("--rows", type=int, default=3600, help="Number of seconds to simulate per vehicle")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--out-dir", default="data/fleet", help="Directory for per-worker CSV files")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible output")
+    parser.add_argument("--vectorized", action="store_true", help="Use the array-based generator per vehicle")
+    args = parser.parse_args()
+
+    simulate_fleet(args.vehicles, args.rows, args.workers, args.out_dir, args.seed, args.vectorized)
@@ -1,8 +1,16 @@
-import sqlite3
+import argparse
 import random
 import time
 from datetime import datetime, timezone
 
+from database import connect, pack_payload, RPM_CAN_ID, PTO_CAN_ID, FAULT_CAN_ID
+from ingest import ingest_frames
+from simulate import eec1_hex, ccvs1_hex, dm1_hex
+from retention import Retention
+from archive import default_root
+from livebuffer import LiveBuffer, DEFAULT_CAPACITY
+from metrics import COMMIT_SECONDS, INGEST_RATE, db_size_gauge, serve
+
 # Generate realistic RPM hex data based on PTO state 
 class RPMGenerator:
     def __init__(self):
@@ -19,8 +27,7 @@ class RPMGenerator:
         else:
             self.current_rpm = target
 
-        scaled = int(self.current_rpm * 4) # Match the hex_to_rpm scaling (÷4)
-        return f"{scaled:04X}" + "0000" # 4-digit hex + 4 zeroes
+        return eec1_hex(self.current_rpm) # EEC1 engine speed
 
 # PTO state machine for realistic engagement patterns
 class PTOStateMachine:
@@ -36,8 +43,7 @@ class PTOStateMachine:
         return self.pto_on
 
     def simulate_pto_hex(self):
-        prefix = "01" if self.pto_on else "00" # PTO engaged vs. not engaged format
-        return prefix + ''.join(random.choices('0123456789ABCDEF', k=6)), self.pto_on # Pad to 8 chars
+        return ccvs1_hex(self.pto_on), self.pto_on # CCVS1 PTO state
 
 # Simulate a generic fault code in hex format based on SAE J1939 specification
 VALID_SPNS = [100, 190, 723, 84, 91, 108, 639, 110, 111]
@@ -56,17 +62,19 @@ RELEVANT_FMIS = {
 class FaultGenerator:
     def __init__(self):
         self.active = False
+        self.dtc = None # DM1 payload of the active fault, repeated for the whole burst
         self.timer = random.randint(60, 90)  # Initial fault timer (1-1.5 minutes)
 
     def simulate_fault_hex(self):
         spn = random.choice(VALID_SPNS)  # SPN (Suspect Parameter Number)
         fmi = random.choice(RELEVANT_FMIS[spn])    # FMI (Failure Mode Identifier)
-        return f"{spn:04X}{fmi:02X}00"   # SPN(4 hex) + FMI(2 hex) + pad to 8 chars
+        return dm1_hex(spn, fmi) # DM1 with one active DTC
 
     def maybe_emit_fault(self):
         if self.timer <= 0:
             if not self.active:
                 self.active = True
+                self.dtc = self.simulate_fault_hex() # One SPN/FMI per burst, rebroadcast like a real DM1
                 self.timer = random.randint(5, 30)  # Emit fault for 5-30 seconds
             else:
                 self.active = False
@@ -75,26 +83,92 @@ class FaultGenerator:
             self.timer -= 1 # Decrement timer
 
         if self.active:
-            return self.simulate_fault_hex() # Emit fault code
+            return self.dtc # Emit fault code
         return None
 
 # Ensure the database and telemetry table exist (main.py not used with this loop simulator)
 def ensure_db(db_path="db/telemetry.db"):
-    conn = sqlite3.connect(db_path) # Connect to SQLite database
-    cur = conn.cursor() # Create a cursor object to execute SQL commands
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS telemetry (
-            id INTEGER PRIMARY KEY,
-            timestamp TEXT,
-            can_id TEXT,
-            data TEXT
-        )
-    ''') # Create and format table if it doesn't exist
-    conn.commit()
-    return conn
+    return connect(db_path) # Connect to SQLite database and create the typed schema if needed
+
+# Broadcast periods (ms) per PGN in high-rate mode: EEC1 engine speed every 10 ms,
+# PTO status every 100 ms, fault codes every second while a fault is active
+HIGH_RATE_PERIODS_MS = {PTO_CAN_ID: 100, RPM_CAN_ID: 10, FAULT_CAN_ID: 1000}
+
+# Drift-free scheduler: occurrence k of a task is due at start + k * period, so sleep jitter and slow
+# iterations never accumulate; late occurrences are all returned (with their scheduled times) to catch up
+class Schedule:
+    def __init__(self, periods, start):
+        self.periods = periods # task -> period in seconds (dict order breaks ties)
+        self.start = start
+        self.counts = {task: 0 for task in periods}
+
+    def next_due(self):
+        return min(self.start + self.counts[task] * period for task, period in self.periods.items())
+
+    # Pop every occurrence due at or before now, ordered by (due time, task order)
+    def pop_due(self, now):
+        due = []
+        for order, (task, period) in enumerate(self.periods.items()):
+            while self.start + self.counts[task] * period <= now:
+                due.append((self.start + self.counts[task] * period, order, task))
+                self.counts[task] += 1
+        return [(task, at) for at, _, task in sorted(due)]
+
+# Buffers frames and commits every flush_frames frames or flush_ms milliseconds, whichever comes first;
+# runs the retention policy after each commit and keeps throughput counters for reporting.
+# live: optional shared-memory LiveBuffer that receives the decoded samples of each flush
+class BufferedWriter:
+    def __init__(self, conn, flush_frames=1000, flush_ms=250, retention=None, live=None):
+        self.conn = conn
+        self.live = live
+        self.flush_frames = flush_frames
+        self.flush_ms = flush_ms
+        self.retention = retention
+        self.frames = []
+        self.first_at = None
+        self.written = 0
+        self.commits = 0
+
+    # Time (perf_counter) by which the buffer must be flushed, or None if it's empty
+    def deadline(self):
+        return None if self.first_at is None else self.first_at + self.flush_ms / 1000
+
+    def add(self, frames, now):
+        if frames and self.first_at is None:
+            self.first_at = now
+        self.frames.extend(frames)
+        if len(self.frames) >= self.flush_frames or (self.first_at is not None and now >= self.deadline()):
+            self.flush()
+
+    # Ingest and commit the buffered frames. If ingest or commit is interrupted (e.g. Ctrl+C), the transaction is
+    # rolled back and the frames go back into the buffer, so a later flush writes them once in a new transaction.
+    def flush(self):
+        frames, self.frames = self.frames, []
+        if frames:
+            try:
+                ingest_frames(self.conn, frames, self.live, source="simulator") # Raw frames plus decoded signal rows
+                with COMMIT_SECONDS.time(source="simulator"):
+                    self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                self.frames = frames + self.frames
+                raise
+            self.written += len(frames)
+            self.commits += 1
+        self.first_at = None
+        if self.retention:
+            self.retention.maybe_prune(self.conn)
 
 # Simulate a continuous loop generating telemetry data every 1s
-def simulate_loop(interval=1.0):
+# Vehicle state (PTO, RPM target, faults) advances every interval seconds; each PGN is broadcast on its own
+# period (periods_ms, default: once per interval) and frames are committed by a BufferedWriter.
+# retention: Retention policy for old rows (default: keep the last hour, pruned once a minute)
+# report_every: print achieved frames/s every N seconds (None = quiet)
+# live_capacity: also publish decoded samples to a shared-memory live buffer of this many samples for the dashboard
+def simulate_loop(interval=1.0, retention=None, periods_ms=None, flush_frames=1, flush_ms=0, report_every=None,
+                  live_capacity=None):
+    retention = retention or Retention()
+    periods_ms = periods_ms or {can_id: interval * 1000 for can_id in HIGH_RATE_PERIODS_MS}
     
     # Name assignment for each class
     pto_state = PTOStateMachine()
@@ -102,48 +176,99 @@ def simulate_loop(interval=1.0):
     fault_gen = FaultGenerator()
 
     conn = ensure_db()
-    cur = conn.cursor()
+    live = None
+    if live_capacity:
+        live = LiveBuffer.create(capacity=live_capacity)
+        live.seed(conn) # Start with the newest samples already in the database
+    writer = BufferedWriter(conn, flush_frames, flush_ms, retention, live)
+
+    start = time.perf_counter()
+    start_ms = int(datetime.now(timezone.utc).timestamp() * 1000) # Epoch milliseconds (UTC) at start
+    schedule = Schedule({"state": interval, **{can_id: period / 1000 for can_id, period in periods_ms.items()}}, start)
+    last_report, last_written, lag = start, 0, 0.0
 
     try:
         while True:
-            ts = datetime.now(timezone.utc).isoformat() # ISO format and UTC timezone
-            
-            # Simulate PTO data first so RPM will correlate as intended
-            pto_engaged = pto_state.next_state()
-            pto_data, _ = pto_state.simulate_pto_hex()
-            
-            # Simulate RPM with PTO-aware logic
-            rpm_data = rpm_gen.get_next(pto_engaged)
-            
-            # Simulate error/fault code data
-            fault_data = fault_gen.maybe_emit_fault()
-
-            # Insert data into the database
-            # CAN IDs from standardized J1939 PGNs, also matching the simulate.py script
-            cur.execute("INSERT INTO telemetry (timestamp, can_id, data) VALUES (?, ?, ?)",
-                        (ts, '0x18FEF100', pto_data)) 
-            cur.execute("INSERT INTO telemetry (timestamp, can_id, data) VALUES (?, ?, ?)",
-                        (ts, '0x0CF00400', rpm_data)) 
-            if fault_data:
-                cur.execute("INSERT INTO telemetry (timestamp, can_id, data) VALUES (?, ?, ?)",
-                            (ts, '0x0CFE6CEE', fault_data))
-
-            conn.commit()
-
-            # Limit to last 3600 entries (1 hour) to ensure adequate performance
-            cur.execute('''
-                DELETE FROM telemetry WHERE id NOT IN (
-                    SELECT id FROM telemetry ORDER BY timestamp DESC LIMIT 3600
-                )
-            ''')
-
-            conn.commit()
-            time.sleep(interval)
+            now = time.perf_counter()
+            wake = schedule.next_due()
+            if writer.deadline() is not None:
+                wake = min(wake, writer.deadline())
+            if wake > now:
+                time.sleep(wake - now)
+                now = time.perf_counter()
+
+            frames = []
+            for task, due in schedule.pop_due(now):
+                ts = start_ms + round((due - start) * 1000) # Scheduled time, not wall time after sleep jitter
+                lag = max(lag, now - due)
+                if task == "state":
+                    # Simulate PTO data first so RPM will correlate as intended
+                    pto_engaged = pto_state.next_state()
+                    # Simulate RPM with PTO-aware logic
+                    rpm_payload = pack_payload(rpm_gen.get_next(pto_engaged))
+                    # Simulate error/fault code data
+                    fault_data = fault_gen.maybe_emit_fault()
+                    fault_payload = pack_payload(fault_data) if fault_data else None
+                # CAN IDs from standardized J1939 PGNs, also matching the simulate.py script
+                elif task == PTO_CAN_ID:
+                    pto_data, _ = pto_state.simulate_pto_hex()
+                    frames.append((ts, PTO_CAN_ID, pack_payload(pto_data), None))
+                elif task == RPM_CAN_ID:
+                    frames.append((ts, RPM_CAN_ID, rpm_payload, None))
+                elif task == FAULT_CAN_ID and fault_payload:
+                    frames.append((ts, FAULT_CAN_ID, fault_payload, None))
+            writer.add(frames, now) # Insert data into the database (commits per flush_frames/flush_ms)
+
+            if now - last_report >= (report_every or 5): # The frames/s metric is updated every 5 s when quiet
+                rate = (writer.written - last_written) / (now - last_report)
+                INGEST_RATE.set(rate, source="simulator")
+                if report_every:
+                    print(f"{rate:,.0f} frames/s, {writer.commits} commits total, max lag {lag * 1000:.1f} ms", flush=True)
+                last_report, last_written, lag = now, writer.written, 0.0
 
     except KeyboardInterrupt:
         print("Stopped simulation.") # Exit loop message in the event of Ctrl+C
     finally:
+        writer.flush()
         conn.close()
+        if live is not None:
+            live.close() # Removes the segment; the dashboard falls back to SQLite
 
 if __name__ == "__main__":
-    simulate_loop()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generate live telemetry into the database")
+    parser.add_argument("-interval", "--interval", type=float, default=1.0, help="Seconds between vehicle state updates (and frames, unless --high-rate)")
+    parser.add_argument("--high-rate", action="store_true", help="Broadcast each PGN at J1939 rates (EEC1 10 ms, PTO 100 ms, faults 1 s) with buffered commits")
+    parser.add_argument("--rpm-period-ms", type=float, default=None, help="EEC1 (RPM) broadcast period")
+    parser.add_argument("--pto-period-ms", type=float, default=None, help="PTO broadcast period")
+    parser.add_argument("--fault-period-ms", type=float, default=None, help="Fault broadcast period while a fault is active")
+    parser.add_argument("--flush-frames", type=int, default=None, help="Commit after this many buffered frames (default: 1000 in high-rate mode, every tick otherwise)")
+    parser.add_argument("--flush-ms", type=float, default=None, help="Commit buffered frames at least this often (default: 250 in high-rate mode)")
+    parser.add_argument("--report-every", type=float, default=None, help="Print frames/s every N seconds (default: 5 in high-rate mode)")
+    parser.add_argument("--retention-age", type=float, default=3600, help="Keep frames newer than this many seconds (0 = no age limit)")
+    parser.add_argument("--retention-rows", type=int, default=None, help="Keep at most this many of the newest frames")
+    parser.add_argument("--prune-every", type=float, default=60, help="Seconds between retention runs")
+    parser.add_argument("--archive", action="store_true", help="Move pruned frames to telemetry_archive instead of deleting them")
+    parser.add_argument("--live-buffer", action="store_true", help="Publish decoded samples to a shared-memory ring buffer read by the dashboard's live charts")
+    parser.add_argument("--live-capacity", type=int, default=DEFAULT_CAPACITY, help="Samples kept in the live buffer")
+    parser.add_argument("--parquet-archive", action="store_true", help="Move aged frames to the Parquet archive (db/telemetry_archive) instead of deleting them")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve ingest metrics in Prometheus text format on this port")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        db_size_gauge(lambda: "db/telemetry.db")
+        serve(args.metrics_port)
+
+    periods_ms = dict(HIGH_RATE_PERIODS_MS) if args.high_rate else {can_id: args.interval * 1000 for can_id in HIGH_RATE_PERIODS_MS}
+    for can_id, period in ((RPM_CAN_ID, args.rpm_period_ms), (PTO_CAN_ID, args.pto_period_ms), (FAULT_CAN_ID, args.fault_period_ms)):
+        if period is not None:
+            periods_ms[can_id] = period
+    defaults = (1000, 250, 5) if args.high_rate else (1, 0, None)
+    flush_frames, flush_ms, report_every = (default if value is None else value for value, default in
+                                            zip((args.flush_frames, args.flush_ms, args.report_every), defaults))
+
+    simulate_loop(args.interval,
+                  Retention(max_age_sec=args.retention_age or None, max_rows=args.retention_rows,
+                            archive=args.archive, every_sec=args.prune_every,
+                            parquet_root=default_root("db/telemetry.db") if args.parquet_archive else None),
+                  periods_ms, flush_frames, flush_ms, report_every,
+                  args.live_capacity if args.live_buffer else None)
@@ -0,0 +1,127 @@
+import argparse
+import multiprocessing as mp
+import os
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+from database import connect, pack_payload, RPM_CAN_ID, PTO_CAN_ID
+from ingest import ingest_frames
+from rollups import range_totals
+from simulate import eec1_hex, ccvs1_hex
+
+# Concurrency check for the shared database layer: one writer inserting frames at a high rate while
+# several reader processes run dashboard/API-style queries; reports throughput, latency and lock errors.
+# --legacy uses plain sqlite3.connect in rollback-journal mode (the old behaviour) for comparison.
+
+# Open a connection the way the app does (WAL + busy timeout) or the old way
+def open_db(db_path, legacy):
+    if not legacy:
+        return connect(db_path)
+    return sqlite3.connect(db_path, timeout=0.1) # Short timeout so lock contention shows up as errors
+
+# "database is locked"/"busy" errors are counted; anything else is a real failure
+def is_lock_error(error):
+    return "locked" in str(error) or "busy" in str(error)
+
+# Insert RPM/PTO frame pairs in batches of batch_size per commit for the given duration
+def writer(db_path, legacy, seconds, batch_size, rate, results):
+    conn = open_db(db_path, legacy)
+    frames_written, errors, latencies = 0, 0, []
+    interval = batch_size / rate if rate else 0
+    next_commit = time.perf_counter()
+    end = time.perf_counter() + seconds
+    ts = int(time.time() * 1000)
+    while time.perf_counter() < end:
+        frames = []
+        for _ in range(batch_size // 2):
+            ts += 10
+            frames.append((ts, RPM_CAN_ID, pack_payload(eec1_hex(random.randint(800, 2800))), None))
+            frames.append((ts, PTO_CAN_ID, pack_payload(ccvs1_hex(random.random() < 0.5)), None))
+        start = time.perf_counter()
+        try:
+            ingest_frames(conn, frames)
+            conn.commit()
+            frames_written += len(frames)
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            conn.rollback()
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+        if interval:
+            next_commit += interval
+            time.sleep(max(0.0, next_commit - time.perf_counter()))
+    conn.close()
+    results.put(("writer", frames_written, errors, latencies))
+
+# Run a mix of recent-window reads and range stats for the given duration
+def reader(db_path, legacy, seconds, results):
+    conn = open_db(db_path, legacy)
+    queries, errors, latencies = 0, 0, []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        try:
+            if random.random() < 0.5:
+                conn.execute("SELECT timestamp, rpm FROM rpm_samples ORDER BY timestamp DESC LIMIT 1000").fetchall()
+            else:
+                now = int(time.time() * 1000)
+                range_totals(conn, now - 3_600_000, now + 3_600_000)
+            queries += 1
+        except sqlite3.OperationalError as e:
+            if not is_lock_error(e):
+                raise
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+    results.put(("reader", queries, errors, latencies))
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 2) if latencies else None
+
+def run(db_path, readers=4, seconds=10, batch_size=100, rate=0, legacy=False):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    conn = connect(db_path) # Create the schema before the processes start
+    if legacy:
+        conn.execute("PRAGMA journal_mode = DELETE") # Back to the default rollback journal
+    conn.close()
+
+    results = mp.Queue()
+    processes = [mp.Process(target=writer, args=(db_path, legacy, seconds, batch_size, rate, results))]
+    processes += [mp.Process(target=reader, args=(db_path, legacy, seconds, results)) for _ in range(readers)]
+    for p in processes:
+        p.start()
+    outcomes = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+
+    mode = "legacy rollback journal" if legacy else "WAL + busy timeout"
+    print(f"{mode}: 1 writer, {readers} readers, {seconds}s")
+    for role in ("writer", "reader"):
+        rows = [o for o in outcomes if o[0] == role]
+        count = sum(o[1] for o in rows)
+        errors = sum(o[2] for o in rows)
+        latencies = [l for o in rows for l in o[3]]
+        unit = "frames" if role == "writer" else "queries"
+        print(f"  {role}s: {count / seconds:,.0f} {unit}/s, {errors} lock errors, "
+              f"latency p50 {percentile_ms(latencies, 50)} ms / p99 {percentile_ms(latencies, 99)} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stress the telemetry database with one writer and several readers")
+    parser.add_argument("--db", default="db/stress.db", help="Scratch SQLite database (deleted first)")
+    parser.add_argument("--readers", type=int, default=4, help="Number of reader processes")
+    parser.add_argument("--seconds", type=float, default=10, help="Test duration")
+    parser.add_argument("--batch-size", type=int, default=100, help="Frames per writer commit")
+    parser.add_argument("--rate", type=float, default=0, help="Target writer frames/s (0 = as fast as possible)")
+    parser.add_argument("--legacy", action="store_true", help="Use the old rollback-journal connections for comparison")
+    args = parser.parse_args()
+
+    db_dir = os.path.dirname(args.db)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    run(args.db, args.readers, args.seconds, args.batch_size, args.rate, args.legacy)